@@ -155,6 +155,9 @@ def generate_safe_exception_message(operation_name, excep):
     except exception.NoDataToProcess:
         reason = u._("No information provided to process")
         status = 400
+    except exception.InvalidMarker:
+        reason = u._("Provided paging marker could not be found")
+        status = 400
     except exception.LimitExceeded:
         reason = u._("Provided information too large "
                      "to process")
@@ -86,8 +86,11 @@ class PecanAPI(pecan.Pecan):
         if len(parts) > 1:
             first_path = parts[1]
 
-        # Route to the special performance controller
+        # Route to the special performance controller, which also reports
+        # the database connection pool gauges at /<performance_uri>/db_pool
         if first_path == self.performance_uri:
+            if len(parts) > 2 and parts[2] == 'db_pool':
+                return self.performance_controller.db_pool, []
             return self.performance_controller.index, []
 
         controller, remainder = super(PecanAPI, self).route(req, node, path)
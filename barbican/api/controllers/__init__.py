@@ -110,6 +110,19 @@ def handle_exceptions(operation_name=u._('System')):
     return exceptions_decorator
 
 
+def is_total_requested(params):
+    """Checks if a list request wants the total number of entities counted.
+
+    Totals are included in list responses unless the 'total' query parameter
+    is 'false', as counting every entity of a large project is costly. Lists
+    paged by marker are spared the count unless 'total' is 'true', so that
+    walking them costs the same on every page.
+    """
+    if params.get('marker'):
+        return params.get('total', 'false').lower() == 'true'
+    return params.get('total', 'true').lower() != 'false'
+
+
 def _do_enforce_content_types(pecan_req, valid_content_types):
     """Content type enforcement
 
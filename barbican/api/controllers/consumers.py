@@ -95,17 +95,25 @@ class ContainerConsumersController(object):
         except exception.NotFound:
             controllers.containers.container_not_found()
 
+        marker = kw.get('marker')
+        with_total = controllers.is_total_requested(kw)
         result = self.consumer_repo.get_by_container_id(
             self.container_id,
             offset_arg=kw.get('offset', 0),
             limit_arg=kw.get('limit', None),
+            marker_arg=marker,
+            with_total=with_total,
             suppress_exception=True
         )
 
         consumers, offset, limit, total = result
+        # Lists paged by marker also hold the first consumer of the next page.
+        has_next = bool(marker) and len(consumers) > limit
+        if has_next:
+            consumers = consumers[:limit]
 
         if not consumers:
-            resp_ctrs_overall = {'consumers': [], 'total': total}
+            resp_ctrs_overall = {'consumers': []}
         else:
             resp_ctrs = [
                 hrefs.convert_to_hrefs(c.to_dict_fields())
@@ -116,8 +124,12 @@ class ContainerConsumersController(object):
                 offset,
                 limit,
                 total,
-                {'consumers': resp_ctrs}
+                {'consumers': resp_ctrs},
+                marker=consumers[-1].id if marker else None,
+                has_next=has_next
             )
+
+        if with_total:
             resp_ctrs_overall.update({'total': total})
 
         return resp_ctrs_overall
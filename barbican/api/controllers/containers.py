@@ -125,17 +125,25 @@ class ContainersController(object):
     def on_get(self, project_id, **kw):
         LOG.debug('Start containers on_get for project-ID %s:', project_id)
 
+        marker = kw.get('marker')
+        with_total = controllers.is_total_requested(kw)
         result = self.container_repo.get_by_create_date(
             project_id,
             offset_arg=kw.get('offset', 0),
             limit_arg=kw.get('limit', None),
+            marker_arg=marker,
+            with_total=with_total,
             suppress_exception=True
         )
 
         containers, offset, limit, total = result
+        # Lists paged by marker also hold the first container of the next page.
+        has_next = bool(marker) and len(containers) > limit
+        if has_next:
+            containers = containers[:limit]
 
         if not containers:
-            resp_ctrs_overall = {'containers': [], 'total': total}
+            resp_ctrs_overall = {'containers': []}
         else:
             resp_ctrs = [
                 hrefs.convert_to_hrefs(c.to_dict_fields())
@@ -151,8 +159,12 @@ class ContainersController(object):
                 offset,
                 limit,
                 total,
-                {'containers': resp_ctrs}
+                {'containers': resp_ctrs},
+                marker=containers[-1].id if marker else None,
+                has_next=has_next
             )
+
+        if with_total:
             resp_ctrs_overall.update({'total': total})
 
         return resp_ctrs_overall
@@ -172,13 +184,14 @@ class ContainersController(object):
         new_container = models.Container(data)
         new_container.project_id = project.id
 
-        # TODO(hgedikli): performance optimizations
+        secrets = self.secret_repo.get_many(
+            [secret_ref.secret_id
+             for secret_ref in new_container.container_secrets],
+            external_project_id)
+        secret_ids = set(secret.id for secret in secrets)
+
         for secret_ref in new_container.container_secrets:
-            secret = self.secret_repo.get(
-                entity_id=secret_ref.secret_id,
-                external_project_id=external_project_id,
-                suppress_exception=True)
-            if not secret:
+            if secret_ref.secret_id not in secret_ids:
                 # This only partially localizes the error message and
                 # doesn't localize secret_ref.name.
                 pecan.abort(
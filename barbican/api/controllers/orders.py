@@ -161,22 +161,31 @@ class OrdersController(object):
         LOG.debug('Start orders on_get '
                   'for project-ID %s:', external_project_id)
 
+        marker = kw.get('marker')
+        with_total = controllers.is_total_requested(kw)
         result = self.order_repo.get_by_create_date(
             external_project_id, offset_arg=kw.get('offset', 0),
-            limit_arg=kw.get('limit', None), suppress_exception=True)
+            limit_arg=kw.get('limit', None), marker_arg=marker,
+            with_total=with_total, suppress_exception=True)
         orders, offset, limit, total = result
+        # Lists paged by marker also hold the first order of the next page.
+        has_next = bool(marker) and len(orders) > limit
+        if has_next:
+            orders = orders[:limit]
 
         if not orders:
-            orders_resp_overall = {'orders': [],
-                                   'total': total}
+            orders_resp_overall = {'orders': []}
         else:
             orders_resp = [
                 hrefs.convert_to_hrefs(o.to_dict_fields())
                 for o in orders
             ]
-            orders_resp_overall = hrefs.add_nav_hrefs('orders',
-                                                      offset, limit, total,
-                                                      {'orders': orders_resp})
+            orders_resp_overall = hrefs.add_nav_hrefs(
+                'orders', offset, limit, total, {'orders': orders_resp},
+                marker=orders[-1].id if marker else None,
+                has_next=has_next)
+
+        if with_total:
             orders_resp_overall.update({'total': total})
 
         return orders_resp_overall
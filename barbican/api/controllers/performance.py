@@ -13,6 +13,7 @@
 import pecan
 
 from barbican.common import utils
+from barbican.model import repositories
 
 LOG = utils.getLogger(__name__)
 
@@ -25,3 +26,7 @@ class PerformanceController(object):
     @pecan.expose()
     def index(self):
         return '42'
+
+    @pecan.expose('json')
+    def db_pool(self):
+        return repositories.get_pool_stats()
@@ -266,10 +266,14 @@ class SecretsController(object):
             # the default should be used.
             bits = 0
 
+        marker = kw.get('marker')
+        with_total = controllers.is_total_requested(kw)
         result = self.repos.secret_repo.get_by_create_date(
             external_project_id,
             offset_arg=kw.get('offset', 0),
             limit_arg=kw.get('limit', None),
+            marker_arg=marker,
+            with_total=with_total,
             name=name,
             alg=kw.get('alg'),
             mode=kw.get('mode'),
@@ -278,10 +282,13 @@ class SecretsController(object):
         )
 
         secrets, offset, limit, total = result
+        # Lists paged by marker also hold the first secret of the next page.
+        has_next = bool(marker) and len(secrets) > limit
+        if has_next:
+            secrets = secrets[:limit]
 
         if not secrets:
-            secrets_resp_overall = {'secrets': [],
-                                    'total': total}
+            secrets_resp_overall = {'secrets': []}
         else:
             secrets_resp = [
                 hrefs.convert_to_hrefs(secret_fields(s))
@@ -289,8 +296,12 @@ class SecretsController(object):
             ]
             secrets_resp_overall = hrefs.add_nav_hrefs(
                 'secrets', offset, limit, total,
-                {'secrets': secrets_resp}
+                {'secrets': secrets_resp},
+                marker=secrets[-1].id if marker else None,
+                has_next=has_next
             )
+
+        if with_total:
             secrets_resp_overall.update({'total': total})
 
         return secrets_resp_overall
@@ -170,6 +170,10 @@ class InvalidFilterRangeValue(Invalid):
     message = u._("Unable to filter using the specified range.")
 
 
+class InvalidMarker(Invalid):
+    message = u._("Paging marker '%(marker)s' could not be found.")
+
+
 class ReadonlyProperty(Forbidden):
     message = u._("Attribute '%(property)s' is read-only.")
 
@@ -84,6 +84,17 @@ def convert_list_to_href(resources_name, offset, limit):
     return utils.hostname_for_refs(resource=resource)
 
 
+def convert_marker_list_to_href(resources_name, marker, limit):
+    """Supports pretty output of marker-paged list hrefs.
+
+    Convert the marker/limit info to a HATEOS-style href
+    suitable for use in a list navigation paging interface.
+    """
+    resource = '{0}?limit={1}&marker={2}'.format(resources_name, limit,
+                                                 marker)
+    return utils.hostname_for_refs(resource=resource)
+
+
 def previous_href(resources_name, offset, limit):
     """Supports pretty output of previous-page hrefs.
 
@@ -107,20 +118,42 @@ def next_href(resources_name, offset, limit):
 
 
 def add_nav_hrefs(resources_name, offset, limit,
-                  total_elements, data):
+                  total_elements, data, marker=None, has_next=False):
     """Adds next and/or previous hrefs to paged list responses.
 
+    If a marker is provided the list is being paged by marker rather than by
+    offset. The next href then pages from that marker, and is only added if
+    has_next says that more elements follow it, as neither the total nor a
+    full page tells. Such lists can only be walked forwards, so no previous
+    href is added. Otherwise, if the total number of elements is not known,
+    a next href is added whenever the current page is full.
+
     :param resources_name: Name of api resource
     :param offset: Element number (ie. index) where current page starts
     :param limit: Max amount of elements listed on current page
-    :param num_elements: Total number of elements
+    :param num_elements: Total number of elements, or None if not counted
+    :param marker: Id of the last element on the current page, for lists
+                   paged by marker
+    :param has_next: Whether more elements follow the marker
     :returns: augmented dictionary with next and/or previous hrefs
     """
+    if marker:
+        if has_next:
+            data.update({'next': convert_marker_list_to_href(resources_name,
+                                                             marker,
+                                                             limit)})
+        return data
+
+    if total_elements is None:
+        has_next = len(data.get(resources_name, [])) >= limit
+    else:
+        has_next = total_elements > (offset + limit)
+
     if offset > 0:
         data.update({'previous': previous_href(resources_name,
                                                offset,
                                                limit)})
-    if total_elements > (offset + limit):
+    if has_next:
         data.update({'next': next_href(resources_name,
                                        offset,
                                        limit)})
@@ -16,27 +16,82 @@
 """
 Shared business logic.
 """
+from oslo_config import cfg
+
 from barbican.common import utils
+from barbican import i18n as u
 from barbican.model import models
 
 
 LOG = utils.getLogger(__name__)
 
+project_cache_opts = [
+    cfg.IntOpt('project_cache_ttl', default=3600,
+               help=u._('Seconds for which the internal id of a project is '
+                        'cached per external project id, sparing a project '
+                        'lookup on each request. Set to 0 to disable the '
+                        'cache.')),
+    cfg.IntOpt('project_cache_size', default=10000,
+               help=u._('Maximum number of projects cached by each '
+                        'process.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(project_cache_opts)
+
+_PROJECT_CACHE = None
+
+
+class ProjectCache(utils.TimedLRUCache):
+    """Least recently used cache of internal project ids by external id.
+
+    Projects are never updated once created, so only their ids are cached,
+    for 'project_cache_ttl' seconds, and at most 'project_cache_size' of
+    them. Entries are invalidated when their project is deleted in Keystone.
+    """
+
+    def __init__(self):
+        super(ProjectCache, self).__init__('project_cache_ttl',
+                                           'project_cache_size')
+
+
+def get_project_cache():
+    """Returns the singleton project cache instance."""
+    global _PROJECT_CACHE
+    if not _PROJECT_CACHE:
+        _PROJECT_CACHE = ProjectCache()
+    return _PROJECT_CACHE
+
 
 def get_or_create_project(project_id, project_repo):
     """Returns project with matching project_id.
 
-    Creates it if it does not exist.
+    Creates it if it does not exist, even should concurrent requests try to
+    create it as well. Projects found in the project cache are returned as
+    new, detached, model instances holding only the project's id, external
+    id and status.
     :param project_id: The external-to-Barbican ID for this project.
     :param project_repo: Project repository.
     :return: Project model instance
     """
-    project = project_repo.find_by_external_project_id(project_id,
-                                                       suppress_exception=True)
-    if not project:
-        LOG.debug('Creating project for %s', project_id)
+    project_cache = get_project_cache()
+    cached_id = project_cache.get(project_id)
+    if cached_id:
         project = models.Project()
+        project.id = cached_id
         project.external_id = project_id
         project.status = models.States.ACTIVE
-        project_repo.create_from(project)
+        return project
+
+    project = project_repo.find_by_external_project_id(project_id,
+                                                       suppress_exception=True)
+    if project:
+        project_cache.add(project_id, project.id)
+    else:
+        # Projects are created within the request's transaction, which may
+        # yet be rolled back, so they are only cached once found by a later
+        # request.
+        LOG.debug('Creating project for %s', project_id)
+        project = project_repo.create_by_external_project_id(project_id)
+
     return project
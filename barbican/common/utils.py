@@ -17,6 +17,8 @@
 Common utilities for Barbican.
 """
 
+import collections
+import threading
 import time
 import uuid
 
@@ -158,5 +160,56 @@ class TimeKeeper(object):
                                                    total_elapsed * 1000.))
 
 
+class TimedLRUCache(object):
+    """Least recently used cache whose entries expire after a while.
+
+    The TTL in seconds and the maximum number of entries are read from the
+    given configuration options, of the given option group if any, on each
+    addition, a TTL of 0 or less disabling the cache.
+    """
+
+    def __init__(self, ttl_option, size_option, group=None):
+        self._ttl_option = ttl_option
+        self._size_option = size_option
+        self._group = group
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value, or None if not cached."""
+        with self._lock:
+            cached = self._entries.pop(key, None)
+            if not cached or cached[1] <= time.time():
+                return None
+            self._entries[key] = cached
+            return cached[0]
+
+    def add(self, key, value):
+        conf = CONF[self._group] if self._group else CONF
+        ttl = conf[self._ttl_option]
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= conf[self._size_option]:
+                self._entries.popitem(last=False)
+            self._entries[key] = (value, time.time() + ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_matching(self, predicate):
+        """Invalidates the entries whose keys match the predicate."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 def generate_uuid():
     return str(uuid.uuid4())
@@ -0,0 +1,22 @@
+"""Add index on secrets for the expiration sweeper
+
+Revision ID: 1bc885808c76
+Revises: 3d36a26b88af
+Create Date: 2015-02-19 14:32:51.318405
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1bc885808c76'
+down_revision = '3d36a26b88af'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_secrets_deleted_expiration', 'secrets',
+                    ['deleted', 'expiration'])
+
+
+def downgrade():
+    op.drop_index('ix_secrets_deleted_expiration', 'secrets')
@@ -0,0 +1,46 @@
+"""Add composite indexes for repository queries
+
+Revision ID: 3d36a26b88af
+Revises: 9fbf15e57805
+Create Date: 2015-02-12 10:21:08.624130
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d36a26b88af'
+down_revision = '9fbf15e57805'
+
+from alembic import op
+
+
+# (index name, table name, columns), in the order they are created.
+INDEXES = [
+    ('ix_secrets_project_deleted_created', 'secrets',
+     ['project_id', 'deleted', 'created_at', 'id']),
+    ('ix_orders_project_deleted_created', 'orders',
+     ['project_id', 'deleted', 'created_at', 'id']),
+    ('ix_containers_project_deleted_created', 'containers',
+     ['project_id', 'deleted', 'created_at', 'id']),
+    ('ix_container_consumer_metadata_container_deleted_name',
+     'container_consumer_metadata',
+     ['container_id', 'deleted', 'name', 'id']),
+    ('ix_secret_store_metadata_secret_deleted', 'secret_store_metadata',
+     ['secret_id', 'deleted']),
+    ('ix_order_plugin_metadata_order_deleted', 'order_plugin_metadata',
+     ['order_id', 'deleted']),
+    ('ix_encrypted_data_secret_id', 'encrypted_data', ['secret_id']),
+    ('ix_kek_data_project_plugin_active', 'kek_data',
+     ['project_id', 'plugin_name', 'active', 'deleted']),
+    ('ix_transport_keys_plugin_deleted_created', 'transport_keys',
+     ['plugin_name', 'deleted', 'created_at']),
+]
+
+
+def upgrade():
+    for name, table_name, columns in INDEXES:
+        op.create_index(name, table_name, columns)
+
+
+def downgrade():
+    for name, table_name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name)
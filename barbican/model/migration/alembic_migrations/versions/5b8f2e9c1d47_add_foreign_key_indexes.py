@@ -0,0 +1,37 @@
+"""Add indexes on the foreign key columns lacking one
+
+Revision ID: 5b8f2e9c1d47
+Revises: 92a3d967e26a
+Create Date: 2015-02-26 09:47:15.204867
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b8f2e9c1d47'
+down_revision = '92a3d967e26a'
+
+from alembic import op
+
+
+# (index name, table name, columns), in the order they are created. The
+# 'purge' command of barbican-db-manage looks these columns up to tell
+# whether a deleted row is still referenced. MySQL indexes foreign keys on
+# its own, but PostgreSQL does not.
+INDEXES = [
+    ('ix_project_secret_secret_id', 'project_secret', ['secret_id']),
+    ('ix_container_secret_secret_id', 'container_secret', ['secret_id']),
+    ('ix_encrypted_data_kek_id', 'encrypted_data', ['kek_id']),
+    ('ix_orders_secret_id', 'orders', ['secret_id']),
+    ('ix_orders_container_id', 'orders', ['container_id']),
+    ('ix_order_retry_tasks_order_id', 'order_retry_tasks', ['order_id']),
+]
+
+
+def upgrade():
+    for name, table_name, columns in INDEXES:
+        op.create_index(name, table_name, columns)
+
+
+def downgrade():
+    for name, table_name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name)
@@ -0,0 +1,27 @@
+"""Add binary cypher text column to encrypted data
+
+Revision ID: 92a3d967e26a
+Revises: 1bc885808c76
+Create Date: 2015-02-23 10:12:37.584311
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '92a3d967e26a'
+down_revision = '1bc885808c76'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Only adds the column, which is quick whatever the size of the table.
+    # The existing encrypted data are then moved over to it by the 'backfill'
+    # command of barbican-db-manage, while Barbican keeps running.
+    op.add_column('encrypted_data',
+                  sa.Column('binary_cypher_text', sa.LargeBinary(),
+                            nullable=True))
+
+
+def downgrade():
+    op.drop_column('encrypted_data', 'binary_cypher_text')
@@ -0,0 +1,66 @@
+"""Add project_id to secrets
+
+Revision ID: 9fbf15e57805
+Revises: aa2cf96a1d5
+Create Date: 2015-02-10 14:02:37.381546
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9fbf15e57805'
+down_revision = 'aa2cf96a1d5'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import column
+from sqlalchemy.sql import table
+
+
+# Number of secrets whose project_id is backfilled per UPDATE statement.
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('secrets', sa.Column('project_id', sa.String(length=36),
+                                       nullable=True))
+    op.create_foreign_key('secrets_project_fk', 'secrets', 'projects',
+                          ['project_id'], ['id'])
+
+    backfill_project_ids(op.get_bind())
+
+
+def downgrade():
+    op.drop_constraint('secrets_project_fk', 'secrets', type_='foreignkey')
+    op.drop_column('secrets', 'project_id')
+
+
+def backfill_project_ids(bind, batch_size=BACKFILL_BATCH_SIZE):
+    """Copies each secret's owning project over from project_secret.
+
+    Secrets are updated in batches, keeping each UPDATE statement small.
+    The batches all run within the migration's transaction though, so on
+    databases with transactional DDL, such as PostgreSQL, the updated rows
+    stay locked until the whole migration is committed.
+    """
+    secrets = table('secrets',
+                    column('id'),
+                    column('project_id'))
+    project_secret = table('project_secret',
+                           column('secret_id'),
+                           column('project_id'))
+
+    pending_query = sa.select([secrets.c.id]).select_from(
+        secrets.join(project_secret,
+                     secrets.c.id == project_secret.c.secret_id)
+    ).where(secrets.c.project_id == None).limit(batch_size)
+
+    owner_query = sa.select([project_secret.c.project_id]).where(
+        project_secret.c.secret_id == secrets.c.id).limit(1).as_scalar()
+
+    while True:
+        secret_ids = [row[0] for row in bind.execute(pending_query)]
+        if not secret_ids:
+            break
+
+        bind.execute(secrets.update().where(
+            secrets.c.id.in_(secret_ids)).values(project_id=owner_query))
@@ -105,16 +105,24 @@ class ModelBase(object):
     status = sa.Column(sa.String(20), nullable=False, default=States.PENDING)
 
     def save(self, session=None):
-        """Save this object."""
+        """Save this object.
+
+        The object is flushed to the database right away, unless flushes are
+        being deferred via repositories.deferred_flush().
+        """
         # import api here to prevent circular dependency problem
         import barbican.model.repositories
         session = session or barbican.model.repositories.get_session()
         # if model is being created ensure that created/updated are the same
         if self.id is None:
+            # Assign the id now rather than on flush, so that it can be
+            # referenced before the object is flushed.
+            self.id = utils.generate_uuid()
             self.created_at = timeutils.utcnow()
             self.updated_at = self.created_at
         session.add(self)
-        session.flush()
+        if not barbican.model.repositories.is_flush_deferred(session):
+            session.flush()
 
     def delete(self, session=None):
         """Delete this object."""
@@ -212,8 +220,11 @@ class ProjectSecret(BASE, ModelBase):
     secret_id = sa.Column(
         sa.String(36), sa.ForeignKey('secrets.id'), primary_key=True)
 
-    __table_args__ = (sa.UniqueConstraint(
-        'project_id', 'secret_id', name='_project_secret_uc'),)
+    __table_args__ = (
+        sa.UniqueConstraint('project_id', 'secret_id',
+                            name='_project_secret_uc'),
+        sa.Index('ix_project_secret_secret_id', 'secret_id'),
+    )
 
 
 class ContainerSecret(BASE, ModelBase):
@@ -233,8 +244,11 @@ class ContainerSecret(BASE, ModelBase):
     secrets = orm.relationship(
         'Secret', backref=orm.backref('container_secrets'))
 
-    __table_args__ = (sa.UniqueConstraint('container_id', 'secret_id', 'name',
-                                          name='_container_secret_name_uc'),)
+    __table_args__ = (
+        sa.UniqueConstraint('container_id', 'secret_id', 'name',
+                            name='_container_secret_name_uc'),
+        sa.Index('ix_container_secret_secret_id', 'secret_id'),
+    )
 
 
 class Project(BASE, ModelBase):
@@ -276,12 +290,13 @@ class Secret(BASE, ModelBase):
     bit_length = sa.Column(sa.Integer)
     mode = sa.Column(sa.String(255))
 
-    # TODO(jwood): Performance - Consider avoiding full load of all
-    #   datum attributes here. This is only being done to support the
-    #   building of the list of supported content types when secret
-    #   metadata is retrieved.
-    #   See barbican.api.resources.py::SecretsResource.on_get()
-    # Eager load this relationship via 'lazy=False'.
+    # Owning project, denormalized from the ProjectSecret association so that
+    # secrets can be resolved for a project without the many-to-many join.
+    project_id = sa.Column(sa.String(36), sa.ForeignKey('projects.id'),
+                           nullable=True)
+
+    # Eager load this relationship via 'lazy=False'. Secret listings opt out
+    #   of this load, see SecretRepo.get_by_create_date().
     encrypted_data = orm.relationship("EncryptedDatum", lazy=False)
 
     secret_store_metadata = orm.relationship(
@@ -290,6 +305,12 @@ class Secret(BASE, ModelBase):
         backref="secret",
         cascade="all, delete-orphan")
 
+    __table_args__ = (
+        sa.Index('ix_secrets_project_deleted_created',
+                 'project_id', 'deleted', 'created_at', 'id'),
+        sa.Index('ix_secrets_deleted_expiration', 'deleted', 'expiration'),
+    )
+
     def __init__(self, parsed_request=None):
         """Creates secret from a dict."""
         super(Secret, self).__init__()
@@ -313,6 +334,9 @@ class Secret(BASE, ModelBase):
         for datum in self.encrypted_data:
             datum.delete(session)
 
+        for project_assoc in self.project_assocs:
+            project_assoc.delete(session)
+
         for secret_ref in self.container_secrets:
             session.delete(secret_ref)
 
@@ -343,6 +367,11 @@ class SecretStoreMetadatum(BASE, ModelBase):
     secret_id = sa.Column(
         sa.String(36), sa.ForeignKey('secrets.id'), nullable=False)
 
+    __table_args__ = (
+        sa.Index('ix_secret_store_metadata_secret_deleted',
+                 'secret_id', 'deleted'),
+    )
+
     def __init__(self, key, value):
         super(SecretStoreMetadatum, self).__init__()
 
@@ -376,13 +405,21 @@ class EncryptedDatum(BASE, ModelBase):
     kek_id = sa.Column(
         sa.String(36), sa.ForeignKey('kek_data.id'), nullable=False)
 
-    # TODO(jwood) Why LargeBinary on Postgres (BYTEA) not work correctly?
+    # Encrypted data used to be stored base64 encoded in cypher_text, and is
+    # now stored as is in binary_cypher_text. Data stored the former way are
+    # moved over by the 'backfill' command of barbican-db-manage.
     cypher_text = sa.Column(sa.Text)
+    binary_cypher_text = sa.Column(sa.LargeBinary)
     kek_meta_extended = sa.Column(sa.Text)
 
     # Eager load this relationship via 'lazy=False'.
     kek_meta_project = orm.relationship("KEKDatum", lazy=False)
 
+    __table_args__ = (
+        sa.Index('ix_encrypted_data_secret_id', 'secret_id'),
+        sa.Index('ix_encrypted_data_kek_id', 'kek_id'),
+    )
+
     def __init__(self, secret=None, kek_datum=None):
         """Creates encrypted datum from a secret and KEK metadata."""
         super(EncryptedDatum, self).__init__()
@@ -440,6 +477,11 @@ class KEKDatum(BASE, ModelBase):
     mode = sa.Column(sa.String(255))
     plugin_meta = sa.Column(sa.Text)
 
+    __table_args__ = (
+        sa.Index('ix_kek_data_project_plugin_active',
+                 'project_id', 'plugin_name', 'active', 'deleted'),
+    )
+
     def _do_extra_dict_fields(self):
         """Sub-class hook method: return dict of fields."""
         return {'algorithm': self.algorithm}
@@ -478,6 +520,13 @@ class Order(BASE, ModelBase):
         backref="order",
         cascade="all, delete-orphan")
 
+    __table_args__ = (
+        sa.Index('ix_orders_project_deleted_created',
+                 'project_id', 'deleted', 'created_at', 'id'),
+        sa.Index('ix_orders_secret_id', 'secret_id'),
+        sa.Index('ix_orders_container_id', 'container_id'),
+    )
+
     def __init__(self, parsed_request=None):
             """Creates a Order entity from a dict."""
             super(Order, self).__init__()
@@ -530,6 +579,11 @@ class OrderPluginMetadatum(BASE, ModelBase):
     key = sa.Column(sa.String(255), nullable=False)
     value = sa.Column(sa.String(255), nullable=False)
 
+    __table_args__ = (
+        sa.Index('ix_order_plugin_metadata_order_deleted',
+                 'order_id', 'deleted'),
+    )
+
     def __init__(self, key, value):
         super(OrderPluginMetadatum, self).__init__()
 
@@ -553,7 +607,10 @@ class OrderPluginMetadatum(BASE, ModelBase):
 class OrderRetryTask(BASE):
 
     __tablename__ = "order_retry_tasks"
-    __table_args__ = {"mysql_engine": "InnoDB"}
+    __table_args__ = (
+        sa.Index('ix_order_retry_tasks_order_id', 'order_id'),
+        {"mysql_engine": "InnoDB"},
+    )
     __table_initialized__ = False
 
     id = sa.Column(
@@ -590,6 +647,11 @@ class Container(BASE, ModelBase):
                            nullable=False)
     consumers = sa.orm.relationship("ContainerConsumerMetadatum")
 
+    __table_args__ = (
+        sa.Index('ix_containers_project_deleted_created',
+                 'project_id', 'deleted', 'created_at', 'id'),
+    )
+
     def __init__(self, parsed_request=None):
         """Creates a Container entity from a dict."""
         super(Container, self).__init__()
@@ -659,7 +721,9 @@ class ContainerConsumerMetadatum(BASE, ModelBase):
     __table_args__ = (
         sa.UniqueConstraint('data_hash',
                             name='_consumer_hashed_container_name_url_uc'),
-        sa.Index('values_index', 'container_id', 'name', 'URL')
+        sa.Index('values_index', 'container_id', 'name', 'URL'),
+        sa.Index('ix_container_consumer_metadata_container_deleted_name',
+                 'container_id', 'deleted', 'name', 'id')
     )
 
     def __init__(self, container_id, parsed_request):
@@ -694,6 +758,11 @@ class TransportKey(BASE, ModelBase):
     plugin_name = sa.Column(sa.String(255), nullable=False)
     transport_key = sa.Column(sa.Text, nullable=False)
 
+    __table_args__ = (
+        sa.Index('ix_transport_keys_plugin_deleted_created',
+                 'plugin_name', 'deleted', 'created_at'),
+    )
+
     def __init__(self, plugin_name, transport_key):
         """Creates transport key entity ."""
         super(TransportKey, self).__init__()
@@ -844,8 +913,11 @@ class ProjectCertificateAuthority(BASE, ModelBase):
 
     ca = orm.relationship("CertificateAuthority", backref="project_cas")
 
-    __table_args__ = (sa.UniqueConstraint(
-        'project_id', 'ca_id', name='_project_certificate_authority_uc'),)
+    __table_args__ = (
+        sa.UniqueConstraint('project_id', 'ca_id',
+                            name='_project_certificate_authority_uc'),
+        sa.Index('ix_project_certificate_authorities_ca_id', 'ca_id'),
+    )
 
     def __init__(self, project_id, ca_id):
         """Registers a Consumer to a Container."""
@@ -894,6 +966,10 @@ class PreferredCertificateAuthority(BASE, ModelBase):
     ca = orm.relationship('CertificateAuthority',
                           backref=orm.backref('preferred_ca'))
 
+    __table_args__ = (
+        sa.Index('ix_preferred_certificate_authorities_ca_id', 'ca_id'),
+    )
+
     def __init__(self, project_id, ca_id):
         """Registers a Consumer to a Container."""
         super(PreferredCertificateAuthority, self).__init__()
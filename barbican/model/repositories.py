@@ -20,12 +20,18 @@ TODO: The top part of this file was 'borrowed' from Glance, but seems
 quite intense for sqlalchemy, and maybe could be simplified.
 """
 
+import base64
+import collections
+import contextlib
+import datetime
 import logging
+import threading
 import time
 import uuid
 
 from oslo_config import cfg
 import sqlalchemy
+from sqlalchemy import and_
 from sqlalchemy import or_
 import sqlalchemy.orm as sa_orm
 
@@ -40,6 +46,7 @@ LOG = utils.getLogger(__name__)
 
 
 _ENGINE = None
+_READ_ENGINE = None
 _MAKER = None
 BASE = models.BASE
 sa_logger = None
@@ -51,6 +58,15 @@ _PROJECT_SECRET_REPOSITORY = None
 _ENCRYPTED_DATUM_REPOSITORY = None
 _KEK_DATUM_REPOSITORY = None
 
+# Short-lived cache of list totals, see TotalCountCache below.
+_TOTAL_COUNT_CACHE = None
+
+# Cache of bound and active KEK data, see KEKDatumCache below.
+_KEK_DATUM_CACHE = None
+
+# Per-thread sessions whose flushes are deferred, see deferred_flush() below.
+_DEFERRED_FLUSHES = threading.local()
+
 
 db_opts = [
     cfg.IntOpt('sql_idle_timeout', default=3600),
@@ -58,8 +74,18 @@ db_opts = [
     cfg.IntOpt('sql_retry_interval', default=1),
     cfg.BoolOpt('db_auto_create', default=True),
     cfg.StrOpt('sql_connection'),
+    cfg.StrOpt('sql_connection_read'),
+    cfg.IntOpt('sql_pool_size'),
+    cfg.IntOpt('sql_pool_max_overflow'),
+    cfg.IntOpt('sql_pool_timeout'),
+    cfg.BoolOpt('sql_pool_pre_ping', default=True),
     cfg.IntOpt('max_limit_paging', default=100),
     cfg.IntOpt('default_limit_paging', default=10),
+    cfg.IntOpt('list_total_cache_ttl', default=10),
+    cfg.IntOpt('list_total_cache_size', default=1000),
+    cfg.IntOpt('kek_cache_ttl', default=300),
+    cfg.IntOpt('kek_cache_size', default=10000),
+    cfg.IntOpt('project_cleanup_batch_size', default=1000),
 ]
 
 CONF = cfg.CONF
@@ -67,13 +93,21 @@ CONF.register_opts(db_opts)
 CONF.import_opt('debug', 'barbican.openstack.common.log')
 
 
+# Session.info key flagging sessions that may read from the read engine.
+_READ_ONLY_KEY = 'barbican_read_only'
+
+
 def hard_reset():
     """Performs a hard reset of database resources, used for unit testing."""
-    global _ENGINE, _MAKER
+    global _ENGINE, _READ_ENGINE, _MAKER
     if _ENGINE:
         _ENGINE.dispose()
+    if _READ_ENGINE:
+        _READ_ENGINE.dispose()
     _ENGINE = None
+    _READ_ENGINE = None
     _MAKER = None
+    get_total_count_cache().clear()
 
 
 def start():
@@ -90,10 +124,14 @@ def start_read_only():
     """Start database and establish a read-only connection to it.
 
     Typically performed at the start of a request cycle, say for GET or HEAD
-    requests.
+    requests. If a separate 'sql_connection_read' is configured, the
+    session's queries are sent to it until the session first writes, after
+    which the session sticks to the read/write connection.
     """
-    # TODO(john-wood-w) Add optional, separate engine/connection for reads.
-    start()
+    configure_db()
+    session = get_session()
+    if get_read_engine():
+        session.info[_READ_ONLY_KEY] = True
 
 
 def commit():
@@ -121,11 +159,55 @@ def clear():
     _MAKER.remove()
 
 
+@contextlib.contextmanager
+def deferred_flush():
+    """Defers flushing the entities saved within the block to its end.
+
+    Saving an entity normally flushes it to the database right away, costing
+    a round trip per entity. Within this block saved entities are only added
+    to their session, to be flushed together in one unit of work when the
+    block exits without error, or earlier should a query need them
+    (autoflush). Entity ids are assigned on save, so they can be referenced
+    before the entities are flushed.
+
+    Note that errors such as duplicate entities are then only raised as the
+    block exits, rather than by the repository call that saved them.
+    """
+    if getattr(_DEFERRED_FLUSHES, 'sessions', None) is not None:
+        # Nested in an outer block, which flushes on exit.
+        yield
+        return
+
+    _DEFERRED_FLUSHES.sessions = []
+    try:
+        yield
+        sessions = _DEFERRED_FLUSHES.sessions
+    finally:
+        _DEFERRED_FLUSHES.sessions = None
+
+    for session in sessions:
+        session.flush()
+
+
+def is_flush_deferred(session):
+    """Returns True if flushing session is deferred by deferred_flush().
+
+    The session is then flushed at the end of the deferred_flush() block.
+    """
+    sessions = getattr(_DEFERRED_FLUSHES, 'sessions', None)
+    if sessions is None:
+        return False
+    if session not in sessions:
+        sessions.append(session)
+    return True
+
+
 def setup_db_env():
     """Setup configuration for database."""
     global sa_logger
 
     LOG.debug("Sql connection = %s", CONF.sql_connection)
+    LOG.debug("Sql read connection = %s", CONF.sql_connection_read)
     sa_logger = logging.getLogger('sqlalchemy.engine')
     if CONF.debug:
         sa_logger.setLevel(logging.DEBUG)
@@ -139,6 +221,7 @@ def configure_db():
     """
     setup_db_env()
     get_engine()
+    get_read_engine()
 
 
 def get_session():
@@ -160,6 +243,16 @@ def get_engine():
     return _ENGINE
 
 
+def get_read_engine():
+    """Return the SQLAlchemy engine for reads, or None if not configured."""
+    """May assign _READ_ENGINE if not already assigned"""
+    global _READ_ENGINE
+    if not _READ_ENGINE and CONF.sql_connection_read:
+        _READ_ENGINE = _connect_engine(CONF.sql_connection_read,
+                                       'sql_connection_read')
+    return _READ_ENGINE
+
+
 def _get_engine(engine):
     if not engine:
         connection = CONF.sql_connection
@@ -167,22 +260,7 @@ def _get_engine(engine):
             raise exception.BarbicanException(
                 u._('No SQL connection configured'))
 
-    # TODO(jfwood):
-    # connection_dict = sqlalchemy.engine.url.make_url(_CONNECTION)
-
-        engine_args = {
-            'pool_recycle': CONF.sql_idle_timeout,
-            'echo': False,
-            'convert_unicode': True}
-
-        try:
-            engine = _create_engine(connection, **engine_args)
-            engine.connect()
-        except Exception as err:
-            msg = u._("Error configuring registry database with supplied "
-                      "sql_connection. Got error: {error}").format(error=err)
-            LOG.exception(msg)
-            raise exception.BarbicanException(msg)
+        engine = _connect_engine(connection, 'sql_connection')
 
         if CONF.db_auto_create:
             meta = sqlalchemy.MetaData()
@@ -196,6 +274,59 @@ def _get_engine(engine):
     return engine
 
 
+def _connect_engine(connection, option_name):
+    """Creates an engine, with its own pool, and checks it can connect."""
+
+    # TODO(jfwood):
+    # connection_dict = sqlalchemy.engine.url.make_url(_CONNECTION)
+
+    engine_args = {
+        'pool_recycle': CONF.sql_idle_timeout,
+        'echo': False,
+        'convert_unicode': True}
+
+    # Only pass pool sizing along if configured, as not every pool class
+    # (such as SQLite's) accepts these arguments.
+    pool_args = {
+        'pool_size': CONF.sql_pool_size,
+        'max_overflow': CONF.sql_pool_max_overflow,
+        'pool_timeout': CONF.sql_pool_timeout}
+    engine_args.update((name, value) for name, value in pool_args.items()
+                       if value is not None)
+
+    try:
+        engine = _create_engine(connection, **engine_args)
+        engine.connect()
+    except Exception as err:
+        msg = u._("Error configuring registry database with supplied "
+                  "{option}. Got error: {error}").format(option=option_name,
+                                                         error=err)
+        LOG.exception(msg)
+        raise exception.BarbicanException(msg)
+
+    return engine
+
+
+class RoutingSession(sa_orm.Session):
+    """Session that can send the queries of read-only requests elsewhere.
+
+    Sessions flagged as read-only by start_read_only() are bound to the read
+    engine. As soon as such a session flushes, or executes an INSERT, UPDATE
+    or DELETE statement, it falls back to the read/write engine for the rest
+    of its life, so that the request goes on to read its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(
+                clause, sqlalchemy.sql.expression.UpdateBase):
+            self.info.pop(_READ_ONLY_KEY, None)
+
+        if self.info.get(_READ_ONLY_KEY) and _READ_ENGINE:
+            return _READ_ENGINE
+        return super(RoutingSession, self).get_bind(mapper=mapper,
+                                                    clause=clause)
+
+
 def get_maker():
     """Return a SQLAlchemy sessionmaker."""
     """May assign __MAKER if not already assigned"""
@@ -205,19 +336,94 @@ def get_maker():
         # Utilize SQLAlchemy's scoped_session to ensure that we only have one
         #   session instance per thread.
         _MAKER = sqlalchemy.orm.scoped_session(
-            sa_orm.sessionmaker(bind=_ENGINE))
+            sa_orm.sessionmaker(bind=_ENGINE, class_=RoutingSession))
     return _MAKER
 
 
-def is_db_connection_error(args):
-    """Return True if error in connecting to db."""
-    # NOTE(adam_g): This is currently MySQL specific and needs to be extended
-    #               to support Postgres and others.
-    conn_err_codes = ('2002', '2003', '2006')
-    for err_code in conn_err_codes:
-        if args.find(err_code) != -1:
-            return True
-    return False
+class PoolStats(object):
+    """Gauges for the connection pool of an engine.
+
+    Tracks the connections checked out of the pool, and how long callers
+    waited to check them out, including the checkouts that timed out.
+    """
+
+    def __init__(self, engine):
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+        # Sessions check connections out via connect(), whereas
+        # Engine.connect() uses unique_connection().
+        engine.pool.connect = self._timed(engine.pool.connect)
+        engine.pool.unique_connection = self._timed(
+            engine.pool.unique_connection)
+        sqlalchemy.event.listen(engine, 'checkout', self._on_checkout)
+        sqlalchemy.event.listen(engine, 'checkin', self._on_checkin)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_wait_total': self.checkout_wait_total,
+                'checkout_wait_max': self.checkout_wait_max,
+            }
+
+    def _timed(self, checkout):
+        def _checkout():
+            start = time.time()
+            timed_out = False
+            try:
+                return checkout()
+            except sqlalchemy.exc.TimeoutError:
+                timed_out = True
+                raise
+            finally:
+                self._record_wait(time.time() - start, timed_out)
+        return _checkout
+
+    def _record_wait(self, wait, timed_out):
+        with self._lock:
+            self.checkout_timeouts += int(timed_out)
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def _on_checkout(self, dbapi_connection, connection_record,
+                     connection_proxy):
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+
+def get_pool_stats():
+    """Returns the connection pool gauges of the engines in use, by name."""
+    engines = (('primary', _ENGINE), ('read', _READ_ENGINE))
+    return dict((name, engine.pool_stats.as_dict())
+                for name, engine in engines if engine)
+
+
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Checks that a connection is alive as it is checked out of the pool.
+
+    Raising DisconnectionError has the pool discard the connection and retry
+    the checkout with a fresh one, so stale connections (say those dropped by
+    the database server) are never handed out.
+    """
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception as err:
+        LOG.warning(u._LW('Discarding stale database connection: %s'), err)
+        raise sqlalchemy.exc.DisconnectionError(err)
 
 
 def _create_engine(connection, **engine_args):
@@ -225,9 +431,12 @@ def _create_engine(connection, **engine_args):
 
     engine = sqlalchemy.create_engine(connection, **engine_args)
 
-    # TODO(jfwood): if 'mysql' in connection_dict.drivername:
-    # TODO(jfwood): sqlalchemy.event.listen(_ENGINE, 'checkout',
-    # TODO(jfwood):                         ping_listener)
+    if CONF.sql_pool_pre_ping:
+        sqlalchemy.event.listen(engine, 'checkout', _ping_connection)
+
+    # Registered after the ping above, so that only live connections are
+    # counted as checked out.
+    engine.pool_stats = PoolStats(engine)
 
     # Wrap the engine's connect method with a retry decorator.
     engine.connect = wrap_db_error(engine.connect)
@@ -250,30 +459,23 @@ def _auto_generate_tables(engine, tables):
 
 
 def wrap_db_error(f):
-    """Retry DB connection. Copied from nova and modified."""
-    def _wrap(*args, **kwargs):
-        try:
-            return f(*args, **kwargs)
-        except sqlalchemy.exc.OperationalError as e:
-            if not is_db_connection_error(e.args[0]):
-                raise
+    """Retry DB connection. Copied from nova and modified.
 
-            remaining_attempts = CONF.sql_max_retries
-            while True:
+    The wrapped function establishes a connection, so any OperationalError
+    it raises is taken as a failure to connect, whatever the database.
+    """
+    def _wrap(*args, **kwargs):
+        remaining_attempts = CONF.sql_max_retries
+        while True:
+            try:
+                return f(*args, **kwargs)
+            except sqlalchemy.exc.OperationalError:
+                if remaining_attempts <= 0:
+                    raise
                 LOG.warning(u._LW('SQL connection failed. %d attempts left.'),
                             remaining_attempts)
                 remaining_attempts -= 1
                 time.sleep(CONF.sql_retry_interval)
-                try:
-                    return f(*args, **kwargs)
-                except sqlalchemy.exc.OperationalError as e:
-                    if (remaining_attempts <= 0 or not
-                            is_db_connection_error(e.args[0])):
-                        raise
-                except sqlalchemy.exc.DBAPIError:
-                    raise
-        except sqlalchemy.exc.DBAPIError:
-            raise
     _wrap.func_name = f.func_name
     return _wrap
 
@@ -306,12 +508,129 @@ def clean_paging_values(offset_arg=0, limit_arg=CONF.default_limit_paging):
     return offset, limit
 
 
+def filter_by_marker(query, model, sort_column, marker_id):
+    """Restricts a paged list query to the entities following a marker.
+
+    Listings are ordered by (sort_column, id), so the page following the
+    marker entity is found via a range condition on that pair rather than by
+    scanning and discarding every earlier row as an OFFSET would. The marker
+    entity is looked up with the list query itself, so that only entities
+    the caller may list, such as live entities of its own project, are
+    accepted as markers.
+
+    :param query: The list query, already ordered by (sort_column, id).
+    :param model: The model class being listed.
+    :param sort_column: The model column the listing is ordered by.
+    :param marker_id: Id of the last entity seen on the previous page.
+    :returns: The query, restricted to entities after the marker.
+    :raises InvalidMarker: if the list query has no entity with the marker's
+                           id.
+    """
+    marker = query.with_entities(sort_column).filter(
+        model.id == marker_id).first()
+    if marker is None:
+        raise exception.InvalidMarker(marker=marker_id)
+
+    marker_value = marker[0]
+    return query.filter(or_(sort_column > marker_value,
+                            and_(sort_column == marker_value,
+                                 model.id > marker_id)))
+
+
+class TotalCountCache(utils.TimedLRUCache):
+    """Caches the total number of entities matched by list queries.
+
+    Counting every entity of a large project costs more than fetching the
+    page itself, so totals are remembered for 'list_total_cache_ttl' seconds
+    keyed by the entity type and the list filters. Totals served from this
+    cache may therefore lag behind the database by up to that many seconds.
+    A TTL of 0 disables caching.
+    """
+
+    def __init__(self):
+        super(TotalCountCache, self).__init__('list_total_cache_ttl',
+                                              'list_total_cache_size')
+
+    def get_total(self, key, query):
+        """Returns the total for the key, counting the query if needed."""
+        total = self.get(key)
+        if total is None:
+            total = query.count()
+            self.add(key, total)
+        return total
+
+
+def get_total_count_cache():
+    """Returns the singleton list total cache instance."""
+    global _TOTAL_COUNT_CACHE
+    if not _TOTAL_COUNT_CACHE:
+        _TOTAL_COUNT_CACHE = TotalCountCache()
+    return _TOTAL_COUNT_CACHE
+
+
+# Snapshot of a KEKDatum, safe to share between sessions and threads.
+CachedKEKDatum = collections.namedtuple('CachedKEKDatum', [
+    'id', 'project_id', 'plugin_name', 'kek_label', 'algorithm',
+    'bit_length', 'mode', 'plugin_meta'])
+
+
+class KEKDatumCache(utils.TimedLRUCache):
+    """Caches the bound and active KEK datum of projects, per plugin.
+
+    Secrets are encrypted with their project's active KEK datum, which only
+    changes when it is rotated or deactivated, so this spares looking the
+    KEK datum up for each new secret. KEK data are cached as CachedKEKDatum
+    snapshots for 'kek_cache_ttl' seconds, which bounds how long other
+    processes may keep using a KEK datum deactivated by this one.
+    """
+
+    def __init__(self):
+        super(KEKDatumCache, self).__init__('kek_cache_ttl',
+                                            'kek_cache_size')
+
+    def get_kek_datum(self, project_id, plugin_name):
+        """Returns the cached CachedKEKDatum, or None if not cached."""
+        return self.get((project_id, plugin_name))
+
+    def add_kek_datum(self, kek_datum):
+        """Caches a snapshot of the bound and active KEKDatum instance."""
+        if not kek_datum.bind_completed or not kek_datum.active:
+            return
+        self.add((kek_datum.project_id, kek_datum.plugin_name),
+                 CachedKEKDatum(*[getattr(kek_datum, field)
+                                  for field in CachedKEKDatum._fields]))
+
+    def invalidate_project(self, project_id):
+        """Invalidates the KEK data cached for a project, for all plugins."""
+        self.invalidate_matching(lambda key: key[0] == project_id)
+
+
+def get_kek_datum_cache():
+    """Returns the singleton KEK datum cache instance."""
+    global _KEK_DATUM_CACHE
+    if not _KEK_DATUM_CACHE:
+        _KEK_DATUM_CACHE = KEKDatumCache()
+    return _KEK_DATUM_CACHE
+
+
+def soft_delete_in_bulk(model, criterion, session):
+    """Soft deletes all entities of a model matching the given criterion.
+
+    This issues a single UPDATE statement, without loading the entities into
+    the session.
+    """
+    query = session.query(model).filter(criterion).filter_by(deleted=False)
+    query.update({'deleted': True, 'deleted_at': timeutils.utcnow()},
+                 synchronize_session=False)
+
+
 def delete_all_project_resources(project_id, repos):
     """Logic to cleanup all project resources.
 
-    This cleanup uses same alchemy session to perform all db operations as a
-    transaction and will commit only when all db operations are performed
-    without error.
+    Entities are soft deleted in batches, each batch being committed as it
+    is done so that no single transaction has to span the whole project. The
+    project itself is deleted last, so that if the cleanup fails part way
+    the project is left in place and its cleanup can be retried.
     """
     session = get_session()
 
@@ -323,12 +642,125 @@ def delete_all_project_resources(project_id, repos):
         project_id, suppress_exception=False, session=session)
     repos.kek_repo.delete_project_entities(
         project_id, suppress_exception=False, session=session)
+    get_kek_datum_cache().invalidate_project(project_id)
     repos.project_secret_repo.delete_project_entities(
         project_id, suppress_exception=False, session=session)
     repos.project_repo.delete_project_entities(
         project_id, suppress_exception=False, session=session)
 
 
+def _get_referencing_foreign_keys(table):
+    """Returns the foreign keys, of any table, that reference a table."""
+    return [fk for other_table in BASE.metadata.sorted_tables
+            for fk in other_table.foreign_keys
+            if fk.column.table is table]
+
+
+def purge_deleted(min_age_in_days, batch_size=1000, batch_pause=0.0,
+                  progress=None):
+    """Hard deletes entities that were soft deleted a while ago.
+
+    Rows soft deleted more than min_age_in_days days ago are deleted table
+    by table, children before their parents, so that no foreign key is
+    broken. Rows that are still referenced, such as a deleted secret that
+    a live order points to, are kept.
+
+    Each batch of at most batch_size rows is deleted in its own short
+    transaction, pausing batch_pause seconds between batches to throttle
+    the load put on the database by a purge running alongside live traffic.
+    The optional progress callable is called after each batch with the
+    table name and the number of rows purged from it so far.
+
+    :returns: dict of the number of rows purged, keyed by table name.
+    """
+    cutoff = timeutils.utcnow() - datetime.timedelta(days=min_age_in_days)
+    engine = get_engine()
+    purged = {}
+
+    # Tables are sorted parents first, so go through them in reverse.
+    for table in reversed(BASE.metadata.sorted_tables):
+        if 'deleted' not in table.c:
+            continue
+
+        criterion = and_(table.c.deleted == sqlalchemy.true(),
+                         table.c.deleted_at < cutoff)
+        for fk in _get_referencing_foreign_keys(table):
+            criterion = and_(criterion, ~sqlalchemy.exists().where(
+                fk.parent == fk.column))
+
+        select = sqlalchemy.select([table.c.id]).where(criterion)
+        select = select.limit(batch_size)
+
+        purged[table.name] = 0
+        while True:
+            with engine.begin() as connection:
+                ids = [row[0] for row in connection.execute(select)]
+                if ids:
+                    # Repeat the criterion, in case a reference to any of
+                    # these rows was added since they were selected.
+                    connection.execute(table.delete().where(
+                        and_(table.c.id.in_(ids), criterion)))
+
+            if not ids:
+                break
+
+            purged[table.name] += len(ids)
+            if progress:
+                progress(table.name, purged[table.name])
+
+            if len(ids) < batch_size:
+                break
+            time.sleep(batch_pause)
+
+    return purged
+
+
+def backfill_binary_cypher_text(batch_size=1000, batch_pause=0.0,
+                                progress=None):
+    """Moves encrypted data stored as base64 text to the binary column.
+
+    Each batch of at most batch_size encrypted data is converted in its own
+    short transaction, pausing batch_pause seconds between batches, so that
+    the backfill can run alongside live traffic. Encrypted data not
+    converted yet are still read from the text column meanwhile. The
+    optional progress callable is called after each batch with the number
+    of encrypted data converted so far.
+
+    :returns: the number of encrypted data converted.
+    """
+    table = models.EncryptedDatum.__table__
+    criterion = and_(table.c.binary_cypher_text == None,
+                     table.c.cypher_text != None)
+    select = sqlalchemy.select([table.c.id, table.c.cypher_text])
+    select = select.where(criterion).limit(batch_size)
+    update = table.update().where(
+        and_(table.c.id == sqlalchemy.bindparam('datum_id'), criterion))
+    update = update.values(
+        binary_cypher_text=sqlalchemy.bindparam('binary_cypher_text'),
+        cypher_text=None)
+    engine = get_engine()
+    converted = 0
+
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select).fetchall()
+            if rows:
+                connection.execute(update, [
+                    {'datum_id': datum_id,
+                     'binary_cypher_text': base64.b64decode(cypher_text)}
+                    for datum_id, cypher_text in rows])
+
+        converted += len(rows)
+        if rows and progress:
+            progress(converted)
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(batch_pause)
+
+    return converted
+
+
 class Repositories(object):
     """Convenient way to pass repositories around.
 
@@ -542,11 +974,23 @@ class BaseRepo(object):
         else:
             return []
 
+    def _do_delete_children_in_bulk(self, entity_ids, session):
+        """Sub-class hook: delete children of the entities with given ids.
+
+        Counterpart of the models' _do_delete_children(), for entities that
+        are soft deleted in bulk by delete_project_entities().
+        """
+        pass
+
     def delete_project_entities(self, project_id,
                                 suppress_exception=False,
                                 session=None):
         """Deletes entities for a given project.
 
+        Entities are soft deleted in batches of 'project_cleanup_batch_size'
+        by set-based UPDATE statements, rather than being loaded and deleted
+        one at a time. The session is committed after each batch.
+
         :param project_id: id of barbican project entity
         :param suppress_exception: Pass True if want to suppress exception
         :param session: existing db session reference. If None, gets session.
@@ -561,9 +1005,18 @@ class BaseRepo(object):
         try:
             # query cannot be None as related repo class is expected to
             # implement it otherwise error is raised in build query call
-            for entity in query:
-                # Its a soft delete so its more like entity update
-                entity.delete(session=session)
+            model = query.column_descriptions[0]['type']
+            id_query = query.filter_by(deleted=False).with_entities(
+                model.id).limit(CONF.project_cleanup_batch_size)
+
+            while True:
+                entity_ids = [row[0] for row in id_query]
+                if not entity_ids:
+                    break
+
+                self._do_delete_children_in_bulk(entity_ids, session)
+                soft_delete_in_bulk(model, model.id.in_(entity_ids), session)
+                session.commit()
         except sqlalchemy.exc.SQLAlchemyError:
             LOG.exception(u._LE('Problem finding project related entity to '
                                 'delete'))
@@ -607,6 +1060,52 @@ class ProjectRepo(BaseRepo):
 
         return entity
 
+    def create_by_external_project_id(self, external_project_id,
+                                      session=None):
+        """Creates the project with the given external id, and returns it.
+
+        Requests for a new project may race to create it, so the project is
+        inserted within a savepoint of the session's transaction. Should a
+        concurrent request have inserted it first, the unique external id
+        makes this insert fail, and the project that request inserted is
+        returned instead once it is committed.
+
+        Either way the project's row is then locked by updating it, as
+        KEKDatumRepo.find_or_create_kek_datum() does, so that requests
+        creating the project's KEK datum next do not have to upgrade a
+        shared lock on the row, and deadlock, to do so.
+        """
+        session = self.get_session(session)
+
+        # The project is selected again below, so the session must no longer
+        # read from a (possibly lagging) read-only database.
+        session.info.pop(_READ_ONLY_KEY, None)
+
+        projects = models.Project.__table__
+        now = timeutils.utcnow()
+        try:
+            with session.begin_nested():
+                session.execute(projects.insert().values(
+                    id=utils.generate_uuid(),
+                    external_id=external_project_id,
+                    status=models.States.ACTIVE,
+                    created_at=now,
+                    updated_at=now,
+                    deleted=False))
+        except sqlalchemy.exc.IntegrityError:
+            LOG.debug('Project for %s was created concurrently',
+                      external_project_id)
+
+        # Updating the row waits for the request that inserted it to commit,
+        # and makes the row visible to this transaction, even a REPEATABLE
+        # READ one that read the projects before.
+        session.execute(projects.update().where(
+            projects.c.external_id == external_project_id).values(
+                updated_at=now))
+
+        query = session.query(models.Project)
+        return query.filter_by(external_id=external_project_id).one()
+
     def _build_get_project_entities_query(self, project_id, session):
         """Builds query for retrieving project for given id."""
         query = session.query(models.Project)
@@ -618,28 +1117,30 @@ class SecretRepo(BaseRepo):
 
     def get_by_create_date(self, external_project_id, offset_arg=None,
                            limit_arg=None, name=None, alg=None, mode=None,
-                           bits=0, suppress_exception=False, session=None):
+                           bits=0, suppress_exception=False, session=None,
+                           marker_arg=None, with_total=True):
         """Returns a list of secrets
 
         The returned secrets are ordered by the date they were created at
-        and paged based on the offset and limit fields. The external_project_id
+        and paged based on the offset and limit fields, or on the marker and
+        limit fields if a marker is provided. The external_project_id
         is external-to-Barbican value assigned to the project by Keystone.
+        The total is None if with_total is False, sparing the count query.
+        If a marker is provided, up to limit + 1 secrets are returned, the
+        last one starting the next page.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
 
         session = self.get_session(session)
-        utcnow = timeutils.utcnow()
 
+        # Expired secrets are not filtered out here, as they are soft deleted
+        # by the worker's expiration sweeper, see
+        # barbican.tasks.expiration.SecretExpirationSweeper.
         query = session.query(models.Secret)
-        query = query.order_by(models.Secret.created_at)
+        query = query.order_by(models.Secret.created_at, models.Secret.id)
         query = query.filter_by(deleted=False)
 
-        # Note(john-wood-w): SQLAlchemy requires '== None' below,
-        #   not 'is None'.
-        query = query.filter(or_(models.Secret.expiration == None,
-                                 models.Secret.expiration > utcnow))
-
         if name:
             query = query.filter(models.Secret.name.like(name))
         if alg:
@@ -649,25 +1150,132 @@ class SecretRepo(BaseRepo):
         if bits > 0:
             query = query.filter(models.Secret.bit_length == bits)
 
-        query = query.join(models.ProjectSecret,
-                           models.Secret.project_assocs)
-        query = query.join(models.Project, models.ProjectSecret.projects)
+        query = query.join(models.Project,
+                           models.Secret.project_id == models.Project.id)
         query = query.filter(models.Project.external_id == external_project_id)
 
+        total = None
+        if with_total:
+            total_key = (self._do_entity_name(), external_project_id,
+                         name, alg, mode, bits)
+            total = get_total_count_cache().get_total(total_key, query)
+
+        if marker_arg:
+            query = filter_by_marker(query, models.Secret,
+                                     models.Secret.created_at,
+                                     marker_arg)
+            offset = 0
+
+        # Listed secrets are only serialized to their fields and content
+        # types, so skip the eager load of their encrypted data (and its KEK
+        # metadata), and load the secrets' metadata in one batched query.
+        query = query.options(
+            sa_orm.lazyload(models.Secret.encrypted_data),
+            sa_orm.subqueryload(models.Secret.secret_store_metadata))
+
         start = offset
         end = offset + limit
+        if marker_arg:
+            # Fetch the first entity of the next page too, if any, telling
+            # the caller whether there is a next page without a count.
+            end += 1
         LOG.debug('Retrieving from %s to %s', start, end)
-        total = query.count()
         entities = query[start:end]
         LOG.debug('Number entities retrieved: %s out of %s',
                   len(entities), total
                   )
 
-        if total <= 0 and not suppress_exception:
+        if not entities and not total and not suppress_exception:
             _raise_no_entities_found(self._do_entity_name())
 
         return entities, offset, limit, total
 
+    def get_many(self, entity_ids, external_project_id, session=None):
+        """Returns the secrets with the given ids, in a single query.
+
+        Ids of secrets that do not exist, or that are deleted, expired or
+        owned by another project than the one with the given
+        external_project_id, are left out of the returned list.
+        """
+        if not entity_ids:
+            return []
+
+        session = self.get_session(session)
+        utcnow = timeutils.utcnow()
+
+        # Note(john-wood-w): SQLAlchemy requires '== None' below,
+        #   not 'is None'.
+        query = session.query(models.Secret)
+        query = query.filter(models.Secret.id.in_(set(entity_ids)))
+        query = query.filter_by(deleted=False)
+        query = query.filter(or_(models.Secret.expiration == None,
+                                 models.Secret.expiration > utcnow))
+        query = query.join(models.Project,
+                           models.Secret.project_id == models.Project.id)
+        query = query.filter(models.Project.external_id == external_project_id)
+
+        # Callers resolve secret references, so leave the encrypted data to
+        # be loaded on demand.
+        query = query.options(sa_orm.lazyload(models.Secret.encrypted_data))
+
+        return query.all()
+
+    def get_expired(self, limit, marker=None, session=None):
+        """Returns up to limit secrets that have expired but are not deleted.
+
+        The secrets that expired first are returned first, ordered by
+        expiration and id. If given, marker is the (expiration, id) pair of
+        the last secret of the previous batch, and only the secrets after it
+        are returned. The secrets are not locked, see claim_expired().
+        """
+        session = self.get_session(session)
+
+        query = session.query(models.Secret)
+        query = query.filter_by(deleted=False)
+        query = query.filter(models.Secret.expiration <= timeutils.utcnow())
+        if marker:
+            marker_expiration, marker_id = marker
+            query = query.filter(or_(
+                models.Secret.expiration > marker_expiration,
+                and_(models.Secret.expiration == marker_expiration,
+                     models.Secret.id > marker_id)))
+        query = query.order_by(models.Secret.expiration, models.Secret.id)
+        query = query.options(sa_orm.lazyload(models.Secret.encrypted_data))
+
+        return query.limit(limit).all()
+
+    def claim_expired(self, secret_id, claimed_before, session=None):
+        """Claims an expired secret for deletion, returning True if claimed.
+
+        The claim is recorded as the secret's updated_at. An expired secret
+        can be claimed if it was not updated since it expired, or if its
+        last claim was made before claimed_before, so that concurrent sweeps
+        do not delete the same secret from its secret store, and a sweep
+        that failed to delete a secret does not hold on to it for good.
+        Deleted secrets and secrets that have not expired are not claimed.
+        """
+        session = self.get_session(session)
+        now = timeutils.utcnow()
+
+        query = session.query(models.Secret)
+        query = query.filter_by(id=secret_id, deleted=False)
+        query = query.filter(models.Secret.expiration <= now)
+        query = query.filter(
+            or_(models.Secret.updated_at <= models.Secret.expiration,
+                models.Secret.updated_at < claimed_before))
+
+        return query.update({'updated_at': now},
+                            synchronize_session=False) == 1
+
+    def delete_expired(self, secret_id, session=None):
+        """Soft deletes an expired secret, along with its children."""
+        session = self.get_session(session)
+
+        query = session.query(models.Secret)
+        secret = query.filter_by(id=secret_id, deleted=False).first()
+        if secret:
+            secret.delete(session=session)
+
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
         return "Secret"
@@ -678,15 +1286,17 @@ class SecretRepo(BaseRepo):
 
         # Note(john-wood-w): SQLAlchemy requires '== None' below,
         #   not 'is None'.
-        # TODO(jfwood): Performance? Is the many-to-many join needed?
         expiration_filter = or_(models.Secret.expiration == None,
                                 models.Secret.expiration > utcnow)
 
+        # The owning project is denormalized onto the secret, so the secret
+        # is resolved via its primary key and project_id, without joining
+        # through the ProjectSecret association.
         query = session.query(models.Secret)
         query = query.filter_by(id=entity_id, deleted=False)
         query = query.filter(expiration_filter)
-        query = query.join(models.ProjectSecret, models.Secret.project_assocs)
-        query = query.join(models.Project, models.ProjectSecret.projects)
+        query = query.join(models.Project,
+                           models.Secret.project_id == models.Project.id)
         query = query.filter(models.Project.external_id == external_project_id)
 
         return query
@@ -698,15 +1308,24 @@ class SecretRepo(BaseRepo):
     def _build_get_project_entities_query(self, project_id, session):
         """Builds query for retrieving Secrets associated with a given project
 
-        Discovery is done via a ProjectSecret association.
-
         :param project_id: id of barbican project entity
         :param session: existing db session reference.
         """
-        query = session.query(models.Secret).filter_by(deleted=False)
-        query = query.join(models.ProjectSecret, models.Secret.project_assocs)
-        query = query.filter(models.ProjectSecret.project_id == project_id)
-        return query
+        return session.query(models.Secret).filter_by(
+            project_id=project_id).filter_by(deleted=False)
+
+    def _do_delete_children_in_bulk(self, entity_ids, session):
+        """Sub-class hook: delete children of the entities with given ids."""
+        soft_delete_in_bulk(models.SecretStoreMetadatum,
+                            models.SecretStoreMetadatum.secret_id.in_(
+                                entity_ids),
+                            session)
+        soft_delete_in_bulk(models.EncryptedDatum,
+                            models.EncryptedDatum.secret_id.in_(entity_ids),
+                            session)
+        session.query(models.ContainerSecret).filter(
+            models.ContainerSecret.secret_id.in_(entity_ids)).delete(
+                synchronize_session=False)
 
 
 class EncryptedDatumRepo(BaseRepo):
@@ -787,32 +1406,54 @@ class KEKDatumRepo(BaseRepo):
     encrypt/decrypt secrets.
     """
 
+    def save(self, entity):
+        """Saves the state of the entity."""
+        if entity.deleted or not entity.active:
+            # The KEK datum is deactivated or rotated out.
+            get_kek_datum_cache().invalidate_project(entity.project_id)
+        super(KEKDatumRepo, self).save(entity)
+
     def find_or_create_kek_datum(self, project,
                                  plugin_name,
                                  suppress_exception=False,
                                  session=None):
-        """Find or create a KEK datum instance."""
+        """Find or create a KEK datum instance.
+
+        Creating the project's KEK datum is serialized on the project's row,
+        which is updated (and so locked until the transaction ends) before
+        looking for the KEK datum again, so that concurrent requests do not
+        create several active KEK data for the same project and plugin.
+        """
         if not plugin_name:
             raise exception.BarbicanException(
                 u._('Tried to register crypto plugin with null or empty '
                     'name.'))
 
-        kek_datum = None
-
         session = self.get_session(session)
 
-        # TODO(jfwood): Reverse this...attempt insert first, then get on fail.
-        try:
+        def _build_query():
             query = session.query(models.KEKDatum)
-            query = query.filter_by(project_id=project.id,
-                                    plugin_name=plugin_name,
-                                    active=True,
-                                    deleted=False)
-
-            kek_datum = query.one()
-
-        except sa_orm.exc.NoResultFound:
-
+            return query.filter_by(project_id=project.id,
+                                   plugin_name=plugin_name,
+                                   active=True,
+                                   deleted=False)
+
+        kek_datum = _build_query().first()
+        if kek_datum:
+            return kek_datum
+
+        # An UPDATE is used rather than a SELECT ... FOR UPDATE, as it also
+        # takes a write lock on SQLite, which ignores FOR UPDATE clauses.
+        projects = models.Project.__table__
+        session.execute(projects.update().where(
+            projects.c.id == project.id).values(
+                updated_at=timeutils.utcnow()))
+
+        # A locking read sees KEK data committed by a request that held the
+        # project's row lock first, even from within a REPEATABLE READ
+        # transaction.
+        kek_datum = _build_query().with_for_update(read=True).first()
+        if not kek_datum:
             kek_datum = models.KEKDatum()
 
             kek_datum.kek_label = "project-{0}-key-{1}".format(
@@ -879,11 +1520,12 @@ class OrderRepo(BaseRepo):
 
     def get_by_create_date(self, external_project_id, offset_arg=None,
                            limit_arg=None, suppress_exception=False,
-                           session=None):
+                           session=None, marker_arg=None, with_total=True):
         """Returns a list of orders
 
         The list is ordered by the date they were created at and paged
-        based on the offset and limit fields.
+        based on the offset and limit fields, or on the marker and limit
+        fields if a marker is provided.
 
         :param external_project_id: The keystone id for the project.
         :param offset_arg: The entity number where the query result should
@@ -892,6 +1534,13 @@ class OrderRepo(BaseRepo):
         :param suppress_exception: Whether NoResultFound exceptions should be
                                    suppressed.
         :param session: SQLAlchemy session object.
+        :param marker_arg: The id of the last order on the previous page. If
+                           provided, the offset is ignored and the result set
+                           starts just after this order. It then holds up
+                           to limit + 1 orders, the last one starting the
+                           next page.
+        :param with_total: Whether the total number of orders should be
+                           counted. If False, the returned total is None.
 
         :returns: Tuple consisting of (list_of_entities, offset, limit, total).
         """
@@ -901,21 +1550,35 @@ class OrderRepo(BaseRepo):
         session = self.get_session(session)
 
         query = session.query(models.Order)
-        query = query.order_by(models.Order.created_at)
+        query = query.order_by(models.Order.created_at, models.Order.id)
         query = query.filter_by(deleted=False)
         query = query.join(models.Project, models.Order.project)
         query = query.filter(models.Project.external_id == external_project_id)
 
+        total = None
+        if with_total:
+            total_key = (self._do_entity_name(), external_project_id)
+            total = get_total_count_cache().get_total(total_key, query)
+
+        if marker_arg:
+            query = filter_by_marker(query, models.Order,
+                                     models.Order.created_at,
+                                     marker_arg)
+            offset = 0
+
         start = offset
         end = offset + limit
+        if marker_arg:
+            # Fetch the first entity of the next page too, if any, telling
+            # the caller whether there is a next page without a count.
+            end += 1
         LOG.debug('Retrieving from %s to %s', start, end)
-        total = query.count()
         entities = query[start:end]
         LOG.debug('Number entities retrieved: %s out of %s',
                   len(entities), total
                   )
 
-        if total <= 0 and not suppress_exception:
+        if not entities and not total and not suppress_exception:
             _raise_no_entities_found(self._do_entity_name())
 
         return entities, offset, limit, total
@@ -1004,12 +1667,16 @@ class ContainerRepo(BaseRepo):
 
     def get_by_create_date(self, external_project_id, offset_arg=None,
                            limit_arg=None, suppress_exception=False,
-                           session=None):
+                           session=None, marker_arg=None, with_total=True):
         """Returns a list of containers
 
         The list is ordered by the date they were created at and paged
-        based on the offset and limit fields. The external_project_id is
+        based on the offset and limit fields, or on the marker and limit
+        fields if a marker is provided. The external_project_id is
         external-to-Barbican value assigned to the project by Keystone.
+        The total is None if with_total is False, sparing the count query.
+        If a marker is provided, up to limit + 1 containers are returned, the
+        last one starting the next page.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
@@ -1017,21 +1684,36 @@ class ContainerRepo(BaseRepo):
         session = self.get_session(session)
 
         query = session.query(models.Container)
-        query = query.order_by(models.Container.created_at)
+        query = query.order_by(models.Container.created_at,
+                               models.Container.id)
         query = query.filter_by(deleted=False)
         query = query.join(models.Project, models.Container.project)
         query = query.filter(models.Project.external_id == external_project_id)
 
+        total = None
+        if with_total:
+            total_key = (self._do_entity_name(), external_project_id)
+            total = get_total_count_cache().get_total(total_key, query)
+
+        if marker_arg:
+            query = filter_by_marker(query, models.Container,
+                                     models.Container.created_at,
+                                     marker_arg)
+            offset = 0
+
         start = offset
         end = offset + limit
+        if marker_arg:
+            # Fetch the first entity of the next page too, if any, telling
+            # the caller whether there is a next page without a count.
+            end += 1
         LOG.debug('Retrieving from %s to %s', start, end)
-        total = query.count()
         entities = query[start:end]
         LOG.debug('Number entities retrieved: %s out of %s',
                   len(entities), total
                   )
 
-        if total <= 0 and not suppress_exception:
+        if not entities and not total and not suppress_exception:
             _raise_no_entities_found(self._do_entity_name())
 
         return entities, offset, limit, total
@@ -1061,6 +1743,12 @@ class ContainerRepo(BaseRepo):
         return session.query(models.Container).filter_by(
             deleted=False).filter_by(project_id=project_id)
 
+    def _do_delete_children_in_bulk(self, entity_ids, session):
+        """Sub-class hook: delete children of the entities with given ids."""
+        session.query(models.ContainerSecret).filter(
+            models.ContainerSecret.container_id.in_(entity_ids)).delete(
+                synchronize_session=False)
+
 
 class ContainerSecretRepo(BaseRepo):
         """Repository for the ContainerSecret entity."""
@@ -1083,11 +1771,15 @@ class ContainerConsumerRepo(BaseRepo):
 
     def get_by_container_id(self, container_id,
                             offset_arg=None, limit_arg=None,
-                            suppress_exception=False, session=None):
+                            suppress_exception=False, session=None,
+                            marker_arg=None, with_total=True):
         """Returns a list of Consumers
 
-        The list is ordered by the date they were created at and paged
-        based on the offset and limit fields.
+        The list is ordered by consumer name and paged based on the offset
+        and limit fields, or on the marker and limit fields if a marker is
+        provided. The total is None if with_total is False, sparing the count
+        query. If a marker is provided, up to limit + 1 consumers are
+        returned, the last one starting the next page.
         """
 
         offset, limit = clean_paging_values(offset_arg, limit_arg)
@@ -1095,22 +1787,37 @@ class ContainerConsumerRepo(BaseRepo):
         session = self.get_session(session)
 
         query = session.query(models.ContainerConsumerMetadatum)
-        query = query.order_by(models.ContainerConsumerMetadatum.name)
+        query = query.order_by(models.ContainerConsumerMetadatum.name,
+                               models.ContainerConsumerMetadatum.id)
         query = query.filter_by(deleted=False)
         query = query.filter(
             models.ContainerConsumerMetadatum.container_id == container_id
         )
 
+        total = None
+        if with_total:
+            total_key = (self._do_entity_name(), container_id)
+            total = get_total_count_cache().get_total(total_key, query)
+
+        if marker_arg:
+            query = filter_by_marker(
+                query, models.ContainerConsumerMetadatum,
+                models.ContainerConsumerMetadatum.name, marker_arg)
+            offset = 0
+
         start = offset
         end = offset + limit
+        if marker_arg:
+            # Fetch the first entity of the next page too, if any, telling
+            # the caller whether there is a next page without a count.
+            end += 1
         LOG.debug('Retrieving from %s to %s', start, end)
-        total = query.count()
         entities = query[start:end]
         LOG.debug('Number entities retrieved: %s out of %s',
                   len(entities), total
                   )
 
-        if total <= 0 and not suppress_exception:
+        if not entities and not total and not suppress_exception:
             _raise_no_entities_found(self._do_entity_name())
 
         return entities, offset, limit, total
@@ -27,6 +27,10 @@ CONF = cfg.CONF
 DEFAULT_PLUGIN_NAMESPACE = 'barbican.crypto.plugin'
 DEFAULT_PLUGINS = ['simple_crypto']
 
+# Maximum number of plugin selections remembered, as the algorithm, bit
+# length and mode they are made for come from requests.
+_MAX_STORE_GENERATE_SELECTIONS = 1000
+
 crypto_opt_group = cfg.OptGroup(name='crypto',
                                 title='Crypto Plugin Options')
 crypto_opts = [
@@ -61,6 +65,16 @@ class _CryptoPluginManager(named.NamedExtensionManager):
             invoke_kwds=invoke_kwargs
         )
 
+        # Plugins by full name, the first loaded winning as it would when
+        # looking them up in turn.
+        self._plugins_by_name = {}
+        for ext in self.extensions:
+            self._plugins_by_name.setdefault(
+                utils.generate_fullname_for(ext.obj), ext.obj)
+        # Plugins selected to store or generate secrets, by the
+        # (type_needed, algorithm, bit_length, mode) they support.
+        self._store_generate_selections = {}
+
     def get_plugin_store_generate(self, type_needed, algorithm=None,
                                   bit_length=None, mode=None):
         """Gets a secret store or generate plugin that supports provided type.
@@ -73,6 +87,11 @@ class _CryptoPluginManager(named.NamedExtensionManager):
         if len(self.extensions) < 1:
             raise crypto.CryptoPluginNotFound()
 
+        selection = (type_needed, algorithm, bit_length, mode)
+        plugin = self._store_generate_selections.get(selection)
+        if plugin is not None:
+            return plugin
+
         for ext in self.extensions:
             if ext.obj.supports(type_needed, algorithm, bit_length, mode):
                 plugin = ext.obj
@@ -80,6 +99,10 @@ class _CryptoPluginManager(named.NamedExtensionManager):
         else:
             raise secret_store.SecretStorePluginNotFound()
 
+        if (len(self._store_generate_selections) <
+                _MAX_STORE_GENERATE_SELECTIONS):
+            self._store_generate_selections[selection] = plugin
+
         return plugin
 
     def get_plugin_retrieve(self, plugin_name_for_store):
@@ -93,21 +116,23 @@ class _CryptoPluginManager(named.NamedExtensionManager):
         if len(self.extensions) < 1:
             raise crypto.CryptoPluginNotFound()
 
-        for ext in self.extensions:
-            decrypting_plugin = ext.obj
-            plugin_name = utils.generate_fullname_for(decrypting_plugin)
-            if plugin_name == plugin_name_for_store:
-                break
-        else:
+        try:
+            return self._plugins_by_name[plugin_name_for_store]
+        except KeyError:
             raise secret_store.SecretStorePluginNotFound()
 
-        return decrypting_plugin
 
-
-@lockutils.synchronized('crypto_get_manager')
 def get_manager():
     """Return a singleton crypto plugin manager."""
+    # Only creating the manager takes the lock, once created it is simply
+    # returned.
+    if _PLUGIN_MANAGER is None:
+        _create_manager()
+    return _PLUGIN_MANAGER
+
+
+@lockutils.synchronized('crypto_get_manager')
+def _create_manager():
     global _PLUGIN_MANAGER
-    if not _PLUGIN_MANAGER:
+    if _PLUGIN_MANAGER is None:
         _PLUGIN_MANAGER = _CryptoPluginManager()
-    return _PLUGIN_MANAGER
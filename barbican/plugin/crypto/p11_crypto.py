@@ -12,12 +12,17 @@
 
 import base64
 import collections
+import contextlib
 import textwrap
+import threading
+import time
 
 import cffi
-from cryptography.hazmat.primitives import padding
-from eventlet import semaphore
+from eventlet import patcher
+from eventlet import tpool
 from oslo_config import cfg
+import six
+from six.moves import queue
 
 from barbican.common import exception
 from barbican.common import utils
@@ -29,11 +34,20 @@ from barbican.plugin.crypto import crypto as plugin
 Attribute = collections.namedtuple("Attribute", ["type", "value"])
 
 CKR_OK = 0
+CKR_KEY_HANDLE_INVALID = 0x60
+CKR_OBJECT_HANDLE_INVALID = 0x82
+CKR_SESSION_CLOSED = 0xb0
+CKR_SESSION_HANDLE_INVALID = 0xb3
+CKR_USER_ALREADY_LOGGED_IN = 0x100
+CKR_USER_NOT_LOGGED_IN = 0x101
 CKF_RW_SESSION = (1 << 1)
 CKF_SERIAL_SESSION = (1 << 2)
 CKU_SO = 0
 CKU_USER = 1
 
+CKS_RO_USER_FUNCTIONS = 1
+CKS_RW_USER_FUNCTIONS = 3
+
 CKO_SECRET_KEY = 4
 CKK_AES = 0x1f
 
@@ -142,6 +156,25 @@ p11_crypto_plugin_opts = [
                help=u._('Master KEK length in bytes.')),
     cfg.StrOpt('hmac_label',
                help=u._('HMAC label (used in the HSM)')),
+    cfg.IntOpt('slot_id', default=1,
+               help=u._('HSM slot ID to open sessions on')),
+    cfg.IntOpt('session_pool_size', default=8,
+               help=u._('Maximum number of logged in sessions kept open, '
+                        'each used by one operation at a time.')),
+    cfg.IntOpt('session_check_interval', default=60,
+               help=u._('Seconds a pooled session may sit unused before '
+                        'its state is checked, as it is checked out.')),
+    cfg.IntOpt('unwrapped_key_cache_size', default=100,
+               help=u._('Maximum number of project KEKs kept unwrapped in '
+                        'the HSM. Set to 0 to disable caching.')),
+    cfg.IntOpt('unwrapped_key_cache_ttl', default=300,
+               help=u._('Seconds a project KEK is kept unwrapped in the '
+                        'HSM. Set to 0 to disable caching.')),
+    cfg.IntOpt('thread_pool_size', default=8,
+               help=u._('Number of native threads calling into the HSM '
+                        'library when running under eventlet, so that HSM '
+                        'calls do not block other green threads. Set to 0 '
+                        'to call the library from the green threads.')),
 ]
 CONF.register_group(p11_crypto_plugin_group)
 CONF.register_opts(p11_crypto_plugin_opts, group=p11_crypto_plugin_group)
@@ -158,6 +191,7 @@ def _build_ffi():
     typedef unsigned long CK_SLOT_ID;
     typedef unsigned long CK_FLAGS;
     typedef unsigned long CK_USER_TYPE;
+    typedef unsigned long CK_STATE;
     typedef unsigned char * CK_UTF8CHAR_PTR;
     typedef ... *CK_NOTIFY;
 
@@ -181,6 +215,13 @@ def _build_ffi():
     typedef CK_BYTE *CK_BYTE_PTR;
     typedef CK_ULONG *CK_ULONG_PTR;
 
+    typedef struct CK_SESSION_INFO {
+        CK_SLOT_ID slotID;
+        CK_STATE state;
+        CK_FLAGS flags;
+        CK_ULONG ulDeviceError;
+    } CK_SESSION_INFO;
+
     typedef struct CK_AES_GCM_PARAMS {
         char * pIv;
         unsigned long ulIvLen;
@@ -196,6 +237,8 @@ def _build_ffi():
     CK_RV C_OpenSession(CK_SLOT_ID, CK_FLAGS, void *, CK_NOTIFY,
                         CK_SESSION_HANDLE *);
     CK_RV C_CloseSession(CK_SESSION_HANDLE);
+    CK_RV C_DestroyObject(CK_SESSION_HANDLE, CK_OBJECT_HANDLE);
+    CK_RV C_GetSessionInfo(CK_SESSION_HANDLE, CK_SESSION_INFO *);
     CK_RV C_Login(CK_SESSION_HANDLE, CK_USER_TYPE, CK_UTF8CHAR_PTR,
                   CK_ULONG);
     CK_RV C_FindObjectsInit(CK_SESSION_HANDLE, CK_ATTRIBUTE *, CK_ULONG);
@@ -238,6 +281,186 @@ class P11CryptoPluginException(exception.BarbicanException):
     message = u._("General exception")
 
 
+class P11CryptoPluginSessionException(P11CryptoPluginException):
+    message = u._("Session is no longer usable")
+
+
+class P11CryptoPluginKeyHandleException(P11CryptoPluginException):
+    message = u._("Key handle is no longer valid")
+
+
+class HSMLibrary(object):
+    """Calls into the vendor PKCS#11 library, timing each call.
+
+    Library calls block the calling thread, so when offloading they are
+    made in eventlet's pool of native threads, leaving the hub free to run
+    other green threads meanwhile.
+    """
+
+    def __init__(self, lib, offload):
+        self._lib = lib
+        self._offload = offload
+
+    def __getattr__(self, name):
+        func = getattr(self._lib, name)
+
+        def call(*args):
+            start = time.time()
+            try:
+                if self._offload:
+                    return tpool.execute(func, *args)
+                return func(*args)
+            finally:
+                LOG.debug("HSM call %s took %.6f seconds",
+                          name, time.time() - start)
+
+        # Only look each function up once.
+        setattr(self, name, call)
+        return call
+
+
+class SessionBuffers(object):
+    """Buffers of a session reused by its encrypt and decrypt operations.
+
+    A session is used by a single operation at a time, so are its buffers.
+    """
+
+    def __init__(self, ffi, algorithm):
+        self._ffi = ffi
+        self.iv = ffi.new("CK_BYTE[16]")
+        self.gcm = ffi.new("CK_AES_GCM_PARAMS *")
+        self.gcm.pIv = self.iv
+        self.gcm.ulIvLen = 16
+        self.gcm.ulIvBits = 128
+        self.gcm.ulTagBits = 128
+        self.mech = ffi.new("CK_MECHANISM *")
+        self.mech.mechanism = algorithm
+        self.mech.parameter = self.gcm
+        self.mech.parameter_len = 48  # sizeof(CK_AES_GCM_PARAMS)
+        self.output_len = ffi.new("CK_ULONG *")
+        self._output = ffi.new("CK_BYTE[]", 0)
+
+    def output(self, length):
+        """Returns an output buffer of length bytes, setting output_len."""
+        if length > len(self._output):
+            self._output = self._ffi.new("CK_BYTE[]", length)
+        self.output_len[0] = length
+        return self._output
+
+
+class UnwrappedKey(object):
+    """Handle of a project KEK unwrapped in the HSM, as a session object."""
+
+    def __init__(self, kek_label, handle, plugin_meta, session, expires):
+        self.kek_label = kek_label
+        self.handle = handle
+        self.plugin_meta = plugin_meta
+        # Session objects are destroyed along with the session that created
+        # them, but may be used and destroyed by any other session.
+        self.session = session
+        self.expires = expires
+        self.users = 1
+        self.cached = False
+
+
+class UnwrappedKeyCache(object):
+    """Least recently used cache of project KEKs unwrapped in the HSM.
+
+    Keys are cached by KEK label for a limited time. Keys may be in use by
+    other operations as they leave the cache, so they are only listed for
+    destruction once the last operation using them checks them back in.
+    """
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._in_use = set()
+        self._to_destroy = []
+        self._lock = threading.Lock()
+
+    def checkout(self, kek_label, plugin_meta):
+        """Returns the cached key, to be checked back in, or None."""
+        with self._lock:
+            key = self._entries.pop(kek_label, None)
+            if not key:
+                return None
+            if key.plugin_meta != plugin_meta or key.expires <= time.time():
+                self._evict(key)
+                return None
+            self._entries[kek_label] = key
+            key.users += 1
+            self._in_use.add(key)
+            return key
+
+    def add(self, kek_label, plugin_meta, handle, session):
+        """Adds and checks out a newly unwrapped key."""
+        key = UnwrappedKey(kek_label, handle, plugin_meta, session,
+                           time.time() + self._ttl)
+        with self._lock:
+            self._in_use.add(key)
+            if self._size <= 0 or self._ttl <= 0:
+                return key
+
+            old_key = self._entries.pop(kek_label, None)
+            if old_key:
+                self._evict(old_key)
+            while len(self._entries) >= self._size:
+                self._evict(self._entries.popitem(last=False)[1])
+            key.cached = True
+            self._entries[kek_label] = key
+            return key
+
+    def checkin(self, key):
+        with self._lock:
+            key.users -= 1
+            if not key.users:
+                self._in_use.discard(key)
+                if not key.cached:
+                    self._destroy(key)
+
+    def pop_keys_to_destroy(self):
+        """Returns the handles of the keys to destroy, no longer cached."""
+        with self._lock:
+            keys, self._to_destroy = self._to_destroy, []
+            return [key.handle for key in keys]
+
+    def invalidate(self, key):
+        """Forgets a key whose handle turned out to be no longer valid."""
+        with self._lock:
+            if self._entries.get(key.kek_label) is key:
+                del self._entries[key.kek_label]
+            key.cached = False
+            key.session = None
+
+    def invalidate_session(self, session):
+        """Forgets the keys unwrapped in a session that was closed.
+
+        Their handles were destroyed with the session, and may be reused by
+        the HSM for new objects.
+        """
+        with self._lock:
+            for kek_label, key in list(self._entries.items()):
+                if key.session == session:
+                    del self._entries[kek_label]
+                    key.cached = False
+            for key in self._in_use:
+                if key.session == session:
+                    key.session = None
+            self._to_destroy = [key for key in self._to_destroy
+                                if key.session != session]
+
+    def _evict(self, key):
+        key.cached = False
+        if not key.users:
+            self._destroy(key)
+
+    def _destroy(self, key):
+        # Keys whose session was closed are already destroyed.
+        if key.session is not None:
+            self._to_destroy.append(key)
+
+
 class P11CryptoPlugin(plugin.CryptoPluginBase):
     """PKCS11 supporting implementation of the crypto plugin.
 
@@ -248,9 +471,6 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
     """
 
     def __init__(self, conf=cfg.CONF, ffi=None):
-        self.enc_sem = semaphore.Semaphore()
-        self.dec_sem = semaphore.Semaphore()
-        self.verify_sem = semaphore.Semaphore()
         self.block_size = 16  # in bytes
         # TODO(reaperhulk): abstract this so alternate algorithms/vendors
         # are possible.
@@ -258,34 +478,136 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         if conf.p11_crypto_plugin.library_path is None:
             raise ValueError(u._("library_path is required"))
         self.ffi = _build_ffi() if not ffi else ffi
-        self.lib = self.ffi.dlopen(conf.p11_crypto_plugin.library_path)
+        thread_pool_size = conf.p11_crypto_plugin.thread_pool_size
+        offload = thread_pool_size > 0 and patcher.is_monkey_patched('thread')
+        if offload:
+            tpool.set_num_threads(thread_pool_size)
+        self.lib = HSMLibrary(
+            self.ffi.dlopen(conf.p11_crypto_plugin.library_path), offload)
 
         self._check_error(self.lib.C_Initialize(self.ffi.NULL))
 
-        self.session = self._open_session(1)
-        self.rw_session = self._open_session(1)
-        self._login(conf.p11_crypto_plugin.login, self.session)
-        self._login(conf.p11_crypto_plugin.login, self.rw_session)
-
-        self._perform_rng_self_test()
+        self.login = conf.p11_crypto_plugin.login
+        self.slot_id = conf.p11_crypto_plugin.slot_id
+        self.session_check_interval = (
+            conf.p11_crypto_plugin.session_check_interval)
+        self.unwrapped_keys = UnwrappedKeyCache(
+            conf.p11_crypto_plugin.unwrapped_key_cache_size,
+            conf.p11_crypto_plugin.unwrapped_key_cache_ttl)
+
+        # Pool of (session, last used time) pairs, with a None session for
+        # each session not opened yet, or closed after it failed. The last
+        # returned session is checked out first, so that sessions are only
+        # opened as concurrency requires.
+        self.sessions = queue.LifoQueue()
+        for i in range(conf.p11_crypto_plugin.session_pool_size):
+            self.sessions.put((None, None))
+        self.session_buffers = {}
+
+        self._with_session(self._perform_rng_self_test)
 
         self.current_mkek_label = conf.p11_crypto_plugin.mkek_label
         self.current_hmac_label = conf.p11_crypto_plugin.hmac_label
         LOG.debug("Current mkek label: %s", self.current_mkek_label)
         LOG.debug("Current hmac label: %s", self.current_hmac_label)
+
+        # Handles of the MKEKs and HMAC keys by label. They are token
+        # objects, so their handles are valid in every session.
         self.key_handles = {}
-        # cache current MKEK handle in the dictionary
-        self._get_or_generate_mkek(
+        self._with_session(
+            self._get_or_generate_mkek,
             self.current_mkek_label,
             conf.p11_crypto_plugin.mkek_length
         )
-        self._get_or_generate_hmac_key(self.current_hmac_label)
+        self._with_session(self._get_or_generate_hmac_key,
+                           self.current_hmac_label)
 
-    def _perform_rng_self_test(self):
-        test_random = self._generate_random(100)
+    def _perform_rng_self_test(self, session):
+        test_random = self._generate_random(session, 100)
         if self.ffi.buffer(test_random, 100)[:] == b"\x00" * 100:
             raise P11CryptoPluginException("Apparent RNG self-test failure.")
 
+    def _with_session(self, func, *args):
+        """Calls func with a session checked out of the pool, then args.
+
+        Each session is used by a single operation at a time, so that HSM
+        operations run concurrently up to the size of the pool. Should the
+        session turn out to be no longer usable, such as after the HSM
+        closed it or logged it out, it is replaced by a new logged in
+        session, and func is called once more. So is func should a key
+        handle it used turn out to be invalid, once the cached handles of
+        the MKEKs and HMAC keys are forgotten so they are looked up again.
+        """
+        session = self._checkout_session()
+        try:
+            try:
+                return func(session, *args)
+            except P11CryptoPluginSessionException as e:
+                LOG.warning(u._LW('Replacing unusable HSM session: %s'), e)
+                self._close_session(session)
+                session = None
+                session = self._open_logged_in_session()
+                return func(session, *args)
+            except P11CryptoPluginKeyHandleException as e:
+                # Raised when a cached key handle is stale, such as after an
+                # unwrapped key was destroyed along with its session, or a
+                # key was replaced in the HSM.
+                LOG.warning(u._LW('Retrying with invalid HSM key: %s'), e)
+                self.key_handles.clear()
+                return func(session, *args)
+        finally:
+            self._return_session(session)
+
+    def _checkout_session(self):
+        """Checks a session out of the pool, waiting for one if need be.
+
+        Sessions left unused for a while are checked before they are
+        handed out, and replaced if the HSM no longer considers them
+        logged in.
+        """
+        session, last_used = self.sessions.get()
+        try:
+            if session is not None and (
+                    time.time() - last_used > self.session_check_interval
+                    and not self._is_session_usable(session)):
+                LOG.warning(u._LW('Replacing HSM session found unusable'))
+                self._close_session(session)
+                session = None
+            if session is None:
+                session = self._open_logged_in_session()
+        except Exception:
+            # Return the slot, so that the pool does not shrink.
+            self.sessions.put((None, None))
+            raise
+        return session
+
+    def _return_session(self, session):
+        """Returns a checked out session, or None if it was closed."""
+        self.sessions.put((session, time.time()))
+
+    def _is_session_usable(self, session):
+        session_info = self.ffi.new("CK_SESSION_INFO *")
+        rv = self.lib.C_GetSessionInfo(session, session_info)
+        return rv == CKR_OK and session_info.state in (
+            CKS_RO_USER_FUNCTIONS, CKS_RW_USER_FUNCTIONS)
+
+    def _open_logged_in_session(self):
+        session = self._open_session(self.slot_id)
+        try:
+            self._login(self.login, session)
+        except Exception:
+            self._close_session(session)
+            raise
+        return session
+
+    def _close_session(self, session):
+        """Closes the session, ignoring errors as it may be closed already."""
+        self.unwrapped_keys.invalidate_session(session)
+        self.session_buffers.pop(session, None)
+        rv = self.lib.C_CloseSession(session)
+        if rv != CKR_OK:
+            LOG.debug("Closing session returned response code: %s", rv)
+
     def _open_session(self, slot):
         session_ptr = self.ffi.new("CK_SESSION_HANDLE *")
         rv = self.lib.C_OpenSession(
@@ -306,9 +628,21 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             password,
             len(password)
         )
-        self._check_error(rv)
+        # Login state is shared by all the sessions of the application, so
+        # sessions opened while another one is logged in are logged in too.
+        if rv != CKR_USER_ALREADY_LOGGED_IN:
+            self._check_error(rv)
 
     def _check_error(self, value):
+        if value in (CKR_SESSION_CLOSED, CKR_SESSION_HANDLE_INVALID,
+                     CKR_USER_NOT_LOGGED_IN):
+            raise P11CryptoPluginSessionException(
+                "HSM returned response code: {0}".format(value)
+            )
+        if value in (CKR_KEY_HANDLE_INVALID, CKR_OBJECT_HANDLE_INVALID):
+            raise P11CryptoPluginKeyHandleException(
+                "HSM returned response code: {0}".format(value)
+            )
         if value != CKR_OK:
             raise P11CryptoPluginException(
                 "HSM returned response code: {0}".format(value)
@@ -340,8 +674,8 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
 
         return attributes, val_list
 
-    def _get_or_generate_mkek(self, mkek_label, mkek_length):
-        mkek = self._get_key_handle(mkek_label)
+    def _get_or_generate_mkek(self, session, mkek_label, mkek_length):
+        mkek = self._get_key_handle(session, mkek_label)
         if not mkek:
             # Generate a key that is persistent and not extractable
             template, val_list = self._build_attributes([
@@ -360,14 +694,14 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
                 Attribute(CKA_UNWRAP, True),
                 Attribute(CKA_EXTRACTABLE, False)
             ])
-            mkek = self._generate_kek(template)
+            mkek = self._generate_kek(session, template)
 
         self.key_handles[mkek_label] = mkek
 
         return mkek
 
-    def _get_or_generate_hmac_key(self, hmac_label):
-        hmac_key = self._get_key_handle(hmac_label)
+    def _get_or_generate_hmac_key(self, session, hmac_label):
+        hmac_key = self._get_key_handle(session, hmac_label)
         if not hmac_key:
             # Generate a key that is persistent and not extractable
             template, val_list = self._build_attributes([
@@ -382,15 +716,16 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
                 Attribute(CKA_TOKEN, True),
                 Attribute(CKA_EXTRACTABLE, False)
             ])
-            hmac_key = self._generate_kek(template)
+            hmac_key = self._generate_kek(session, template)
 
         self.key_handles[hmac_label] = hmac_key
 
         return hmac_key
 
-    def _get_key_handle(self, mkek_label):
-        if mkek_label in self.key_handles:
-            return self.key_handles[mkek_label]
+    def _get_key_handle(self, session, mkek_label):
+        key = self.key_handles.get(mkek_label)
+        if key is not None:
+            return key
 
         template, val_list = self._build_attributes([
             Attribute(CKA_CLASS, CKO_SECRET_KEY),
@@ -398,46 +733,42 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             Attribute(CKA_LABEL, mkek_label)
         ])
         rv = self.lib.C_FindObjectsInit(
-            self.session, template, len(template)
+            session, template, len(template)
         )
         self._check_error(rv)
 
         returned_count = self.ffi.new("CK_ULONG *")
         object_handle_ptr = self.ffi.new("CK_OBJECT_HANDLE *")
         rv = self.lib.C_FindObjects(
-            self.session, object_handle_ptr, 2, returned_count
+            session, object_handle_ptr, 2, returned_count
         )
         self._check_error(rv)
         if returned_count[0] == 1:
             key = object_handle_ptr[0]
-        rv = self.lib.C_FindObjectsFinal(self.session)
+        rv = self.lib.C_FindObjectsFinal(session)
         self._check_error(rv)
         if returned_count[0] == 1:
+            self.key_handles[mkek_label] = key
             return key
         elif returned_count[0] == 0:
             return None
         else:
             raise P11CryptoPluginKeyException()
 
-    def _generate_random(self, length):
+    def _generate_random(self, session, length):
         buf = self.ffi.new("CK_BYTE[{0}]".format(length))
-        rv = self.lib.C_GenerateRandom(self.session, buf, length)
+        rv = self.lib.C_GenerateRandom(session, buf, length)
         self._check_error(rv)
         return buf
 
-    def _build_gcm_mech(self, iv):
-        mech = self.ffi.new("CK_MECHANISM *")
-        mech.mechanism = self.algorithm
-        gcm = self.ffi.new("CK_AES_GCM_PARAMS *")
-        gcm.pIv = iv
-        gcm.ulIvLen = 16
-        gcm.ulIvBits = 128
-        gcm.ulTagBits = 128
-        mech.parameter = gcm
-        mech.parameter_len = 48  # sizeof(CK_AES_GCM_PARAMS)
-        return mech
-
-    def _generate_kek(self, template):
+    def _get_session_buffers(self, session):
+        buffers = self.session_buffers.get(session)
+        if buffers is None:
+            buffers = SessionBuffers(self.ffi, self.algorithm)
+            self.session_buffers[session] = buffers
+        return buffers
+
+    def _generate_kek(self, session, template):
         """Generates both master and project KEKs
 
         :param template: A tuple of tuples in (CKA_TYPE, VALUE) form
@@ -446,13 +777,13 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         mech.mechanism = CKM_AES_KEY_GEN
         object_handle_ptr = self.ffi.new("CK_OBJECT_HANDLE *")
         rv = self.lib.C_GenerateKey(
-            self.rw_session, mech, template, len(template), object_handle_ptr
+            session, mech, template, len(template), object_handle_ptr
         )
 
         self._check_error(rv)
         return object_handle_ptr[0]
 
-    def _generate_wrapped_kek(self, kek_label, key_length):
+    def _generate_wrapped_kek(self, session, kek_label, key_length):
         # generate a non-persistent key that is extractable
         template, val_list = self._build_attributes([
             Attribute(CKA_CLASS, CKO_SECRET_KEY),
@@ -468,13 +799,13 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             Attribute(CKA_UNWRAP, True),
             Attribute(CKA_EXTRACTABLE, True)
         ])
-        kek = self._generate_kek(template)
+        kek = self._generate_kek(session, template)
         mech = self.ffi.new("CK_MECHANISM *")
         mech.mechanism = CKM_AES_CBC_PAD
-        iv = self._generate_random(16)
+        iv = self._generate_random(session, 16)
         mech.parameter = iv
         mech.parameter_len = 16
-        mkek = self.key_handles[self.current_mkek_label]
+        mkek = self._get_key_handle(session, self.current_mkek_label)
         # Since we're using CKM_AES_CBC_PAD the maximum length of the
         # padded key will be the key length + one block. We allocate the
         # worst case scenario as a CK_BYTE array.
@@ -482,10 +813,10 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
 
         buf = self.ffi.new("CK_BYTE[{0}]".format(padded_length))
         buf_len = self.ffi.new("CK_ULONG *", padded_length)
-        rv = self.lib.C_WrapKey(self.rw_session, mech, mkek, kek, buf, buf_len)
+        rv = self.lib.C_WrapKey(session, mech, mkek, kek, buf, buf_len)
         self._check_error(rv)
         wrapped_key = self.ffi.buffer(buf, buf_len[0])[:]
-        hmac = self._compute_hmac(wrapped_key)
+        hmac = self._compute_hmac(session, wrapped_key)
         return {
             'iv': base64.b64encode(self.ffi.buffer(iv)[:]),
             'wrapped_key': base64.b64encode(wrapped_key),
@@ -494,36 +825,63 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             'hmac_label': self.current_hmac_label
         }
 
-    def _compute_hmac(self, wrapped_key):
+    def _compute_hmac(self, session, wrapped_key):
         mech = self.ffi.new("CK_MECHANISM *")
         mech.mechanism = CKM_SHA256_HMAC
-        hmac_key = self.key_handles[self.current_hmac_label]
-        rv = self.lib.C_SignInit(self.rw_session, mech, hmac_key)
+        hmac_key = self._get_key_handle(session, self.current_hmac_label)
+        rv = self.lib.C_SignInit(session, mech, hmac_key)
         self._check_error(rv)
 
         ck_bytes = self.ffi.new("CK_BYTE[]", wrapped_key)
         buf = self.ffi.new("CK_BYTE[32]")
         buf_len = self.ffi.new("CK_ULONG *", 32)
         rv = self.lib.C_Sign(
-            self.rw_session, ck_bytes, len(wrapped_key), buf, buf_len
+            session, ck_bytes, len(wrapped_key), buf, buf_len
         )
         self._check_error(rv)
         return self.ffi.buffer(buf, buf_len[0])[:]
 
-    def _verify_hmac(self, hmac_key, sig, wrapped_key):
+    def _verify_hmac(self, session, hmac_key, sig, wrapped_key):
         mech = self.ffi.new("CK_MECHANISM *")
         mech.mechanism = CKM_SHA256_HMAC
-        with self.verify_sem:
-            rv = self.lib.C_VerifyInit(self.rw_session, mech, hmac_key)
-            self._check_error(rv)
-            ck_bytes = self.ffi.new("CK_BYTE[]", wrapped_key)
-            ck_sig = self.ffi.new("CK_BYTE[]", sig)
-            rv = self.lib.C_Verify(
-                self.rw_session, ck_bytes, len(wrapped_key), ck_sig, len(sig)
-            )
-            self._check_error(rv)
+        rv = self.lib.C_VerifyInit(session, mech, hmac_key)
+        self._check_error(rv)
+        ck_bytes = self.ffi.new("CK_BYTE[]", wrapped_key)
+        ck_sig = self.ffi.new("CK_BYTE[]", sig)
+        rv = self.lib.C_Verify(
+            session, ck_bytes, len(wrapped_key), ck_sig, len(sig)
+        )
+        self._check_error(rv)
 
-    def _unwrap_key(self, plugin_meta):
+    @contextlib.contextmanager
+    def _unwrapped_key(self, session, kek_meta_dto):
+        """Yields the handle of the project KEK unwrapped in the HSM.
+
+        Unwrapped KEKs are cached, sparing the HMAC verification and unwrap
+        round trips to the HSM, and the KEKs leaving the cache are
+        destroyed rather than left behind in the HSM.
+        """
+        key = self.unwrapped_keys.checkout(kek_meta_dto.kek_label,
+                                           kek_meta_dto.plugin_meta)
+        if not key:
+            handle = self._unwrap_key(session, kek_meta_dto.plugin_meta)
+            key = self.unwrapped_keys.add(kek_meta_dto.kek_label,
+                                          kek_meta_dto.plugin_meta,
+                                          handle, session)
+        try:
+            yield key.handle
+        except P11CryptoPluginKeyHandleException:
+            self.unwrapped_keys.invalidate(key)
+            raise
+        finally:
+            self.unwrapped_keys.checkin(key)
+            for handle in self.unwrapped_keys.pop_keys_to_destroy():
+                rv = self.lib.C_DestroyObject(session, handle)
+                if rv != CKR_OK:
+                    LOG.warning(u._LW('Destroying unwrapped KEK returned '
+                                      'response code: %s'), rv)
+
+    def _unwrap_key(self, session, plugin_meta):
         """Unwraps byte string to key handle in HSM.
 
         :param plugin_meta: kek_meta_dto plugin meta (json string)
@@ -533,12 +891,12 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         iv = base64.b64decode(meta['iv'])
         hmac = base64.b64decode(meta['hmac'])
         wrapped_key = base64.b64decode(meta['wrapped_key'])
-        mkek = self._get_key_handle(meta['mkek_label'])
-        hmac_key = self._get_key_handle(meta['hmac_label'])
+        mkek = self._get_key_handle(session, meta['mkek_label'])
+        hmac_key = self._get_key_handle(session, meta['hmac_label'])
         LOG.debug("Unwrapping key with %s mkek label", meta['mkek_label'])
 
         LOG.debug("Verifying key with %s hmac label", meta['hmac_label'])
-        self._verify_hmac(hmac_key, hmac, wrapped_key)
+        self._verify_hmac(session, hmac_key, hmac, wrapped_key)
 
         unwrapped = self.ffi.new("CK_OBJECT_HANDLE *")
         mech = self.ffi.new("CK_MECHANISM *")
@@ -559,7 +917,7 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         ])
 
         rv = self.lib.C_UnwrapKey(
-            self.rw_session, mech, mkek, wrapped_key, len(wrapped_key),
+            session, mech, mkek, wrapped_key, len(wrapped_key),
             template, len(template), unwrapped
         )
         self._check_error(rv)
@@ -567,19 +925,27 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
         return unwrapped[0]
 
     def _pad(self, unencrypted):
-        padder = padding.PKCS7(self.block_size * 8).padder()
-        return padder.update(unencrypted) + padder.finalize()
+        """Pads to a multiple of the block size, as PKCS #7 does."""
+        pad_length = self.block_size - len(unencrypted) % self.block_size
+        return unencrypted + six.int2byte(pad_length) * pad_length
 
     def _unpad(self, unencrypted):
-        unpadder = padding.PKCS7(self.block_size * 8).unpadder()
-        return unpadder.update(unencrypted) + unpadder.finalize()
+        pad_length = six.indexbytes(unencrypted, -1) if unencrypted else 0
+        if (not 0 < pad_length <= self.block_size or
+                unencrypted[-pad_length:] !=
+                six.int2byte(pad_length) * pad_length):
+            raise ValueError(u._("Invalid padding bytes."))
+        return unencrypted[:-pad_length]
 
     def encrypt(self, encrypt_dto, kek_meta_dto, project_id):
-        key = self._unwrap_key(kek_meta_dto.plugin_meta)
-        iv = self._generate_random(16)
-        mech = self._build_gcm_mech(iv)
-        with self.enc_sem:
-            rv = self.lib.C_EncryptInit(self.session, mech, key)
+        return self._with_session(self._encrypt, encrypt_dto, kek_meta_dto)
+
+    def _encrypt(self, session, encrypt_dto, kek_meta_dto):
+        buffers = self._get_session_buffers(session)
+        rv = self.lib.C_GenerateRandom(session, buffers.iv, 16)
+        self._check_error(rv)
+        with self._unwrapped_key(session, kek_meta_dto) as key:
+            rv = self.lib.C_EncryptInit(session, buffers.mech, key)
             self._check_error(rv)
             # GCM does not require padding, but sometimes HSMs don't seem to
             # know that and then you need to pad things for no reason.
@@ -588,51 +954,50 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
             # The GCM mechanism adds a 16 byte tag to the front of the
             # cyphertext (which is the same length as the (annoyingly) padded
             # plaintext) so adding 16 bytes guarantees sufficient space.
-            ct_len = self.ffi.new("CK_ULONG *", pt_len + 16)
-            ct = self.ffi.new("CK_BYTE[{0}]".format(pt_len + 16))
+            ct = buffers.output(pt_len + 16)
             rv = self.lib.C_Encrypt(
-                self.session, pt_padded, pt_len, ct, ct_len
+                session, pt_padded, pt_len, ct, buffers.output_len
             )
             self._check_error(rv)
 
-        cyphertext = self.ffi.buffer(ct, ct_len[0])[:]
+        cyphertext = self.ffi.buffer(ct, buffers.output_len[0])[:]
         kek_meta_extended = json.dumps({
-            'iv': base64.b64encode(self.ffi.buffer(iv)[:])
+            'iv': base64.b64encode(self.ffi.buffer(buffers.iv)[:])
         })
 
         return plugin.ResponseDTO(cyphertext, kek_meta_extended)
 
     def decrypt(self, decrypt_dto, kek_meta_dto, kek_meta_extended,
                 project_id):
-        key = self._unwrap_key(kek_meta_dto.plugin_meta)
+        return self._with_session(self._decrypt, decrypt_dto, kek_meta_dto,
+                                  kek_meta_extended)
+
+    def _decrypt(self, session, decrypt_dto, kek_meta_dto, kek_meta_extended):
         meta_extended = json.loads(kek_meta_extended)
-        iv = base64.b64decode(meta_extended['iv'])
-        iv = self.ffi.new("CK_BYTE[]", iv)
-        mech = self._build_gcm_mech(iv)
-        with self.dec_sem:
-            rv = self.lib.C_DecryptInit(self.session, mech, key)
+        buffers = self._get_session_buffers(session)
+        self.ffi.buffer(buffers.iv)[:] = base64.b64decode(meta_extended['iv'])
+        with self._unwrapped_key(session, kek_meta_dto) as key:
+            rv = self.lib.C_DecryptInit(session, buffers.mech, key)
             self._check_error(rv)
-            pt = self.ffi.new(
-                "CK_BYTE[{0}]".format(len(decrypt_dto.encrypted))
-            )
-            pt_len = self.ffi.new("CK_ULONG *", len(decrypt_dto.encrypted))
+            pt = buffers.output(len(decrypt_dto.encrypted))
             rv = self.lib.C_Decrypt(
-                self.session,
+                session,
                 decrypt_dto.encrypted,
                 len(decrypt_dto.encrypted),
                 pt,
-                pt_len
+                buffers.output_len
             )
             self._check_error(rv)
 
-        return self._unpad(self.ffi.buffer(pt, pt_len[0])[:])
+        return self._unpad(self.ffi.buffer(pt, buffers.output_len[0])[:])
 
     def bind_kek_metadata(self, kek_meta_dto):
         # Enforce idempotency: If we've already generated a key leave now.
         if not kek_meta_dto.plugin_meta:
             kek_length = 32
             kek_meta_dto.plugin_meta = json.dumps(
-                self._generate_wrapped_kek(kek_meta_dto.kek_label, kek_length)
+                self._with_session(self._generate_wrapped_kek,
+                                   kek_meta_dto.kek_label, kek_length)
             )
             # To be persisted by Barbican:
             kek_meta_dto.algorithm = 'AES'
@@ -643,7 +1008,7 @@ class P11CryptoPlugin(plugin.CryptoPluginBase):
 
     def generate_symmetric(self, generate_dto, kek_meta_dto, project_id):
         byte_length = generate_dto.bit_length / 8
-        buf = self._generate_random(byte_length)
+        buf = self._with_session(self._generate_random, byte_length)
         rand = self.ffi.buffer(buf)[:]
         assert len(rand) == byte_length
         return self.encrypt(plugin.EncryptDTO(rand), kek_meta_dto, project_id)
@@ -10,15 +10,22 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import base64
+import collections
 import os
 
 from Crypto.PublicKey import DSA
 from Crypto.PublicKey import RSA
 from Crypto.Util import asn1
 from cryptography import fernet
+from cryptography.hazmat import backends
+from cryptography.hazmat.primitives import ciphers
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf import hkdf
 from oslo_config import cfg
 import six
 
+from barbican.common import utils
 from barbican import i18n as u
 from barbican.plugin.crypto import crypto as c
 
@@ -31,28 +38,90 @@ simple_crypto_plugin_opts = [
     cfg.StrOpt('kek',
                default=b'dGhpcnR5X3R3b19ieXRlX2tleWJsYWhibGFoYmxhaGg=',
                help=u._('Key encryption key to be used by Simple Crypto '
-                        'Plugin'))
+                        'Plugin')),
+    cfg.IntOpt('kek_cache_ttl', default=300,
+               help=u._('Seconds the decrypted project KEKs are cached for. '
+                        'Set to 0 to disable caching.')),
+    cfg.IntOpt('kek_cache_size', default=1000,
+               help=u._('Maximum number of decrypted project KEKs cached.')),
+    cfg.StrOpt('encryption_mode', default='fernet',
+               choices=['fernet', 'aes-256-gcm'],
+               help=u._('How new secrets are encrypted with their project '
+                        'KEK. Secrets encrypted in either mode can always be '
+                        'decrypted.'))
 ]
 CONF.register_group(simple_crypto_plugin_group)
 CONF.register_opts(simple_crypto_plugin_opts, group=simple_crypto_plugin_group)
 
+# Stored as the kek_meta_extended of the secrets encrypted in AES-256-GCM
+# mode, the version allowing the format to evolve. Secrets encrypted with
+# Fernet have no kek_meta_extended.
+AES_GCM_V1 = 'aes-256-gcm:v1'
+AES_GCM_NONCE_LENGTH = 12
+AES_GCM_TAG_LENGTH = 16
+
+# Decrypted project KEK, as a Fernet instance and the AES-256-GCM key
+# derived from it.
+ProjectKEK = collections.namedtuple('ProjectKEK', ['fernet', 'gcm_key'])
+
 
 class SimpleCryptoPlugin(c.CryptoPluginBase):
     """Insecure implementation of the crypto plugin."""
 
     def __init__(self, conf=CONF):
         self.master_kek = conf.simple_crypto_plugin.kek
+        self.encryption_mode = conf.simple_crypto_plugin.encryption_mode
+        # Project KEKs are stored encrypted with the master KEK, so their
+        # decrypted form is cached, keyed by their encrypted form.
+        self.kek_cache = utils.TimedLRUCache('kek_cache_ttl',
+                                             'kek_cache_size',
+                                             group='simple_crypto_plugin')
 
     def _get_kek(self, kek_meta_dto):
+        """Returns the decrypted project KEK, as a ProjectKEK."""
         if not kek_meta_dto.plugin_meta:
             raise ValueError(u._('KEK not yet created.'))
-        # the kek is stored encrypted. Need to decrypt.
-        encryptor = fernet.Fernet(self.master_kek)
         # Note : If plugin_meta type is unicode, encode to byte.
         if isinstance(kek_meta_dto.plugin_meta, six.text_type):
             kek_meta_dto.plugin_meta = kek_meta_dto.plugin_meta.encode('utf-8')
 
-        return encryptor.decrypt(kek_meta_dto.plugin_meta)
+        kek = self.kek_cache.get(kek_meta_dto.plugin_meta)
+        if not kek:
+            # the kek is stored encrypted. Need to decrypt.
+            encryptor = fernet.Fernet(self.master_kek)
+            key = encryptor.decrypt(kek_meta_dto.plugin_meta)
+            kek = ProjectKEK(fernet.Fernet(key), self._derive_gcm_key(key))
+            self.kek_cache.add(kek_meta_dto.plugin_meta, kek)
+        return kek
+
+    def _derive_gcm_key(self, key):
+        """Derives the AES-256-GCM key from a project's Fernet key.
+
+        A distinct key is derived, rather than reusing the Fernet signing and
+        encryption keys for another cipher.
+        """
+        kdf = hkdf.HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                        info=b'barbican simple crypto aes-256-gcm',
+                        backend=backends.default_backend())
+        return kdf.derive(base64.urlsafe_b64decode(key))
+
+    def _encrypt_gcm(self, key, unencrypted):
+        nonce = os.urandom(AES_GCM_NONCE_LENGTH)
+        encryptor = ciphers.Cipher(
+            ciphers.algorithms.AES(key), ciphers.modes.GCM(nonce),
+            backend=backends.default_backend()).encryptor()
+        cyphertext = encryptor.update(unencrypted) + encryptor.finalize()
+        return nonce + cyphertext + encryptor.tag
+
+    def _decrypt_gcm(self, key, encrypted):
+        nonce = encrypted[:AES_GCM_NONCE_LENGTH]
+        tag = encrypted[-AES_GCM_TAG_LENGTH:]
+        decryptor = ciphers.Cipher(
+            ciphers.algorithms.AES(key), ciphers.modes.GCM(nonce, tag),
+            backend=backends.default_backend()).decryptor()
+        return (decryptor.update(encrypted[AES_GCM_NONCE_LENGTH:
+                                           -AES_GCM_TAG_LENGTH]) +
+                decryptor.finalize())
 
     def encrypt(self, encrypt_dto, kek_meta_dto, project_id):
         kek = self._get_kek(kek_meta_dto)
@@ -66,16 +135,24 @@ class SimpleCryptoPlugin(c.CryptoPluginBase):
                     unencrypted_type=type(unencrypted)
                 )
             )
-        encryptor = fernet.Fernet(kek)
-        cyphertext = encryptor.encrypt(unencrypted)
+        if self.encryption_mode == 'aes-256-gcm':
+            return c.ResponseDTO(self._encrypt_gcm(kek.gcm_key, unencrypted),
+                                 AES_GCM_V1)
+
+        cyphertext = kek.fernet.encrypt(unencrypted)
         return c.ResponseDTO(cyphertext, None)
 
     def decrypt(self, encrypted_dto, kek_meta_dto, kek_meta_extended,
                 project_id):
         kek = self._get_kek(kek_meta_dto)
         encrypted = encrypted_dto.encrypted
-        decryptor = fernet.Fernet(kek)
-        return decryptor.decrypt(encrypted)
+        if not kek_meta_extended:
+            return kek.fernet.decrypt(encrypted)
+        if kek_meta_extended == AES_GCM_V1:
+            return self._decrypt_gcm(kek.gcm_key, encrypted)
+        raise ValueError(
+            u._('Unsupported encryption format: {format}').format(
+                format=kek_meta_extended))
 
     def bind_kek_metadata(self, kek_meta_dto):
         kek_meta_dto.algorithm = 'aes'
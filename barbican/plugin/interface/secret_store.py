@@ -15,6 +15,7 @@
 
 import abc
 
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 import six
 from stevedore import named
@@ -24,10 +25,15 @@ from barbican.common import utils
 from barbican import i18n as u
 
 
+_SECRET_STORE = None
+
 CONF = cfg.CONF
 DEFAULT_PLUGIN_NAMESPACE = 'barbican.secretstore.plugin'
 DEFAULT_PLUGINS = ['store_crypto']
 
+# Maximum number of plugin selections remembered by the manager.
+_MAX_PLUGIN_SELECTIONS = 1000
+
 store_opt_group = cfg.OptGroup(name='secretstore',
                                title='Secret Store Plugin Options')
 store_opts = [
@@ -416,6 +422,13 @@ class SecretStoreBase(object):
         return False
 
 
+def _get_key_spec_selection(key_spec):
+    # Leaves out the passphrase, which no plugin selection depends on.
+    if key_spec is None:
+        return None
+    return key_spec.alg, key_spec.bit_length, key_spec.mode
+
+
 def _enforce_extensions_configured(plugin_related_function):
     def _check_plugins_configured(self, *args, **kwargs):
         if len(self.extensions) < 1:
@@ -435,6 +448,47 @@ class SecretStorePluginManager(named.NamedExtensionManager):
             invoke_kwds=invoke_kwargs
         )
 
+        # Plugins by full name, built on first use.
+        self._plugins_by_name = None
+        # Plugins selected to store or generate secrets, by what they were
+        # selected for.
+        self._selections = {}
+
+    def _get_plugin_by_name(self, plugin_name):
+        if self._plugins_by_name is None:
+            plugins_by_name = {}
+            for ext in self.extensions:
+                plugins_by_name.setdefault(
+                    utils.generate_fullname_for(ext.obj), ext.obj)
+            self._plugins_by_name = plugins_by_name
+
+        try:
+            return self._plugins_by_name[plugin_name]
+        except KeyError:
+            raise SecretStorePluginNotFound(plugin_name)
+
+    def _select_plugin(self, selection, supports):
+        """Gets the first plugin supports is true for, once per selection.
+
+        The selection is made of what is asked of the plugin, such as the
+        algorithm, bit length and mode of a key spec. These come from
+        requests, so only so many selections are remembered.
+        """
+        plugin = self._selections.get(selection)
+        if plugin is not None:
+            return plugin
+
+        for ext in self.extensions:
+            if supports(ext.obj):
+                plugin = ext.obj
+                break
+        else:
+            raise SecretStoreSupportedPluginNotFound()
+
+        if len(self._selections) < _MAX_PLUGIN_SELECTIONS:
+            self._selections[selection] = plugin
+        return plugin
+
     @_enforce_extensions_configured
     def get_plugin_store(self, key_spec, plugin_name=None,
                          transport_key_needed=False):
@@ -448,23 +502,19 @@ class SecretStorePluginManager(named.NamedExtensionManager):
         """
 
         if plugin_name is not None:
-            for ext in self.extensions:
-                if utils.generate_fullname_for(ext.obj) == plugin_name:
-                    return ext.obj
-            raise SecretStorePluginNotFound(plugin_name)
+            return self._get_plugin_by_name(plugin_name)
 
+        selection = ('store', _get_key_spec_selection(key_spec),
+                     transport_key_needed)
         if not transport_key_needed:
-            for ext in self.extensions:
-                if ext.obj.store_secret_supports(key_spec):
-                    return ext.obj
-
-        else:
-            for ext in self.extensions:
-                if (ext.obj.get_transport_key() is not None and
-                        ext.obj.store_secret_supports(key_spec)):
-                    return ext.obj
+            return self._select_plugin(
+                selection,
+                lambda plugin: plugin.store_secret_supports(key_spec))
 
-        raise SecretStoreSupportedPluginNotFound()
+        return self._select_plugin(
+            selection,
+            lambda plugin: (plugin.get_transport_key() is not None and
+                            plugin.store_secret_supports(key_spec)))
 
     @_enforce_extensions_configured
     def get_plugin_retrieve_delete(self, plugin_name):
@@ -473,10 +523,7 @@ class SecretStorePluginManager(named.NamedExtensionManager):
         :returns: SecretStoreBase plugin implementation
         """
 
-        for ext in self.extensions:
-            if utils.generate_fullname_for(ext.obj) == plugin_name:
-                return ext.obj
-        raise SecretStorePluginNotFound(plugin_name)
+        return self._get_plugin_by_name(plugin_name)
 
     @_enforce_extensions_configured
     def get_plugin_generate(self, key_spec):
@@ -487,7 +534,22 @@ class SecretStorePluginManager(named.NamedExtensionManager):
         :returns: SecretStoreBase plugin implementation
         """
 
-        for ext in self.extensions:
-            if ext.obj.generate_supports(key_spec):
-                return ext.obj
-        raise SecretStoreSupportedPluginNotFound()
+        return self._select_plugin(
+            ('generate', _get_key_spec_selection(key_spec)),
+            lambda plugin: plugin.generate_supports(key_spec))
+
+
+def get_manager():
+    """Return a singleton secret store plugin manager."""
+    # Only creating the manager takes the lock, once created it is simply
+    # returned.
+    if _SECRET_STORE is None:
+        _create_manager()
+    return _SECRET_STORE
+
+
+@lockutils.synchronized('secret_store_get_manager')
+def _create_manager():
+    global _SECRET_STORE
+    if _SECRET_STORE is None:
+        _SECRET_STORE = SecretStorePluginManager()
@@ -13,6 +13,7 @@
 
 from barbican.common import utils
 from barbican.model import models
+from barbican.model import repositories
 from barbican.plugin.interface import secret_store
 from barbican.plugin import store_crypto
 from barbican.plugin.util import translations as tr
@@ -23,7 +24,7 @@ def get_transport_key_model(key_spec, repos, transport_key_needed):
     if transport_key_needed:
         # get_plugin_store() will throw an exception if no suitable
         # plugin with transport key is found
-        plugin_manager = secret_store.SecretStorePluginManager()
+        plugin_manager = secret_store.get_manager()
         store_plugin = plugin_manager.get_plugin_store(
             key_spec=key_spec, transport_key_needed=True)
         plugin_name = utils.generate_fullname_for(store_plugin)
@@ -96,7 +97,7 @@ def store_secret(unencrypted_raw, content_type_raw, content_encoding,
         repos, transport_key_id)
 
     # Locate a suitable plugin to store the secret.
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     store_plugin = plugin_manager.get_plugin_store(
         key_spec=key_spec, plugin_name=plugin_name)
 
@@ -116,13 +117,16 @@ def store_secret(unencrypted_raw, content_type_raw, content_encoding,
                                         key_spec=key_spec,
                                         content_type=content_type,
                                         transport_key=transport_key)
-    secret_metadata = _store_secret(
-        store_plugin, secret_dto, secret_model, project_model)
+    # Store the secret, then save it and its metadata, flushing them all to
+    # the database together.
+    with repositories.deferred_flush():
+        secret_metadata = _store_secret(
+            store_plugin, secret_dto, secret_model, project_model)
 
-    # Save secret and metadata.
-    _save_secret(secret_model, project_model, repos)
-    _save_secret_metadata(secret_model, secret_metadata, store_plugin,
-                          content_type, repos)
+        # Save secret and metadata.
+        _save_secret(secret_model, project_model, repos)
+        _save_secret_metadata(secret_model, secret_metadata, store_plugin,
+                              content_type, repos)
 
     return secret_model, None
 
@@ -138,7 +142,7 @@ def get_secret(requesting_content_type, secret_model, project_model, repos,
         secret_metadata['transport_key'] = transport_key
 
     # Locate a suitable plugin to store the secret.
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     retrieve_plugin = plugin_manager.get_plugin_retrieve_delete(
         secret_metadata.get('plugin_name'))
 
@@ -160,7 +164,7 @@ def get_transport_key_id_for_retrieval(secret_model, repos):
 
     secret_metadata = _get_secret_meta(secret_model, repos)
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     retrieve_plugin = plugin_manager.get_plugin_retrieve_delete(
         secret_metadata.get('plugin_name'))
 
@@ -177,20 +181,22 @@ def generate_secret(spec, content_type,
                                     bit_length=spec.get('bit_length'),
                                     mode=spec.get('mode'))
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     generate_plugin = plugin_manager.get_plugin_generate(key_spec)
 
     # Create secret model to eventually save metadata to.
     secret_model = models.Secret(spec)
 
-    # Generate the secret.
-    secret_metadata = _generate_symmetric_key(
-        generate_plugin, key_spec, secret_model, project_model, content_type)
+    with repositories.deferred_flush():
+        # Generate the secret.
+        secret_metadata = _generate_symmetric_key(
+            generate_plugin, key_spec, secret_model, project_model,
+            content_type)
 
-    # Save secret and metadata.
-    _save_secret(secret_model, project_model, repos)
-    _save_secret_metadata(secret_model, secret_metadata, generate_plugin,
-                          content_type, repos)
+        # Save secret and metadata.
+        _save_secret(secret_model, project_model, repos)
+        _save_secret_metadata(secret_model, secret_metadata, generate_plugin,
+                              content_type, repos)
 
     return secret_model
 
@@ -203,7 +209,7 @@ def generate_asymmetric_secret(spec, content_type,
                                     bit_length=spec.get('bit_length'),
                                     passphrase=spec.get('passphrase'))
 
-    plugin_manager = secret_store.SecretStorePluginManager()
+    plugin_manager = secret_store.get_manager()
     generate_plugin = plugin_manager.get_plugin_generate(key_spec)
 
     # Create secret models to eventually save metadata to.
@@ -212,42 +218,45 @@ def generate_asymmetric_secret(spec, content_type,
     passphrase_secret_model = (models.Secret(spec)
                                if spec.get('passphrase') else None)
 
-    # Generate the secret.
-    asymmetric_meta_dto = _generate_asymmetric_key(
-        generate_plugin,
-        key_spec,
-        private_secret_model,
-        public_secret_model,
-        passphrase_secret_model,
-        project_model,
-        content_type
-    )
-
-    # Save secret and metadata.
-    _save_secret(private_secret_model, project_model, repos)
-    _save_secret_metadata(private_secret_model,
-                          asymmetric_meta_dto.private_key_meta,
-                          generate_plugin,
-                          content_type, repos)
-
-    _save_secret(public_secret_model, project_model, repos)
-    _save_secret_metadata(public_secret_model,
-                          asymmetric_meta_dto.public_key_meta,
-                          generate_plugin,
-                          content_type, repos)
+    # The secrets, their metadata and the container are flushed to the
+    # database together.
+    with repositories.deferred_flush():
+        # Generate the secret.
+        asymmetric_meta_dto = _generate_asymmetric_key(
+            generate_plugin,
+            key_spec,
+            private_secret_model,
+            public_secret_model,
+            passphrase_secret_model,
+            project_model,
+            content_type
+        )
 
-    if spec.get('passphrase'):
-        _save_secret(passphrase_secret_model, project_model, repos)
-        _save_secret_metadata(passphrase_secret_model,
-                              asymmetric_meta_dto.passphrase_meta,
+        # Save secret and metadata.
+        _save_secret(private_secret_model, project_model, repos)
+        _save_secret_metadata(private_secret_model,
+                              asymmetric_meta_dto.private_key_meta,
                               generate_plugin,
                               content_type, repos)
 
-    # Now create container
-    container_model = _save_container(spec, project_model, repos,
-                                      private_secret_model,
-                                      public_secret_model,
-                                      passphrase_secret_model)
+        _save_secret(public_secret_model, project_model, repos)
+        _save_secret_metadata(public_secret_model,
+                              asymmetric_meta_dto.public_key_meta,
+                              generate_plugin,
+                              content_type, repos)
+
+        if spec.get('passphrase'):
+            _save_secret(passphrase_secret_model, project_model, repos)
+            _save_secret_metadata(passphrase_secret_model,
+                                  asymmetric_meta_dto.passphrase_meta,
+                                  generate_plugin,
+                                  content_type, repos)
+
+        # Now create container
+        container_model = _save_container(spec, project_model, repos,
+                                          private_secret_model,
+                                          public_secret_model,
+                                          passphrase_secret_model)
 
     return container_model
 
@@ -255,23 +264,40 @@ def generate_asymmetric_secret(spec, content_type,
 def delete_secret(secret_model, project_id, repos):
     """Remove a secret from secure backend."""
 
-    secret_metadata = _get_secret_meta(secret_model, repos)
+    _delete_secret_from_store(secret_model, repos)
+
+    # Delete the secret from data model.
+    repos.secret_repo.delete_entity_by_id(entity_id=secret_model.id,
+                                          external_project_id=project_id)
+
+
+def expire_secret_from_store(secret_metadata):
+    """Remove an expired secret from secure backend.
+
+    Unlike delete_secret(), the secret is not deleted from the data model,
+    and its metadata are passed in, so that the secure backend need not be
+    called from within a database transaction.
+    """
 
+    _delete_metadata_from_store(secret_metadata)
+
+
+def _delete_secret_from_store(secret_model, repos):
+    _delete_metadata_from_store(_get_secret_meta(secret_model, repos))
+
+
+def _delete_metadata_from_store(secret_metadata):
     # We should only try to delete a secret using the plugin interface if
     # there's the metadata available. This addresses bug/1377330.
     if secret_metadata:
         # Locate a suitable plugin to delete the secret from.
-        plugin_manager = secret_store.SecretStorePluginManager()
+        plugin_manager = secret_store.get_manager()
         delete_plugin = plugin_manager.get_plugin_retrieve_delete(
             secret_metadata.get('plugin_name'))
 
         # Delete the secret from plugin storage.
         delete_plugin.delete_secret(secret_metadata)
 
-    # Delete the secret from data model.
-    repos.secret_repo.delete_entity_by_id(entity_id=secret_model.id,
-                                          external_project_id=project_id)
-
 
 def _store_secret(store_plugin, secret_dto, secret_model, project_model):
     if isinstance(store_plugin, store_crypto.StoreCryptoAdapterPlugin):
@@ -358,6 +384,7 @@ def _save_secret(secret_model, project_model, repos):
 
     # Create Secret entities in data store.
     if not secret_model.id:
+        secret_model.project_id = project_model.id
         repos.secret_repo.create_from(secret_model)
         new_assoc = models.ProjectSecret()
         new_assoc.project_id = project_model.id
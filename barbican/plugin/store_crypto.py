@@ -120,8 +120,11 @@ class StoreCryptoAdapterPlugin(object):
         # wrap the KEKDatum instance in our DTO
         kek_meta_dto = crypto.KEKMetaDTO(datum_model.kek_meta_project)
 
-        # Convert from text-based storage format to binary.
-        encrypted = base64.b64decode(datum_model.cypher_text)
+        encrypted = datum_model.binary_cypher_text
+        if encrypted is None:
+            # Stored before encrypted data were stored as binary, and not
+            # backfilled yet, so convert from the text-based storage format.
+            encrypted = base64.b64decode(datum_model.cypher_text)
         decrypt_dto = crypto.DecryptDTO(encrypted)
 
         # Decrypt the secret.
@@ -267,10 +270,22 @@ def _determine_generation_type(algorithm):
 
 
 def _find_or_create_kek_objects(plugin_inst, project_model):
-    kek_repo = repositories.get_kek_datum_repository()
+    """Returns the project's KEK datum, and its KEKMetaDTO, for the plugin.
 
-    # Find or create a key encryption key.
+    In the steady state, the KEK datum is a repositories.CachedKEKDatum
+    snapshot rather than a KEKDatum instance, found without querying the
+    database.
+    """
+    kek_cache = repositories.get_kek_datum_cache()
     full_plugin_name = utils.generate_fullname_for(plugin_inst)
+
+    cached_kek_datum = kek_cache.get_kek_datum(project_model.id,
+                                               full_plugin_name)
+    if cached_kek_datum:
+        return cached_kek_datum, crypto.KEKMetaDTO(cached_kek_datum)
+
+    # Find or create a key encryption key.
+    kek_repo = repositories.get_kek_datum_repository()
     kek_datum_model = kek_repo.find_or_create_kek_datum(project_model,
                                                         full_plugin_name)
 
@@ -288,6 +303,10 @@ def _find_or_create_kek_objects(plugin_inst, project_model):
 
         _indicate_bind_completed(kek_meta_dto, kek_datum_model)
         kek_repo.save(kek_datum_model)
+    else:
+        # Only cache KEK data bound by earlier requests, as those bound by
+        # this one are not committed yet.
+        kek_cache.add_kek_datum(kek_datum_model)
 
     return kek_datum_model, kek_meta_dto
 
@@ -297,6 +316,7 @@ def _store_secret_and_datum(
 
     # Create Secret entities in data store.
     if not secret_model.id:
+        secret_model.project_id = context.project_model.id
         repositories.get_secret_repository().create_from(secret_model)
         new_assoc = models.ProjectSecret()
         new_assoc.project_id = context.project_model.id
@@ -305,10 +325,12 @@ def _store_secret_and_datum(
         new_assoc.status = models.States.ACTIVE
         repositories.get_project_secret_repository().create_from(new_assoc)
 
-    # setup and store encrypted datum
-    datum_model = models.EncryptedDatum(secret_model, kek_datum_model)
+    # setup and store encrypted datum, by KEK datum id as the KEK datum may
+    # be a cached snapshot.
+    datum_model = models.EncryptedDatum(secret_model)
+    datum_model.kek_id = kek_datum_model.id
     datum_model.content_type = context.content_type
-    datum_model.cypher_text = base64.b64encode(generated_dto.cypher_text)
+    datum_model.binary_cypher_text = generated_dto.cypher_text
     datum_model.kek_meta_extended = generated_dto.kek_meta_extended
     datum_model.secret_id = secret_model.id
     repositories.get_encrypted_datum_repository().create_from(
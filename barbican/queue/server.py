@@ -24,6 +24,7 @@ from barbican.common import utils
 from barbican.model import repositories
 from barbican.openstack.common import service
 from barbican import queue
+from barbican.tasks import expiration
 from barbican.tasks import resources
 
 
@@ -121,6 +122,19 @@ class TaskServer(Tasks, service.Service):
         self._server.start()
         super(TaskServer, self).start()
 
+        sweep_interval = CONF.secret_expiration.sweep_interval
+        if sweep_interval > 0:
+            self.tg.add_timer(sweep_interval, self.sweep_expired_secrets,
+                              initial_delay=sweep_interval)
+
+    def sweep_expired_secrets(self):
+        """Deletes the expired secrets, in batches."""
+        try:
+            expiration.SecretExpirationSweeper().sweep()
+        except Exception:
+            # Keep the timer running for the next sweep.
+            LOG.exception(">>>>> Problem sweeping expired secrets.")
+
     def stop(self):
         super(TaskServer, self).stop()
         self._server.stop()
@@ -0,0 +1,150 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sweeper deleting expired secrets, run periodically on the worker nodes.
+"""
+import contextlib
+import datetime
+
+from oslo_config import cfg
+
+from barbican.common import utils
+from barbican import i18n as u
+from barbican.model import repositories as rep
+from barbican.openstack.common import timeutils
+from barbican.plugin import resources as plugin
+
+
+LOG = utils.getLogger(__name__)
+
+expiration_opt_group = cfg.OptGroup(name='secret_expiration',
+                                    title='Secret Expiration Options')
+
+expiration_opts = [
+    cfg.IntOpt('sweep_interval', default=300,
+               help=u._('Seconds between sweeps of the expired secrets by '
+                        'each worker node. Set to 0 to disable sweeping.')),
+    cfg.IntOpt('sweep_batch_size', default=100,
+               help=u._('Number of expired secrets looked up at a time.')),
+    cfg.IntOpt('sweep_claim_timeout', default=600,
+               help=u._('Seconds after which a sweep\'s claim on an expired '
+                        'secret lapses, so that a secret that failed to be '
+                        'deleted is retried. Should exceed the time taken '
+                        'to delete a secret from its secret store.')),
+]
+
+CONF = cfg.CONF
+CONF.register_group(expiration_opt_group)
+CONF.register_opts(expiration_opts, group=expiration_opt_group)
+
+
+class SecretExpirationSweeper(object):
+    """Deletes expired secrets, from their secret stores and data model.
+
+    Expired secrets are looked up in batches, and then deleted one at a
+    time. Each secret is first claimed, so that sweeps running concurrently
+    on several worker nodes do not delete the same secret twice, then
+    deleted from its secret store, and only then soft deleted. The claim and
+    the soft delete run in their own short transactions, and the secret
+    store is called in between, outside of any transaction.
+
+    Secrets that fail to be deleted from their secret store are skipped, and
+    retried once their claim lapsed. A database error ends the sweep.
+    """
+
+    def __init__(self, secret_repo=None, secret_meta_repo=None,
+                 repositories=None, db_start=rep.start, db_commit=rep.commit,
+                 db_rollback=rep.rollback, db_clear=rep.clear):
+        LOG.debug('Creating SecretExpirationSweeper')
+
+        self.db_start = db_start
+        self.db_commit = db_commit
+        self.db_rollback = db_rollback
+        self.db_clear = db_clear
+
+        self.repos = repositories
+        if not repositories:
+            self.repos = rep.Repositories(
+                secret_repo=secret_repo,
+                secret_meta_repo=secret_meta_repo)
+
+    def sweep(self):
+        """Deletes the expired secrets, returning how many were deleted."""
+        batch_size = CONF.secret_expiration.sweep_batch_size
+        marker = None
+        deleted = 0
+
+        while True:
+            try:
+                secret_ids, marker = self._get_expired(batch_size, marker)
+                for secret_id in secret_ids:
+                    if self._expire_secret(secret_id):
+                        deleted += 1
+            except Exception:
+                LOG.exception(u._LE('Problem sweeping expired secrets'))
+                break
+
+            if len(secret_ids) < batch_size:
+                break
+
+        if deleted:
+            LOG.info(u._LI('Deleted %s expired secrets'), deleted)
+        return deleted
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.db_start()
+        try:
+            yield
+            self.db_commit()
+        except Exception:
+            self.db_rollback()
+            raise
+        finally:
+            self.db_clear()
+
+    def _get_expired(self, batch_size, marker):
+        """Returns the ids of a batch of expired secrets, and its marker."""
+        with self._transaction():
+            secrets = self.repos.secret_repo.get_expired(batch_size,
+                                                         marker=marker)
+            if secrets:
+                marker = (secrets[-1].expiration, secrets[-1].id)
+            return [secret.id for secret in secrets], marker
+
+    def _expire_secret(self, secret_id):
+        """Expires the secret, returning True if this sweep deleted it."""
+        claim_timeout = datetime.timedelta(
+            seconds=CONF.secret_expiration.sweep_claim_timeout)
+        claimed_before = timeutils.utcnow() - claim_timeout
+
+        with self._transaction():
+            if not self.repos.secret_repo.claim_expired(secret_id,
+                                                        claimed_before):
+                # Deleted or claimed by another sweep meanwhile.
+                return False
+            secret_metadata = (
+                self.repos.secret_meta_repo.get_metadata_for_secret(
+                    secret_id))
+
+        try:
+            plugin.expire_secret_from_store(secret_metadata)
+        except Exception:
+            LOG.exception(u._LE('Problem deleting expired secret %s'),
+                          secret_id)
+            return False
+
+        with self._transaction():
+            self.repos.secret_repo.delete_expired(secret_id)
+        return True
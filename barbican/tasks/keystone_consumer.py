@@ -17,6 +17,7 @@
 Server-side Keystone notification payload processing logic.
 """
 
+from barbican.common import resources as res
 from barbican.common import utils
 from barbican import i18n as u
 from barbican.model import repositories as rep
@@ -142,6 +143,7 @@ class KeystoneEventConsumer(resources.BaseTask):
         project_id = project.id
 
         rep.delete_all_project_resources(project_id, self.repos)
+        res.get_project_cache().invalidate(project.external_id)
 
         # reached here means there is no error so log the successful
         # cleanup log entry.
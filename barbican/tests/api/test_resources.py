@@ -33,6 +33,7 @@ from barbican.api import app
 from barbican.api import controllers
 from barbican.common import exception as excep
 from barbican.common import hrefs
+from barbican.common import resources as c_resources
 from barbican.common import validators
 import barbican.context
 from barbican.model import models
@@ -156,6 +157,8 @@ class FunctionalTest(utils.BaseTestCase):
 
     def setUp(self):
         super(FunctionalTest, self).setUp()
+        # Don't let projects cached by one test leak into the next.
+        self.addCleanup(c_resources.get_project_cache().clear)
         root = self.root
         config = {'app': {'root': root}}
         pecan.set_config(config, overwrite=True)
@@ -370,10 +373,8 @@ class BaseSecretTestSuite(BaseSecretsResource):
 
         self.test_should_add_new_secret_one_step(check_project_id=False)
 
-        args, kwargs = self.project_repo.create_from.call_args
-        project = args[0]
-        self.assertIsInstance(project, models.Project)
-        self.assertEqual(self.external_project_id, project.external_id)
+        create = self.project_repo.create_by_external_project_id
+        create.assert_called_once_with(self.external_project_id)
 
     def test_should_add_new_secret_metadata_without_payload(self):
         self.app.post_json(
@@ -661,6 +662,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True,
             name=self.name,
             alg=None,
@@ -683,6 +686,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True,
             name='',
             alg=None,
@@ -705,6 +710,56 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
         self.assertTrue(resp.body.count(url_hrefs) ==
                         (self.num_secrets + 2))
 
+    def test_should_get_list_secrets_by_marker(self):
+        self.params['marker'] = 'id0'
+        # The repository also returns the first secret of the next page.
+        self.secret_repo.get_by_create_date.return_value = (
+            self.secrets[:self.limit + 1], 0, self.limit, None)
+
+        resp = self.app.get(
+            '/secrets/',
+            dict((k, v) for k, v in self.params.items() if v is not None)
+        )
+
+        self.secret_repo.get_by_create_date.assert_called_once_with(
+            self.external_project_id,
+            offset_arg=u'{0}'.format(self.offset),
+            limit_arg=u'{0}'.format(self.limit),
+            marker_arg=u'id0',
+            with_total=False,
+            suppress_exception=True,
+            name='',
+            alg=None,
+            mode=None,
+            bits=0
+        )
+
+        self.assertEqual(self.limit, len(resp.namespace['secrets']))
+        self.assertNotIn('total', resp.namespace)
+        self.assertNotIn('previous', resp.namespace)
+        self.assertIn('next', resp.namespace)
+        self.assertTrue(resp.namespace['next'].endswith(
+            '/secrets?limit={0}&marker=id{1}'.format(self.limit,
+                                                     self.limit - 1)))
+
+    def test_should_get_last_full_page_of_secrets_by_marker(self):
+        self.params['marker'] = 'id0'
+        self.params['total'] = 'true'
+        self.secret_repo.get_by_create_date.return_value = (
+            self.secrets[:self.limit], 0, self.limit, self.total)
+
+        resp = self.app.get(
+            '/secrets/',
+            dict((k, v) for k, v in self.params.items() if v is not None)
+        )
+
+        self.assertTrue(
+            self.secret_repo.get_by_create_date.call_args[1]['with_total'])
+        self.assertEqual(self.limit, len(resp.namespace['secrets']))
+        self.assertEqual(self.total, resp.namespace['total'])
+        self.assertNotIn('previous', resp.namespace)
+        self.assertNotIn('next', resp.namespace)
+
     def test_response_should_include_total(self):
         resp = self.app.get(
             '/secrets/',
@@ -714,6 +769,33 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
         self.assertIn('total', resp.namespace)
         self.assertEqual(resp.namespace['total'], self.total)
 
+    def test_response_should_omit_total_if_not_requested(self):
+        self.params['total'] = 'false'
+        self.secret_repo.get_by_create_date.return_value = (
+            self.secrets[:self.limit], self.offset, self.limit, None)
+
+        resp = self.app.get(
+            '/secrets/',
+            dict((k, v) for k, v in self.params.items() if v is not None)
+        )
+
+        self.secret_repo.get_by_create_date.assert_called_once_with(
+            self.external_project_id,
+            offset_arg=u'{0}'.format(self.offset),
+            limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=False,
+            suppress_exception=True,
+            name='',
+            alg=None,
+            mode=None,
+            bits=0
+        )
+
+        self.assertNotIn('total', resp.namespace)
+        self.assertIn('previous', resp.namespace)
+        self.assertIn('next', resp.namespace)
+
     def test_should_handle_no_secrets(self):
 
         del self.secrets[:]
@@ -727,6 +809,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True,
             name='',
             alg=None,
@@ -751,6 +835,8 @@ class WhenGettingSecretsListUsingSecretsResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True,
             name='',
             alg=None,
@@ -1549,6 +1635,8 @@ class WhenGettingOrdersListUsingOrdersResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True
         )
 
@@ -1582,6 +1670,8 @@ class WhenGettingOrdersListUsingOrdersResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True
         )
 
@@ -1960,6 +2050,53 @@ class WhenAddingNavigationHrefs(utils.BaseTestCase):
         self.assertIn('previous', data_with_hrefs)
         self.assertNotIn('next', data_with_hrefs)
 
+    def test_add_nav_hrefs_without_total_adds_next_if_page_full(self):
+        offset = 10
+        limit = 2
+        self.data[self.resource_name] = ['order1', 'order2']
+
+        data_with_hrefs = hrefs.add_nav_hrefs(
+            self.resource_name, offset, limit, None, self.data)
+
+        self.assertIn('previous', data_with_hrefs)
+        self.assertIn('next', data_with_hrefs)
+
+    def test_add_nav_hrefs_without_total_on_last_page_adds_previous_only(
+            self):
+        offset = 10
+        limit = 10
+        self.data[self.resource_name] = ['order1', 'order2']
+
+        data_with_hrefs = hrefs.add_nav_hrefs(
+            self.resource_name, offset, limit, None, self.data)
+
+        self.assertIn('previous', data_with_hrefs)
+        self.assertNotIn('next', data_with_hrefs)
+
+    def test_add_nav_hrefs_with_marker_adds_next_only(self):
+        limit = 2
+        self.data[self.resource_name] = ['order1', 'order2']
+
+        data_with_hrefs = hrefs.add_nav_hrefs(
+            self.resource_name, 0, limit, None, self.data,
+            marker='id2', has_next=True)
+
+        self.assertNotIn('previous', data_with_hrefs)
+        self.assertIn('next', data_with_hrefs)
+        self.assertIn('marker=id2', data_with_hrefs['next'])
+        self.assertNotIn('offset', data_with_hrefs['next'])
+
+    def test_add_nav_hrefs_with_marker_on_full_last_page_adds_nothing(self):
+        limit = 2
+        self.data[self.resource_name] = ['order1', 'order2']
+
+        data_with_hrefs = hrefs.add_nav_hrefs(
+            self.resource_name, 0, limit, self.num_elements, self.data,
+            marker='id2', has_next=False)
+
+        self.assertNotIn('previous', data_with_hrefs)
+        self.assertNotIn('next', data_with_hrefs)
+
 
 class TestingJsonSanitization(utils.BaseTestCase):
 
@@ -2050,8 +2187,15 @@ class WhenCreatingContainersUsingContainersResource(FunctionalTest):
         self.container_repo = mock.MagicMock()
         self.container_repo.create_from.return_value = None
 
+        self.secrets = []
+        for secret_ref in self.secret_refs:
+            secret = models.Secret()
+            secret.id = secret_ref['secret_ref']
+            self.secrets.append(secret)
+
         self.secret_repo = mock.MagicMock()
         self.secret_repo.create_from.return_value = None
+        self.secret_repo.get_many.return_value = self.secrets
 
         self.consumer_repo = mock.MagicMock()
         self.consumer_repo.create_from.return_value = None
@@ -2072,6 +2216,10 @@ class WhenCreatingContainersUsingContainersResource(FunctionalTest):
         container = args[0]
         self.assertIsInstance(container, models.Container)
 
+        self.secret_repo.get_many.assert_called_once_with(
+            ['1231', '1232', '1233'], self.external_project_id)
+        self.assertFalse(self.secret_repo.get.called)
+
     def _assert_returned_valid_container(self, resp):
         self.assertEqual(resp.status_int, 201)
         self.assertNotIn(self.external_project_id, resp.headers['Location'])
@@ -2120,13 +2268,24 @@ class WhenCreatingContainersUsingContainersResource(FunctionalTest):
         self.assertEqual(resp.status_int, 415)
 
     def test_should_throw_exception_when_secret_ref_doesnt_exist(self):
-        self.secret_repo.get.return_value = None
+        self.secret_repo.get_many.return_value = []
+        resp = self.app.post_json(
+            '/containers/',
+            self.container_req,
+            expect_errors=True
+        )
+        self.assertEqual(resp.status_int, 404)
+
+    def test_should_throw_exception_when_one_secret_ref_doesnt_exist(self):
+        self.secret_repo.get_many.return_value = self.secrets[:2]
         resp = self.app.post_json(
             '/containers/',
             self.container_req,
             expect_errors=True
         )
         self.assertEqual(resp.status_int, 404)
+        self.assertIn('test secret 3', resp.body)
+        self.assertFalse(self.container_repo.create_from.called)
 
 
 class WhenGettingOrDeletingContainerUsingContainerResource(FunctionalTest):
@@ -2460,6 +2619,8 @@ class WhenGettingOrDeletingConsumersUsingConsumerResource(FunctionalTest):
             self.container.id,
             limit_arg=None,
             offset_arg=0,
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True
         )
 
@@ -2736,6 +2897,8 @@ class WhenGettingContainersListUsingResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True
         )
 
@@ -2775,6 +2938,8 @@ class WhenGettingContainersListUsingResource(FunctionalTest):
             self.external_project_id,
             offset_arg=u'{0}'.format(self.offset),
             limit_arg=u'{0}'.format(self.limit),
+            marker_arg=None,
+            with_total=True,
             suppress_exception=True
         )
 
@@ -0,0 +1,123 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+
+from barbican.common import resources
+from barbican.model import models
+from barbican.tests import utils
+
+
+class WhenGettingOrCreatingProjects(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenGettingOrCreatingProjects, self).setUp()
+        self.addCleanup(resources.get_project_cache().clear)
+
+        self.project = models.Project()
+        self.project.id = 'projectid1234'
+        self.project.external_id = self.external_project_id
+
+        self.project_repo = mock.MagicMock()
+        self.project_repo.find_by_external_project_id.return_value = (
+            self.project)
+
+    def test_should_find_project(self):
+        project = resources.get_or_create_project(self.external_project_id,
+                                                  self.project_repo)
+
+        self.assertIs(self.project, project)
+        self.project_repo.find_by_external_project_id.assert_called_once_with(
+            self.external_project_id, suppress_exception=True)
+
+    def test_should_find_cached_project(self):
+        resources.get_or_create_project(self.external_project_id,
+                                        self.project_repo)
+        project = resources.get_or_create_project(self.external_project_id,
+                                                  self.project_repo)
+
+        self.assertEqual(1, self.project_repo.find_by_external_project_id.
+                         call_count)
+        self.assertEqual('projectid1234', project.id)
+        self.assertEqual(self.external_project_id, project.external_id)
+
+    def test_should_not_cache_project_if_disabled(self):
+        resources.CONF.set_override('project_cache_ttl', 0)
+        self.addCleanup(resources.CONF.clear_override, 'project_cache_ttl')
+
+        for i in range(2):
+            resources.get_or_create_project(self.external_project_id,
+                                            self.project_repo)
+
+        self.assertEqual(2, self.project_repo.find_by_external_project_id.
+                         call_count)
+
+    def test_should_create_project(self):
+        self.project_repo.find_by_external_project_id.return_value = None
+        self.project_repo.create_by_external_project_id.return_value = (
+            self.project)
+
+        project = resources.get_or_create_project(self.external_project_id,
+                                                  self.project_repo)
+
+        self.assertIs(self.project, project)
+        create = self.project_repo.create_by_external_project_id
+        create.assert_called_once_with(self.external_project_id)
+
+    def test_should_not_cache_created_project(self):
+        self.project_repo.find_by_external_project_id.return_value = None
+        self.project_repo.create_by_external_project_id.return_value = (
+            self.project)
+
+        resources.get_or_create_project(self.external_project_id,
+                                        self.project_repo)
+
+        self.assertIsNone(
+            resources.get_project_cache().get(self.external_project_id))
+
+
+class WhenUsingProjectCache(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenUsingProjectCache, self).setUp()
+        self.cache = resources.ProjectCache()
+
+    def test_should_get_added_project_id(self):
+        self.cache.add('external1', 'id1')
+        self.assertEqual('id1', self.cache.get('external1'))
+        self.assertIsNone(self.cache.get('external2'))
+
+    def test_should_invalidate_project_id(self):
+        self.cache.add('external1', 'id1')
+        self.cache.invalidate('external1')
+        self.assertIsNone(self.cache.get('external1'))
+
+    @mock.patch('time.time')
+    def test_should_expire_project_id(self, mock_time):
+        mock_time.return_value = 1000.0
+        self.cache.add('external1', 'id1')
+
+        mock_time.return_value = 1000.0 + resources.CONF.project_cache_ttl
+        self.assertIsNone(self.cache.get('external1'))
+
+    def test_should_evict_least_recently_used_project_id(self):
+        resources.CONF.set_override('project_cache_size', 2)
+        self.addCleanup(resources.CONF.clear_override, 'project_cache_size')
+
+        self.cache.add('external1', 'id1')
+        self.cache.add('external2', 'id2')
+        self.cache.get('external1')
+        self.cache.add('external3', 'id3')
+
+        self.assertEqual('id1', self.cache.get('external1'))
+        self.assertIsNone(self.cache.get('external2'))
+        self.assertEqual('id3', self.cache.get('external3'))
@@ -18,6 +18,8 @@ Warning: Do not merge this content with the utils.py module, as doing so will
 break the DevStack functional test discovery process.
 """
 
+from barbican.common import resources
+from barbican.model import models
 from barbican.model import repositories
 from barbican.tests import utils
 
@@ -36,6 +38,10 @@ class RepositoryTestCase(utils.BaseTestCase):
     def setUp(self):
         super(RepositoryTestCase, self).setUp()
 
+        # Don't let entities cached by one test leak into the next.
+        self.addCleanup(resources.get_project_cache().clear)
+        self.addCleanup(repositories.get_kek_datum_cache().clear)
+
         # Ensure we are using in-memory SQLite database, and creating tables.
         repositories.CONF.set_override("sql_connection", "sqlite:///:memory:")
         repositories.CONF.set_override("db_auto_create", True)
@@ -53,3 +59,59 @@ class RepositoryTestCase(utils.BaseTestCase):
 
     def _cleanup(self):
         repositories.clear()
+
+
+class EngineTestCase(utils.BaseTestCase):
+    """Base test case class for unit tests that reconfigure the database.
+
+    Unlike tests extending RepositoryTestCase, tests extending this class may
+    invoke the repositories.start()/start_read_only()/clear()/hard_reset()
+    methods, say to switch over to another database or to add a read engine.
+    The engines and session maker of the barbican/model/repositories.py
+    module are set aside before each test, and restored once the test is
+    completed and the engines it created are disposed of.
+    """
+    def setUp(self):
+        super(EngineTestCase, self).setUp()
+
+        # Don't let entities cached by one test leak into the next.
+        self.addCleanup(resources.get_project_cache().clear)
+        self.addCleanup(repositories.get_kek_datum_cache().clear)
+
+        saved = (repositories._ENGINE, repositories._READ_ENGINE,
+                 repositories._MAKER)
+        self.addCleanup(self._restore_engines, saved)
+        repositories._ENGINE = None
+        repositories._READ_ENGINE = None
+        repositories._MAKER = None
+
+        # Start with an in-memory SQLite database, as RepositoryTestCase does.
+        repositories.CONF.set_override("sql_connection", "sqlite:///:memory:")
+        repositories.CONF.set_override("db_auto_create", True)
+        repositories.CONF.set_override("debug", False)
+        repositories.start()
+
+    def use_database(self, connection):
+        """Switches over to the database at the connection URL.
+
+        The tables created in that database are dropped once the test is
+        completed.
+        """
+        repositories.CONF.set_override('sql_connection', connection)
+        self.addCleanup(repositories.CONF.clear_override, 'sql_connection')
+        repositories.clear()
+        repositories.hard_reset()
+        repositories.start()
+        self.addCleanup(models.BASE.metadata.drop_all,
+                        repositories.get_engine())
+
+    def _restore_engines(self, saved):
+        if repositories._MAKER:
+            repositories._MAKER.remove()
+        for engine in (repositories._ENGINE, repositories._READ_ENGINE):
+            if engine is not None and engine not in saved[:2]:
+                engine.dispose()
+
+        (repositories._ENGINE, repositories._READ_ENGINE,
+         repositories._MAKER) = saved
+        repositories.get_total_count_cache().clear()
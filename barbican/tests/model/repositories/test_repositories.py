@@ -17,6 +17,7 @@ import sqlalchemy
 from barbican.common import exception
 from barbican.model import models
 from barbican.model import repositories
+from barbican.openstack.common import timeutils
 from barbican.tests import database_utils
 from barbican.tests import utils
 
@@ -88,6 +89,137 @@ class WhenCleaningRepositoryPagingParameters(utils.BaseTestCase):
         self.assertEqual(self.CONF.max_limit_paging, clean_limit)
 
 
+class WhenCachingListTotals(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenCachingListTotals, self).setUp()
+        self.cache = repositories.TotalCountCache()
+        self.query = mock.MagicMock()
+        self.query.count.return_value = 42
+
+    def _set_ttl(self, ttl):
+        repositories.CONF.set_override('list_total_cache_ttl', ttl)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'list_total_cache_ttl')
+
+    def test_should_count_every_time_if_disabled(self):
+        self._set_ttl(0)
+
+        self.assertEqual(42, self.cache.get_total('key', self.query))
+        self.assertEqual(42, self.cache.get_total('key', self.query))
+
+        self.assertEqual(2, self.query.count.call_count)
+
+    def test_should_count_once_within_ttl(self):
+        self._set_ttl(60)
+
+        self.assertEqual(42, self.cache.get_total('key', self.query))
+        self.query.count.return_value = 43
+        self.assertEqual(42, self.cache.get_total('key', self.query))
+        self.assertEqual(43, self.cache.get_total('other', self.query))
+
+        self.assertEqual(2, self.query.count.call_count)
+
+    @mock.patch('time.time')
+    def test_should_count_again_after_ttl(self, mock_time):
+        self._set_ttl(60)
+        mock_time.return_value = 1000
+
+        self.cache.get_total('key', self.query)
+        mock_time.return_value = 1061
+        self.query.count.return_value = 43
+
+        self.assertEqual(43, self.cache.get_total('key', self.query))
+
+    def test_should_count_again_after_clear(self):
+        self._set_ttl(60)
+
+        self.cache.get_total('key', self.query)
+        self.cache.clear()
+        self.cache.get_total('key', self.query)
+
+        self.assertEqual(2, self.query.count.call_count)
+
+    def test_should_cache_by_default(self):
+        self.assertTrue(repositories.CONF.list_total_cache_ttl > 0)
+
+        self.cache.get_total('key', self.query)
+        self.cache.get_total('key', self.query)
+
+        self.assertEqual(1, self.query.count.call_count)
+
+    def test_should_evict_least_recently_used_when_full(self):
+        self._set_ttl(60)
+        repositories.CONF.set_override('list_total_cache_size', 2)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'list_total_cache_size')
+
+        self.cache.get_total('key1', self.query)
+        self.cache.get_total('key2', self.query)
+        self.cache.get_total('key1', self.query)
+        self.cache.get_total('key3', self.query)
+        self.assertEqual(3, self.query.count.call_count)
+
+        # Only the least recently used total was evicted.
+        self.cache.get_total('key1', self.query)
+        self.cache.get_total('key3', self.query)
+        self.assertEqual(3, self.query.count.call_count)
+        self.cache.get_total('key2', self.query)
+        self.assertEqual(4, self.query.count.call_count)
+
+
+class WhenCachingKEKData(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenCachingKEKData, self).setUp()
+        self.cache = repositories.get_kek_datum_cache()
+        self.repo = repositories.KEKDatumRepo()
+        session = self.repo.get_session()
+
+        self.project = models.Project()
+        self.project.external_id = 'my keystone id'
+        self.project.save(session=session)
+
+        self.kek_datum = self.repo.find_or_create_kek_datum(self.project,
+                                                            'plugin')
+        self.kek_datum.bind_completed = True
+        self.kek_datum.plugin_meta = 'plugin meta'
+        session.commit()
+
+    def test_should_cache_bound_kek_datum(self):
+        self.cache.add_kek_datum(self.kek_datum)
+
+        cached = self.cache.get_kek_datum(self.project.id, 'plugin')
+        self.assertIsInstance(cached, repositories.CachedKEKDatum)
+        self.assertEqual(self.kek_datum.id, cached.id)
+        self.assertEqual('plugin meta', cached.plugin_meta)
+        self.assertIsNone(self.cache.get_kek_datum(self.project.id, 'other'))
+
+    def test_should_not_cache_unbound_kek_datum(self):
+        self.kek_datum.bind_completed = False
+        self.cache.add_kek_datum(self.kek_datum)
+
+        self.assertIsNone(self.cache.get_kek_datum(self.project.id, 'plugin'))
+
+    def test_should_invalidate_on_deactivation(self):
+        self.cache.add_kek_datum(self.kek_datum)
+
+        self.kek_datum.active = False
+        self.repo.save(self.kek_datum)
+
+        self.assertIsNone(self.cache.get_kek_datum(self.project.id, 'plugin'))
+
+    def test_should_invalidate_on_project_cleanup(self):
+        self.cache.add_kek_datum(self.kek_datum)
+        repos = repositories.Repositories(
+            project_repo=None, project_secret_repo=None, secret_repo=None,
+            kek_repo=None, container_repo=None)
+
+        repositories.delete_all_project_resources(self.project.id, repos)
+
+        self.assertIsNone(self.cache.get_kek_datum(self.project.id, 'plugin'))
+
+
 class WhenInvokingExceptionMethods(utils.BaseTestCase):
 
     def setUp(self):
@@ -193,6 +325,78 @@ class WhenTestingBaseRepository(database_utils.RepositoryTestCase):
             exception_result.message)
 
 
+class WhenUsingReadEngine(database_utils.EngineTestCase):
+
+    def setUp(self):
+        super(WhenUsingReadEngine, self).setUp()
+        self.repo = repositories.ProjectRepo()
+
+        # A separate in-memory database stands in for the read replica.
+        repositories.CONF.set_override("sql_connection_read",
+                                       "sqlite:///:memory:")
+        self.addCleanup(repositories.CONF.clear_override,
+                        "sql_connection_read")
+
+        repositories.start_read_only()
+        read_engine = repositories.get_read_engine()
+        models.register_models(read_engine)
+        read_engine.execute(models.Project.__table__.insert().values(
+            id='replica-id', external_id='replica project',
+            created_at=timeutils.utcnow(), updated_at=timeutils.utcnow(),
+            deleted=False, status=models.States.ACTIVE))
+
+    def _create_project(self, external_id):
+        project = models.Project()
+        project.external_id = external_id
+        project.status = models.States.ACTIVE
+        self.repo.create_from(project)
+
+    def test_reads_use_read_engine(self):
+        project = self.repo.find_by_external_project_id('replica project')
+
+        self.assertEqual('replica-id', project.id)
+
+    def test_reads_stick_to_primary_after_flush(self):
+        self._create_project('primary project')
+
+        project = self.repo.find_by_external_project_id(
+            'primary project', suppress_exception=True)
+        replica_project = self.repo.find_by_external_project_id(
+            'replica project', suppress_exception=True)
+
+        self.assertEqual('primary project', project.external_id)
+        self.assertIsNone(replica_project)
+
+    def test_reads_stick_to_primary_after_update_statement(self):
+        session = repositories.get_session()
+        session.execute(models.Project.__table__.update().where(
+            models.Project.external_id == 'nothing').values(deleted=True))
+
+        replica_project = self.repo.find_by_external_project_id(
+            'replica project', suppress_exception=True)
+
+        self.assertIsNone(replica_project)
+
+    def test_read_write_start_uses_primary(self):
+        repositories.clear()
+        repositories.start()
+
+        replica_project = self.repo.find_by_external_project_id(
+            'replica project', suppress_exception=True)
+
+        self.assertIsNone(replica_project)
+
+    def test_read_only_start_without_read_connection_uses_primary(self):
+        repositories.clear()
+        repositories.CONF.clear_override("sql_connection_read")
+        repositories.hard_reset()
+        repositories.start_read_only()
+
+        self.assertIsNone(repositories.get_read_engine())
+        self.assertNotIn(repositories._READ_ONLY_KEY,
+                         repositories.get_session().info)
+
+
 class WhenTestingRepositoriesClass(utils.BaseTestCase):
 
     def setUp(self):
@@ -217,10 +421,11 @@ class WhenTestingWrapDbError(utils.BaseTestCase):
         repositories.CONF.set_override("sql_max_retries", 0)
         repositories.CONF.set_override("sql_retry_interval", 0)
 
-    @mock.patch('barbican.model.repositories.is_db_connection_error')
-    def test_should_raise_operational_error_is_connection_error(
-            self, mock_is_db_error):
-        mock_is_db_error.return_value = True
+        self.addCleanup(repositories.CONF.clear_override, "sql_max_retries")
+        self.addCleanup(repositories.CONF.clear_override,
+                        "sql_retry_interval")
+
+    def test_should_raise_operational_error_is_connection_error(self):
 
         @repositories.wrap_db_error
         def test_function():
@@ -231,6 +436,16 @@ class WhenTestingWrapDbError(utils.BaseTestCase):
             sqlalchemy.exc.OperationalError,
             test_function)
 
+    def test_should_retry_operational_error(self):
+        repositories.CONF.set_override("sql_max_retries", 1)
+        connect = mock.MagicMock(side_effect=[
+            sqlalchemy.exc.OperationalError('statement', 'params', 'orig'),
+            'connection'])
+        connect.func_name = 'connect'
+
+        self.assertEqual('connection', repositories.wrap_db_error(connect)())
+        self.assertEqual(2, connect.call_count)
+
 
 class WhenTestingGetEnginePrivate(utils.BaseTestCase):
 
@@ -269,39 +484,104 @@ class WhenTestingGetEnginePrivate(utils.BaseTestCase):
 
         engine.connect.assert_called_once_with()
 
+    @mock.patch('barbican.model.repositories._create_engine')
+    def test_should_not_pass_pool_args_by_default(self, mock_create_engine):
+        repositories.CONF.set_override("db_auto_create", False)
 
-class WhenTestingAutoGenerateTables(utils.BaseTestCase):
+        repositories._get_engine(None)
 
-    @mock.patch('barbican.model.migration.commands.upgrade')
-    def test_should_complete_with_alembic_database_update(
-            self, mock_commands_upgrade):
+        engine_args = mock_create_engine.call_args[1]
+        self.assertNotIn('pool_size', engine_args)
+        self.assertNotIn('max_overflow', engine_args)
+        self.assertNotIn('pool_timeout', engine_args)
 
-        tables = dict(
-            alembic_version='version')  # Mimic tables already created.
-        engine = 'engine'
+    @mock.patch('barbican.model.repositories._create_engine')
+    def test_should_pass_configured_pool_args(self, mock_create_engine):
+        repositories.CONF.set_override("db_auto_create", False)
+        repositories.CONF.set_override("sql_pool_size", 20)
+        repositories.CONF.set_override("sql_pool_max_overflow", 5)
+        repositories.CONF.set_override("sql_pool_timeout", 3)
+        self.addCleanup(repositories.CONF.clear_override, "sql_pool_size")
+        self.addCleanup(repositories.CONF.clear_override,
+                        "sql_pool_max_overflow")
+        self.addCleanup(repositories.CONF.clear_override, "sql_pool_timeout")
 
-        # Invoke method under test.
-        repositories._auto_generate_tables(engine, tables)
+        repositories._get_engine(None)
 
-        mock_commands_upgrade.assert_called_once_with()
+        engine_args = mock_create_engine.call_args[1]
+        self.assertEqual(20, engine_args['pool_size'])
+        self.assertEqual(5, engine_args['max_overflow'])
+        self.assertEqual(3, engine_args['pool_timeout'])
 
 
-class WhenTestingIsDbConnectionError(utils.BaseTestCase):
+class WhenTestingConnectionPool(utils.BaseTestCase):
 
-    def test_should_return_false_no_error_code_in_args(self):
+    def setUp(self):
+        super(WhenTestingConnectionPool, self).setUp()
+        self.engine = repositories._create_engine('sqlite://')
+        self.addCleanup(self.engine.dispose)
+
+    def test_should_track_connections_in_use(self):
+        connection = self.engine.connect()
+        stats = self.engine.pool_stats.as_dict()
+        self.assertEqual(1, stats['in_use'])
+        self.assertEqual(1, stats['checkouts'])
+
+        connection.close()
+        stats = self.engine.pool_stats.as_dict()
+        self.assertEqual(0, stats['in_use'])
+        self.assertEqual(1, stats['checkouts'])
+        self.assertEqual(0, stats['checkout_timeouts'])
+        self.assertTrue(stats['checkout_wait_max'] >= 0)
+
+    def test_should_count_checkout_timeouts(self):
+        checkout = mock.MagicMock(side_effect=sqlalchemy.exc.TimeoutError())
+
+        self.assertRaises(sqlalchemy.exc.TimeoutError,
+                          self.engine.pool_stats._timed(checkout))
+
+        self.assertEqual(
+            1, self.engine.pool_stats.as_dict()['checkout_timeouts'])
+
+    def test_should_raise_disconnection_error_for_stale_connection(self):
+        dbapi_connection = mock.MagicMock()
+        dbapi_connection.cursor.return_value.execute.side_effect = (
+            Exception('MySQL server has gone away'))
+
+        self.assertRaises(
+            sqlalchemy.exc.DisconnectionError,
+            repositories._ping_connection,
+            dbapi_connection, None, None)
+
+    def test_should_ping_live_connection(self):
+        dbapi_connection = mock.MagicMock()
+
+        repositories._ping_connection(dbapi_connection, None, None)
+
+        dbapi_connection.cursor.return_value.execute.assert_called_once_with(
+            'SELECT 1')
 
-        args = mock.MagicMock()
-        args.find.return_value = -1
 
-        result = repositories.is_db_connection_error(args)
+class WhenGettingPoolStats(database_utils.RepositoryTestCase):
 
-        self.assertFalse(result)
+    def test_should_report_primary_engine_only(self):
+        stats = repositories.get_pool_stats()
 
-    def test_should_return_true_error_code_found_in_args(self):
+        self.assertEqual(['primary'], list(stats))
+        self.assertIn('in_use', stats['primary'])
 
-        args = mock.MagicMock()
-        args.find.return_value = 1
 
-        result = repositories.is_db_connection_error(args)
+class WhenTestingAutoGenerateTables(utils.BaseTestCase):
 
-        self.assertTrue(result)
+    @mock.patch('barbican.model.migration.commands.upgrade')
+    def test_should_complete_with_alembic_database_update(
+            self, mock_commands_upgrade):
+
+        tables = dict(
+            alembic_version='version')  # Mimic tables already created.
+        engine = 'engine'
+
+        # Invoke method under test.
+        repositories._auto_generate_tables(engine, tables)
+
+        mock_commands_upgrade.assert_called_once_with()
@@ -0,0 +1,88 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+
+import mock
+
+from barbican.model import models
+from barbican.model import repositories
+from barbican.tests import database_utils
+
+
+class WhenBackfillingBinaryCypherText(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenBackfillingBinaryCypherText, self).setUp()
+        self.session = repositories.get_session()
+
+        self.project = models.Project()
+        self.project.external_id = 'my keystone id'
+        self.project.save(session=self.session)
+
+        self.kek_datum = models.KEKDatum()
+        self.kek_datum.plugin_name = 'plugin'
+        self.kek_datum.project_id = self.project.id
+        self.kek_datum.save(session=self.session)
+
+        self.secret = models.Secret()
+        self.secret.project_id = self.project.id
+        self.secret.save(session=self.session)
+
+        self.session.commit()
+
+    def _create_datum(self, cypher_text=None, binary_cypher_text=None):
+        datum = models.EncryptedDatum(self.secret, self.kek_datum)
+        datum.cypher_text = cypher_text
+        datum.binary_cypher_text = binary_cypher_text
+        datum.save(session=self.session)
+        self.session.commit()
+        return datum.id
+
+    def _get_cypher_texts(self, datum_id):
+        self.session.expire_all()
+        datum = self.session.query(models.EncryptedDatum).get(datum_id)
+        return datum.cypher_text, datum.binary_cypher_text
+
+    def test_converts_text_cypher_text(self):
+        datum_id = self._create_datum(
+            cypher_text=base64.b64encode(b'\x00\xff'))
+
+        self.assertEqual(1, repositories.backfill_binary_cypher_text())
+
+        self.assertEqual((None, b'\x00\xff'),
+                         self._get_cypher_texts(datum_id))
+
+    def test_keeps_binary_cypher_text(self):
+        datum_id = self._create_datum(binary_cypher_text=b'\x00\xff')
+
+        self.assertEqual(0, repositories.backfill_binary_cypher_text())
+
+        self.assertEqual((None, b'\x00\xff'),
+                         self._get_cypher_texts(datum_id))
+
+    @mock.patch('time.sleep')
+    def test_converts_in_batches(self, mock_sleep):
+        datum_ids = [self._create_datum(cypher_text=base64.b64encode(str(i)))
+                     for i in range(5)]
+        progress = mock.MagicMock()
+
+        converted = repositories.backfill_binary_cypher_text(
+            batch_size=2, batch_pause=0.5, progress=progress)
+
+        self.assertEqual(5, converted)
+        self.assertEqual([(None, str(i)) for i in range(5)],
+                         [self._get_cypher_texts(datum_id)
+                          for datum_id in datum_ids])
+        self.assertEqual([mock.call(2), mock.call(4), mock.call(5)],
+                         progress.call_args_list)
+        mock_sleep.assert_called_with(0.5)
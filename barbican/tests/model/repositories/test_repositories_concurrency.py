@@ -0,0 +1,116 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+
+import testtools
+
+from barbican.common import resources
+from barbican.model import models
+from barbican.model import repositories
+from barbican.tests import database_utils
+
+# Set to a PostgreSQL connection URL to also run the tests there, as the
+# 'postgresql' tox environment does.
+POSTGRESQL_CONNECTION = os.environ.get('BARBICAN_TEST_POSTGRESQL_CONNECTION')
+
+
+class WhenFindingOrCreatingConcurrently(database_utils.EngineTestCase):
+    """Races many threads to find or create the same project and KEK datum.
+
+    Each thread runs in its own session and transaction, as requests do, so
+    the tests need a database shared by several connections: a SQLite
+    database file rather than the in-memory one of the base fixture.
+    """
+
+    thread_count = 20
+
+    def setUp(self):
+        super(WhenFindingOrCreatingConcurrently, self).setUp()
+        self._switch_database()
+
+        self.external_project_id = 'my keystone id'
+        self.start = threading.Event()
+        self.results = []
+        self.errors = []
+
+    def _switch_database(self):
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir)
+        self.use_database(
+            'sqlite:///' + os.path.join(db_dir, 'barbican.sqlite'))
+
+    def _find_or_create(self):
+        self.start.wait()
+        session = repositories.get_session()
+        try:
+            project = resources.get_or_create_project(
+                self.external_project_id,
+                repositories.ProjectRepo())
+            kek_repo = repositories.KEKDatumRepo()
+            kek_datum = kek_repo.find_or_create_kek_datum(project, 'plugin')
+            session.commit()
+            self.results.append((project.id, kek_datum.id))
+        except Exception as e:
+            session.rollback()
+            self.errors.append(e)
+        finally:
+            repositories.clear()
+
+    def _race(self):
+        threads = [threading.Thread(target=self._find_or_create)
+                   for i in range(self.thread_count)]
+        for thread in threads:
+            thread.start()
+        self.start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], self.errors)
+        self.assertEqual(self.thread_count, len(self.results))
+
+    def _get_all(self, model):
+        return repositories.get_session().query(model).all()
+
+    def test_should_create_one_project_and_kek_datum(self):
+        self._race()
+
+        projects = self._get_all(models.Project)
+        kek_data = self._get_all(models.KEKDatum)
+        self.assertEqual(1, len(projects))
+        self.assertEqual(1, len(kek_data))
+        self.assertEqual(set([(projects[0].id, kek_data[0].id)]),
+                         set(self.results))
+
+    def test_should_find_existing_project(self):
+        project = models.Project()
+        project.external_id = self.external_project_id
+        project.save()
+        repositories.get_session().commit()
+
+        self._race()
+
+        self.assertEqual([project.id],
+                         [p.id for p in self._get_all(models.Project)])
+        self.assertEqual(1, len(self._get_all(models.KEKDatum)))
+
+
+@testtools.skipUnless(POSTGRESQL_CONNECTION,
+                      'BARBICAN_TEST_POSTGRESQL_CONNECTION is not set')
+class WhenFindingOrCreatingConcurrentlyOnPostgreSQL(
+        WhenFindingOrCreatingConcurrently):
+
+    def _switch_database(self):
+        self.use_database(POSTGRESQL_CONNECTION)
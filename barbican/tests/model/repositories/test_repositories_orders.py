@@ -47,6 +47,34 @@ class WhenTestingOrderRepository(database_utils.RepositoryTestCase):
             session=session,
             suppress_exception=False)
 
+    def test_get_by_create_date_with_marker(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        orders = []
+        for i in range(3):
+            order = models.Order()
+            order.project_id = project.id
+            orders.append(self.repo.create_from(order, session=session))
+
+        session.commit()
+        orders.sort(key=lambda o: (o.created_at, o.id))
+
+        entities, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            limit_arg=1,
+            marker_arg=orders[0].id,
+            session=session)
+
+        # The first order of the next page is returned too.
+        self.assertEqual([orders[1].id, orders[2].id],
+                         [o.id for o in entities])
+        self.assertEqual(0, offset)
+        self.assertEqual(3, total)
+
     def test_get_order(self):
         session = self.repo.get_session()
 
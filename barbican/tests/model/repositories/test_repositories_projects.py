@@ -47,3 +47,27 @@ class WhenTestingProjectRepository(database_utils.RepositoryTestCase):
             "my keystone id",
             session=session,
             suppress_exception=False)
+
+    def test_should_create_project_by_external_id(self):
+        session = self.repo.get_session()
+
+        project = self.repo.create_by_external_project_id(
+            "my keystone id", session=session)
+
+        self.assertEqual("my keystone id", project.external_id)
+        self.assertEqual(models.States.ACTIVE, project.status)
+        self.assertEqual(project.id, self.repo.find_by_external_project_id(
+            "my keystone id", session=session).id)
+
+    def test_should_return_project_created_concurrently(self):
+        session = self.repo.get_session()
+        existing = models.Project()
+        existing.external_id = "my keystone id"
+        existing.status = models.States.ACTIVE
+        self.repo.create_from(existing, session=session)
+
+        project = self.repo.create_by_external_project_id(
+            "my keystone id", session=session)
+
+        self.assertEqual(existing.id, project.id)
+        self.assertEqual(1, session.query(models.Project).count())
@@ -0,0 +1,143 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import mock
+
+from barbican.model import models
+from barbican.model import repositories
+from barbican.openstack.common import timeutils
+from barbican.tests import database_utils
+
+
+class WhenPurgingDeletedEntities(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenPurgingDeletedEntities, self).setUp()
+        self.session = repositories.get_session()
+        self.long_ago = timeutils.utcnow() - datetime.timedelta(days=100)
+
+        self.project = models.Project()
+        self.project.external_id = 'my keystone id'
+        self.project.save(session=self.session)
+
+        self.kek_datum = models.KEKDatum()
+        self.kek_datum.plugin_name = 'plugin'
+        self.kek_datum.project_id = self.project.id
+        self.kek_datum.save(session=self.session)
+
+        self.session.commit()
+
+    def _create_secret(self, deleted_at=None):
+        secret = models.Secret()
+        secret.project_id = self.project.id
+        secret.save(session=self.session)
+
+        children = [models.EncryptedDatum(secret, self.kek_datum),
+                    models.SecretStoreMetadatum('key', 'value')]
+        children[1].secret_id = secret.id
+
+        project_secret = models.ProjectSecret()
+        project_secret.secret_id = secret.id
+        project_secret.project_id = self.project.id
+        children.append(project_secret)
+
+        for entity in [secret] + children:
+            if deleted_at:
+                entity.deleted = True
+                entity.deleted_at = deleted_at
+            entity.save(session=self.session)
+
+        self.session.commit()
+        return secret.id
+
+    def _count(self, model):
+        return self.session.query(model).count()
+
+    def test_purges_entities_deleted_long_ago(self):
+        self._create_secret(deleted_at=self.long_ago)
+        live_secret_id = self._create_secret()
+
+        purged = repositories.purge_deleted(90)
+
+        self.assertEqual(1, purged['secrets'])
+        self.assertEqual(1, purged['encrypted_data'])
+        self.assertEqual(1, purged['secret_store_metadata'])
+        self.assertEqual(1, purged['project_secret'])
+        self.assertEqual(
+            [live_secret_id],
+            [s.id for s in self.session.query(models.Secret)])
+        self.assertEqual(1, self._count(models.EncryptedDatum))
+        self.assertEqual(1, self._count(models.SecretStoreMetadatum))
+        self.assertEqual(1, self._count(models.ProjectSecret))
+
+    def test_keeps_entities_deleted_recently(self):
+        self._create_secret(deleted_at=timeutils.utcnow())
+
+        purged = repositories.purge_deleted(90)
+
+        self.assertEqual(0, purged['secrets'])
+        self.assertEqual(1, self._count(models.Secret))
+
+    def test_keeps_deleted_entities_still_referenced(self):
+        secret_id = self._create_secret(deleted_at=self.long_ago)
+        order = models.Order()
+        order.project_id = self.project.id
+        order.secret_id = secret_id
+        order.save(session=self.session)
+        self.session.commit()
+
+        purged = repositories.purge_deleted(90)
+
+        # The secret's children are purged, but not the secret the live
+        # order still references.
+        self.assertEqual(0, purged['secrets'])
+        self.assertEqual(1, purged['encrypted_data'])
+        self.assertEqual(1, self._count(models.Secret))
+
+    @mock.patch('time.sleep')
+    def test_purges_in_batches(self, mock_sleep):
+        for i in range(5):
+            self._create_secret(deleted_at=self.long_ago)
+        progress = mock.MagicMock()
+
+        purged = repositories.purge_deleted(90, batch_size=2,
+                                            batch_pause=0.5,
+                                            progress=progress)
+
+        self.assertEqual(5, purged['secrets'])
+        self.assertEqual(0, self._count(models.Secret))
+        self.assertIn(mock.call('secrets', 2), progress.call_args_list)
+        self.assertIn(mock.call('secrets', 4), progress.call_args_list)
+        self.assertIn(mock.call('secrets', 5), progress.call_args_list)
+        mock_sleep.assert_called_with(0.5)
+
+    def test_purges_secrets_deleted_through_the_repository(self):
+        secret_id = self._create_secret()
+        repositories.get_secret_repository().delete_entity_by_id(
+            secret_id, 'my keystone id', session=self.session)
+        self.session.commit()
+
+        # Age every row the delete soft deleted past the purge cutoff.
+        for model in (models.Secret, models.EncryptedDatum,
+                      models.SecretStoreMetadatum, models.ProjectSecret):
+            self.session.query(model).filter_by(deleted=True).update(
+                {'deleted_at': self.long_ago}, synchronize_session=False)
+        self.session.commit()
+
+        purged = repositories.purge_deleted(90)
+
+        self.assertEqual(1, purged['secrets'])
+        self.assertEqual(1, purged['project_secret'])
+        self.assertEqual(0, self._count(models.Secret))
+        self.assertEqual(0, self._count(models.ProjectSecret))
@@ -0,0 +1,238 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+import sqlalchemy as sa
+import testtools
+
+from barbican.model import models
+from barbican.model import repositories
+from barbican.tests import database_utils
+
+# Set to a PostgreSQL connection URL to also check the query plans there.
+POSTGRESQL_CONNECTION = os.environ.get('BARBICAN_TEST_POSTGRESQL_CONNECTION')
+
+# SQLite reports full table scans as 'SCAN <table>' (or 'SCAN TABLE <table>'
+# in older releases), whereas subqueries show up as 'SCAN <anon alias>'.
+SQLITE_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(?!anon_)(\w+)')
+
+# Matches the table purged by the SELECT statements of purge_deleted().
+PURGE_SELECT_PATTERN = re.compile(r'^SELECT \w+\.id\s+FROM (\w+)')
+
+
+class WhenExplainingRepositoryQueries(database_utils.EngineTestCase):
+    """Asserts that the repository queries are all served by indexes.
+
+    Each test captures the SELECT statements issued by a repository call and
+    checks their query plans for full table scans.
+    """
+
+    def setUp(self):
+        super(WhenExplainingRepositoryQueries, self).setUp()
+        self._create_entities()
+
+    def _create_entities(self):
+        session = repositories.get_session()
+
+        self.project = models.Project()
+        self.project.external_id = 'my keystone id'
+        self.project.save(session=session)
+
+        self.kek_datum = models.KEKDatum()
+        self.kek_datum.plugin_name = 'plugin'
+        self.kek_datum.project_id = self.project.id
+        self.kek_datum.save(session=session)
+
+        self.secret = models.Secret()
+        self.secret.project_id = self.project.id
+        self.secret.save(session=session)
+
+        datum = models.EncryptedDatum(self.secret, self.kek_datum)
+        datum.save(session=session)
+
+        meta = models.SecretStoreMetadatum('key', 'value')
+        meta.secret_id = self.secret.id
+        meta.save(session=session)
+
+        self.order = models.Order()
+        self.order.project_id = self.project.id
+        self.order.save(session=session)
+
+        order_meta = models.OrderPluginMetadatum('key', 'value')
+        order_meta.order_id = self.order.id
+        order_meta.save(session=session)
+
+        self.container = models.Container()
+        self.container.project_id = self.project.id
+        self.container.save(session=session)
+
+        consumer = models.ContainerConsumerMetadatum(
+            self.container.id, {'name': 'name', 'URL': 'www.foo.com'})
+        consumer.save(session=session)
+
+        transport_key = models.TransportKey('plugin', 'key')
+        transport_key.save(session=session)
+
+        session.commit()
+
+    def _capture_selects(self, func, *args, **kwargs):
+        """Calls func, returning the SELECT statements that it issued."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        engine = repositories.get_engine()
+        sa.event.listen(engine, 'before_cursor_execute',
+                        before_cursor_execute)
+        try:
+            func(*args, **kwargs)
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute',
+                            before_cursor_execute)
+
+        self.assertNotEqual([], statements)
+        return statements
+
+    def _get_full_scans(self, statement, parameters):
+        engine = repositories.get_engine()
+        if engine.dialect.name == 'sqlite':
+            rows = engine.execute('EXPLAIN QUERY PLAN ' + statement,
+                                  parameters)
+            details = [row['detail'] for row in rows]
+            return [d for d in details if SQLITE_SCAN_PATTERN.match(d)]
+
+        connection = engine.connect()
+        try:
+            # Discourage sequential scans, as the planner would otherwise
+            # prefer them on tables as small as the ones created here.
+            connection.execute('SET enable_seqscan = off')
+            rows = connection.execute('EXPLAIN ' + statement, parameters)
+            details = [row[0] for row in rows]
+        finally:
+            connection.close()
+        return [d for d in details if 'Seq Scan' in d]
+
+    def _assert_no_full_scans(self, func, *args, **kwargs):
+        for statement, parameters in self._capture_selects(
+                func, *args, **kwargs):
+            self.assertEqual(
+                [], self._get_full_scans(statement, parameters),
+                'Full scan in query: {0}'.format(statement))
+
+    def test_secret_get_by_create_date(self):
+        self._assert_no_full_scans(
+            repositories.SecretRepo().get_by_create_date,
+            self.project.external_id)
+
+    def test_secret_get_by_create_date_with_marker(self):
+        self._assert_no_full_scans(
+            repositories.SecretRepo().get_by_create_date,
+            self.project.external_id, marker_arg=self.secret.id,
+            suppress_exception=True)
+
+    def test_secret_get(self):
+        self._assert_no_full_scans(
+            repositories.SecretRepo().get,
+            self.secret.id, self.project.external_id)
+
+    def test_secret_get_project_entities(self):
+        self._assert_no_full_scans(
+            repositories.SecretRepo().get_project_entities, self.project.id)
+
+    def test_secret_get_expired(self):
+        self._assert_no_full_scans(
+            repositories.SecretRepo().get_expired, 100)
+
+    def test_secret_store_metadata_for_secret(self):
+        self._assert_no_full_scans(
+            repositories.SecretStoreMetadatumRepo().get_metadata_for_secret,
+            self.secret.id)
+
+    def test_find_or_create_kek_datum(self):
+        self._assert_no_full_scans(
+            repositories.KEKDatumRepo().find_or_create_kek_datum,
+            self.project, 'plugin')
+
+    def test_order_get_by_create_date(self):
+        self._assert_no_full_scans(
+            repositories.OrderRepo().get_by_create_date,
+            self.project.external_id)
+
+    def test_order_get(self):
+        self._assert_no_full_scans(
+            repositories.OrderRepo().get,
+            self.order.id, self.project.external_id)
+
+    def test_order_plugin_metadata_for_order(self):
+        self._assert_no_full_scans(
+            repositories.OrderPluginMetadatumRepo().get_metadata_for_order,
+            self.order.id)
+
+    def test_container_get_by_create_date(self):
+        self._assert_no_full_scans(
+            repositories.ContainerRepo().get_by_create_date,
+            self.project.external_id)
+
+    def test_container_get(self):
+        self._assert_no_full_scans(
+            repositories.ContainerRepo().get,
+            self.container.id, self.project.external_id)
+
+    def test_consumer_get_by_container_id(self):
+        self._assert_no_full_scans(
+            repositories.ContainerConsumerRepo().get_by_container_id,
+            self.container.id)
+
+    def test_consumer_get_by_values(self):
+        self._assert_no_full_scans(
+            repositories.ContainerConsumerRepo().get_by_values,
+            self.container.id, 'name', 'www.foo.com')
+
+    def test_project_find_by_external_project_id(self):
+        self._assert_no_full_scans(
+            repositories.ProjectRepo().find_by_external_project_id,
+            self.project.external_id)
+
+    def test_get_latest_transport_key(self):
+        self._assert_no_full_scans(
+            repositories.TransportKeyRepo().get_latest_transport_key,
+            'plugin')
+
+    def test_purge_deleted(self):
+        # The deleted rows of the purged table are scanned, but the rows
+        # referencing each of them must be looked up by index.
+        for statement, parameters in self._capture_selects(
+                repositories.purge_deleted, 0):
+            purged_table = PURGE_SELECT_PATTERN.match(statement).group(1)
+            scans = [
+                d for d in self._get_full_scans(statement, parameters)
+                if not re.search(r'\b{0}\b'.format(purged_table), d)]
+            self.assertEqual([], scans,
+                             'Full scan in query: {0}'.format(statement))
+
+
+@testtools.skipUnless(POSTGRESQL_CONNECTION,
+                      'BARBICAN_TEST_POSTGRESQL_CONNECTION is not set')
+class WhenExplainingRepositoryQueriesOnPostgreSQL(
+        WhenExplainingRepositoryQueries):
+
+    def _create_entities(self):
+        # The base fixture started an in-memory SQLite database, so switch
+        # over to PostgreSQL before creating the entities.
+        self.use_database(POSTGRESQL_CONNECTION)
+        super(WhenExplainingRepositoryQueriesOnPostgreSQL,
+              self)._create_entities()
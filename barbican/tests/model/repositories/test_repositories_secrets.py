@@ -10,9 +10,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
+import mock
+import sqlalchemy
+
 from barbican.common import exception
 from barbican.model import models
 from barbican.model import repositories
+from barbican.openstack.common import timeutils
 from barbican.tests import database_utils
 from barbican.tests import utils
 
@@ -58,6 +64,7 @@ class WhenTestingSecretRepository(database_utils.RepositoryTestCase):
         project_secret = models.ProjectSecret()
         project_secret.secret_id = secret.id
         project_secret.project_id = project.id
+        secret.project_id = project.id
         project_secret.save(session=session)
 
         session.commit()
@@ -92,11 +99,13 @@ class WhenTestingSecretRepository(database_utils.RepositoryTestCase):
         project_secret1 = models.ProjectSecret()
         project_secret1.secret_id = secret1.id
         project_secret1.project_id = project.id
+        secret1.project_id = project.id
         project_secret1.save(session=session)
 
         project_secret2 = models.ProjectSecret()
         project_secret2.secret_id = secret2.id
         project_secret2.project_id = project.id
+        secret2.project_id = project.id
         project_secret2.save(session=session)
 
         session.commit()
@@ -126,6 +135,50 @@ class WhenTestingSecretRepository(database_utils.RepositoryTestCase):
         self.assertEqual(limit, 10)
         self.assertEqual(total, 0)
 
+    def test_get_by_create_date_ignores_other_projects(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+        other_project = models.Project()
+        other_project.external_id = "other keystone id"
+        other_project.save(session=session)
+
+        secret = models.Secret()
+        secret.project_id = project.id
+        self.repo.create_from(secret, session=session)
+        other_secret = models.Secret()
+        other_secret.project_id = other_project.id
+        self.repo.create_from(other_secret, session=session)
+
+        session.commit()
+
+        secrets, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            session=session,
+        )
+
+        self.assertEqual([secret.id], [s.id for s in secrets])
+        self.assertEqual(1, total)
+
+    def test_get_project_entities_uses_secret_project_id(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        secret = models.Secret()
+        secret.project_id = project.id
+        self.repo.create_from(secret, session=session)
+
+        session.commit()
+
+        secrets = self.repo.get_project_entities(project.id, session=session)
+
+        self.assertEqual([secret.id], [s.id for s in secrets])
+
     def test_do_entity_name(self):
         self.assertEqual(self.repo._do_entity_name(), "Secret")
 
@@ -138,3 +191,341 @@ class WhenTestingSecretRepository(database_utils.RepositoryTestCase):
             "my keystone id",
             session=session,
             suppress_exception=False)
+
+    def test_get_by_create_date_with_marker(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        secrets = []
+        for i in range(5):
+            secret = self.repo.create_from(models.Secret(), session=session)
+            project_secret = models.ProjectSecret()
+            project_secret.secret_id = secret.id
+            project_secret.project_id = project.id
+            secret.project_id = project.id
+            project_secret.save(session=session)
+            secrets.append(secret)
+
+        session.commit()
+
+        first_page, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            limit_arg=2,
+            session=session,
+        )
+        second_page, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            offset_arg=3,
+            limit_arg=2,
+            marker_arg=first_page[-1].id,
+            session=session,
+        )
+        # Pages fetched by marker also hold the first secret of the next
+        # page, if any.
+        self.assertEqual(3, len(second_page))
+        second_page = second_page[:2]
+        last_page, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            limit_arg=2,
+            marker_arg=second_page[-1].id,
+            session=session,
+            with_total=False,
+        )
+
+        all_ids = [s.id for s in first_page + second_page + last_page]
+        expected_ids = [s.id for s in sorted(
+            secrets, key=lambda s: (s.created_at, s.id))]
+        self.assertEqual(expected_ids, all_ids)
+        self.assertEqual(1, len(last_page))
+        self.assertEqual(0, offset)
+        self.assertEqual(2, limit)
+        self.assertIsNone(total)
+
+    def test_get_by_create_date_without_total(self):
+        session = self.repo.get_session()
+
+        secret = self.repo.create_from(models.Secret(), session=session)
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        project_secret = models.ProjectSecret()
+        project_secret.secret_id = secret.id
+        project_secret.project_id = project.id
+        secret.project_id = project.id
+        project_secret.save(session=session)
+
+        session.commit()
+
+        secrets, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            with_total=False,
+            session=session,
+        )
+
+        self.assertEqual([secret.id], [s.id for s in secrets])
+        self.assertIsNone(total)
+
+    def test_get_by_create_date_skips_encrypted_data(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        kek_datum = models.KEKDatum()
+        kek_datum.plugin_name = 'plugin'
+        kek_datum.project_id = project.id
+        kek_datum.save(session=session)
+
+        for i in range(3):
+            secret = models.Secret()
+            secret.project_id = project.id
+            self.repo.create_from(secret, session=session)
+            models.EncryptedDatum(secret, kek_datum).save(session=session)
+            meta = models.SecretStoreMetadatum('content_type', 'text/plain')
+            meta.secret_id = secret.id
+            meta.save(session=session)
+
+        session.commit()
+        session.expunge_all()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            statements.append(statement)
+
+        engine = repositories.get_engine()
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                                before_cursor_execute)
+        self.addCleanup(sqlalchemy.event.remove, engine,
+                        'before_cursor_execute', before_cursor_execute)
+
+        secrets, offset, limit, total = self.repo.get_by_create_date(
+            "my keystone id",
+            session=session,
+        )
+        content_types = [s.secret_store_metadata['content_type'].value
+                         for s in secrets]
+
+        self.assertEqual(['text/plain'] * 3, content_types)
+        # The total, the secrets and their metadata, in one query each.
+        self.assertEqual(3, len(statements))
+        for statement in statements:
+            self.assertNotIn('encrypted_data', statement)
+            self.assertNotIn('kek_data', statement)
+
+    def test_get_many(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+        other_project = models.Project()
+        other_project.external_id = "other keystone id"
+        other_project.save(session=session)
+
+        secrets = []
+        for i in range(5):
+            secret = models.Secret()
+            secret.project_id = project.id
+            self.repo.create_from(secret, session=session)
+            secrets.append(secret)
+
+        secrets[1].project_id = other_project.id
+        secrets[2].deleted = True
+        secrets[3].expiration = timeutils.utcnow() - datetime.timedelta(1)
+        secret_ids = [s.id for s in secrets]
+        session.commit()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            statements.append(statement)
+
+        engine = repositories.get_engine()
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                                before_cursor_execute)
+        self.addCleanup(sqlalchemy.event.remove, engine,
+                        'before_cursor_execute', before_cursor_execute)
+
+        found = self.repo.get_many(secret_ids + ['bogus-id'],
+                                   "my keystone id", session=session)
+
+        self.assertEqual(1, len(statements))
+        self.assertEqual(sorted([secret_ids[0], secret_ids[4]]),
+                         sorted(s.id for s in found))
+
+    def test_get_many_without_ids(self):
+        self.assertEqual([], self.repo.get_many([], "my keystone id"))
+
+    def test_get_expired(self):
+        session = self.repo.get_session()
+        now = timeutils.utcnow()
+
+        expirations = [now - datetime.timedelta(minutes=1),
+                       now - datetime.timedelta(minutes=2),
+                       now - datetime.timedelta(minutes=3),
+                       now + datetime.timedelta(minutes=1),
+                       None]
+        secrets = []
+        for expiration in expirations:
+            secret = models.Secret()
+            secret.expiration = expiration
+            self.repo.create_from(secret, session=session)
+            secrets.append(secret)
+        secrets[2].deleted = True
+        secret_ids = [s.id for s in secrets]
+        session.commit()
+
+        expired = self.repo.get_expired(5, session=session)
+        self.assertEqual([secret_ids[1], secret_ids[0]],
+                         [s.id for s in expired])
+
+        expired = self.repo.get_expired(1, session=session)
+        self.assertEqual([secret_ids[1]], [s.id for s in expired])
+
+        marker = (expired[0].expiration, expired[0].id)
+        expired = self.repo.get_expired(5, marker=marker, session=session)
+        self.assertEqual([secret_ids[0]], [s.id for s in expired])
+
+    def test_claim_expired(self):
+        session = self.repo.get_session()
+        now = timeutils.utcnow()
+
+        secret = models.Secret()
+        secret.expiration = now - datetime.timedelta(minutes=1)
+        self.repo.create_from(secret, session=session)
+        secret.updated_at = now - datetime.timedelta(days=1)
+        live_secret = models.Secret()
+        live_secret.expiration = now + datetime.timedelta(minutes=1)
+        self.repo.create_from(live_secret, session=session)
+        session.commit()
+
+        long_ago = now - datetime.timedelta(hours=1)
+        self.assertTrue(self.repo.claim_expired(secret.id, long_ago,
+                                                session=session))
+        # Claimed already, until claims made before now lapse.
+        self.assertFalse(self.repo.claim_expired(secret.id, long_ago,
+                                                 session=session))
+        self.assertTrue(self.repo.claim_expired(
+            secret.id, timeutils.utcnow() + datetime.timedelta(seconds=1),
+            session=session))
+        self.assertFalse(self.repo.claim_expired(live_secret.id, long_ago,
+                                                 session=session))
+
+        self.repo.delete_expired(secret.id, session=session)
+        self.assertTrue(secret.deleted)
+        self.assertFalse(self.repo.claim_expired(
+            secret.id, timeutils.utcnow() + datetime.timedelta(seconds=1),
+            session=session))
+
+    def test_get_by_create_date_with_unknown_marker(self):
+        session = self.repo.get_session()
+
+        self.assertRaises(
+            exception.InvalidMarker,
+            self.repo.get_by_create_date,
+            "my keystone id",
+            marker_arg="bogus-marker-id",
+            session=session,
+            suppress_exception=True)
+
+    def test_get_by_create_date_with_marker_of_other_project(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "other keystone id"
+        project.save(session=session)
+        secret = models.Secret()
+        secret.project_id = project.id
+        self.repo.create_from(secret, session=session)
+        session.commit()
+
+        self.assertRaises(
+            exception.InvalidMarker,
+            self.repo.get_by_create_date,
+            "my keystone id",
+            marker_arg=secret.id,
+            session=session,
+            suppress_exception=True)
+
+    def test_get_by_create_date_with_deleted_marker(self):
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+        secret = models.Secret()
+        secret.project_id = project.id
+        secret.deleted = True
+        self.repo.create_from(secret, session=session)
+        session.commit()
+
+        self.assertRaises(
+            exception.InvalidMarker,
+            self.repo.get_by_create_date,
+            "my keystone id",
+            marker_arg=secret.id,
+            session=session,
+            suppress_exception=True)
+
+    def test_delete_project_entities_in_batches(self):
+        repositories.CONF.set_override("project_cleanup_batch_size", 2)
+        self.addCleanup(repositories.CONF.clear_override,
+                        "project_cleanup_batch_size")
+        session = self.repo.get_session()
+
+        project = models.Project()
+        project.external_id = "my keystone id"
+        project.save(session=session)
+
+        kek_datum = models.KEKDatum()
+        kek_datum.plugin_name = 'plugin'
+        kek_datum.project_id = project.id
+        kek_datum.save(session=session)
+
+        container = models.Container()
+        container.project_id = project.id
+        container.save(session=session)
+
+        secret_ids = []
+        for i in range(3):
+            secret = models.Secret()
+            secret.project_id = project.id
+            self.repo.create_from(secret, session=session)
+            secret_ids.append(secret.id)
+
+            models.EncryptedDatum(secret, kek_datum).save(session=session)
+            meta = models.SecretStoreMetadatum('key', 'value')
+            meta.secret_id = secret.id
+            meta.save(session=session)
+
+            container_secret = models.ContainerSecret()
+            container_secret.container_id = container.id
+            container_secret.secret_id = secret.id
+            container_secret.save(session=session)
+
+        session.commit()
+
+        with mock.patch.object(session, 'commit',
+                               wraps=session.commit) as mock_commit:
+            self.repo.delete_project_entities(project.id, session=session)
+
+        # Two batches, of two secrets and then one.
+        self.assertEqual(2, mock_commit.call_count)
+        self.assertEqual(
+            [], self.repo.get_project_entities(project.id, session=session))
+
+        for model in (models.Secret, models.EncryptedDatum,
+                      models.SecretStoreMetadatum):
+            entities = session.query(model).all()
+            self.assertEqual(3, len(entities))
+            self.assertTrue(all(e.deleted and e.deleted_at for e in entities))
+
+        self.assertEqual(0, session.query(models.ContainerSecret).count())
@@ -18,6 +18,7 @@ import os
 from Crypto.PublicKey import DSA
 from Crypto.PublicKey import RSA
 from Crypto.Util import asn1
+from cryptography import exceptions
 from cryptography import fernet
 import mock
 import six
@@ -160,6 +161,128 @@ class WhenTestingSimpleCryptoPlugin(utils.BaseTestCase):
                                         mock.MagicMock())
         self.assertEqual(unencrypted, decrypted)
 
+    def _encrypt_and_decrypt(self, kek_meta_dto):
+        response_dto = self.plugin.encrypt(plugin.EncryptDTO(b'some_secret'),
+                                           kek_meta_dto,
+                                           mock.MagicMock())
+        decrypt_dto = plugin.DecryptDTO(response_dto.cypher_text)
+        return self.plugin.decrypt(decrypt_dto, kek_meta_dto,
+                                   response_dto.kek_meta_extended,
+                                   mock.MagicMock())
+
+    @mock.patch.object(simple.fernet, 'Fernet', wraps=fernet.Fernet)
+    def test_decrypted_kek_is_cached(self, mock_fernet):
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        mock_fernet.reset_mock()
+
+        for i in range(2):
+            self.assertEqual(b'some_secret',
+                             self._encrypt_and_decrypt(kek_meta_dto))
+
+        # Only the master KEK and project KEK Fernet instances are built.
+        self.assertEqual(2, mock_fernet.call_count)
+
+    @mock.patch.object(simple.fernet, 'Fernet', wraps=fernet.Fernet)
+    def test_decrypted_kek_is_not_cached_if_disabled(self, mock_fernet):
+        simple.CONF.set_override('kek_cache_ttl', 0,
+                                 group='simple_crypto_plugin')
+        self.addCleanup(simple.CONF.clear_override, 'kek_cache_ttl',
+                        group='simple_crypto_plugin')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        mock_fernet.reset_mock()
+
+        self.assertEqual(b'some_secret',
+                         self._encrypt_and_decrypt(kek_meta_dto))
+
+        self.assertEqual(4, mock_fernet.call_count)
+
+    def test_decrypted_kek_is_cached_per_project_kek(self):
+        kek_meta_dtos = [self._get_mocked_kek_meta_dto() for i in range(2)]
+
+        keks = [self.plugin._get_kek(dto) for dto in kek_meta_dtos]
+
+        self.assertIsNot(keks[0], keks[1])
+        self.assertIs(keks[0], self.plugin._get_kek(kek_meta_dtos[0]))
+        self.assertIs(keks[1], self.plugin._get_kek(kek_meta_dtos[1]))
+
+    def _use_encryption_mode(self, mode):
+        simple.CONF.set_override('encryption_mode', mode,
+                                 group='simple_crypto_plugin')
+        self.addCleanup(simple.CONF.clear_override, 'encryption_mode',
+                        group='simple_crypto_plugin')
+        self.plugin = simple.SimpleCryptoPlugin()
+
+    def test_aes_gcm_encryption(self):
+        self._use_encryption_mode('aes-256-gcm')
+        unencrypted = os.urandom(10)
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+
+        response_dto = self.plugin.encrypt(plugin.EncryptDTO(unencrypted),
+                                           kek_meta_dto,
+                                           mock.MagicMock())
+        decrypted = self.plugin.decrypt(
+            plugin.DecryptDTO(response_dto.cypher_text), kek_meta_dto,
+            response_dto.kek_meta_extended, mock.MagicMock())
+
+        self.assertEqual(unencrypted, decrypted)
+        self.assertEqual(simple.AES_GCM_V1, response_dto.kek_meta_extended)
+        # Nonce, ciphertext and tag, with no padding or encoding.
+        self.assertEqual(12 + 10 + 16, len(response_dto.cypher_text))
+
+    def test_aes_gcm_mode_decrypts_fernet_encryption(self):
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        response_dto = self.plugin.encrypt(plugin.EncryptDTO(b'some_secret'),
+                                           kek_meta_dto,
+                                           mock.MagicMock())
+
+        self._use_encryption_mode('aes-256-gcm')
+        decrypted = self.plugin.decrypt(
+            plugin.DecryptDTO(response_dto.cypher_text), kek_meta_dto,
+            response_dto.kek_meta_extended, mock.MagicMock())
+
+        self.assertIsNone(response_dto.kek_meta_extended)
+        self.assertEqual(b'some_secret', decrypted)
+
+    def test_fernet_mode_decrypts_aes_gcm_encryption(self):
+        self._use_encryption_mode('aes-256-gcm')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        response_dto = self.plugin.encrypt(plugin.EncryptDTO(b'some_secret'),
+                                           kek_meta_dto,
+                                           mock.MagicMock())
+
+        self._use_encryption_mode('fernet')
+        decrypted = self.plugin.decrypt(
+            plugin.DecryptDTO(response_dto.cypher_text), kek_meta_dto,
+            response_dto.kek_meta_extended, mock.MagicMock())
+
+        self.assertEqual(b'some_secret', decrypted)
+
+    def test_aes_gcm_decryption_of_tampered_data_fails(self):
+        self._use_encryption_mode('aes-256-gcm')
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+        response_dto = self.plugin.encrypt(plugin.EncryptDTO(b'some_secret'),
+                                           kek_meta_dto,
+                                           mock.MagicMock())
+        tampered = bytearray(response_dto.cypher_text)
+        tampered[15] ^= 1
+
+        self.assertRaises(exceptions.InvalidTag,
+                          self.plugin.decrypt,
+                          plugin.DecryptDTO(bytes(tampered)),
+                          kek_meta_dto,
+                          response_dto.kek_meta_extended,
+                          mock.MagicMock())
+
+    def test_decrypt_unsupported_format_raises_value_error(self):
+        kek_meta_dto = self._get_mocked_kek_meta_dto()
+
+        self.assertRaises(ValueError,
+                          self.plugin.decrypt,
+                          plugin.DecryptDTO(b'some_encrypted_secret'),
+                          kek_meta_dto,
+                          'aes-256-gcm:v99',
+                          mock.MagicMock())
+
     def test_generate_256_bit_key(self):
         secret = models.Secret()
         secret.bit_length = 256
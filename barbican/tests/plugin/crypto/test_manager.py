@@ -11,10 +11,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mock
+from stevedore import named
+
+from barbican.plugin.crypto import crypto
 from barbican.plugin.crypto import manager
+from barbican.plugin.interface import secret_store
 from barbican.tests import utils
 
 
+class FakePlugin(object):
+
+    def __init__(self, supported):
+        self.supported = supported
+        self.supports = mock.Mock(
+            side_effect=lambda type_needed, *args: type_needed in supported)
+
+
+class OtherFakePlugin(FakePlugin):
+    pass
+
+
 class WhenTestingManager(utils.BaseTestCase):
 
     def test_can_override_enabled_plugins(self):
@@ -31,3 +48,88 @@ class WhenTestingManager(utils.BaseTestCase):
 
         self.assertListEqual(['foo_plugin'],
                              manager_to_test._names)
+
+    def test_should_not_lock_once_manager_created(self):
+        manager._PLUGIN_MANAGER = None
+        self.addCleanup(setattr, manager, '_PLUGIN_MANAGER', None)
+        manager_to_test = manager.get_manager()
+
+        with mock.patch.object(manager, '_create_manager') as create:
+            self.assertIs(manager_to_test, manager.get_manager())
+            self.assertFalse(create.called)
+
+
+class WhenSelectingPlugins(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenSelectingPlugins, self).setUp()
+        self.plugin = FakePlugin([crypto.PluginSupportTypes.ENCRYPT_DECRYPT])
+        self.other_plugin = OtherFakePlugin([
+            crypto.PluginSupportTypes.ENCRYPT_DECRYPT,
+            crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION])
+        self.manager = self._create_manager(
+            [self.plugin, self.other_plugin, OtherFakePlugin([])])
+
+    def _create_manager(self, plugins):
+        def init(plugin_manager, *args, **kwargs):
+            plugin_manager.extensions = [mock.MagicMock(obj=plugin)
+                                         for plugin in plugins]
+
+        with mock.patch.object(named.NamedExtensionManager, '__init__', init):
+            return manager._CryptoPluginManager()
+
+    def test_should_select_first_supporting_plugin(self):
+        self.assertIs(self.plugin, self.manager.get_plugin_store_generate(
+            crypto.PluginSupportTypes.ENCRYPT_DECRYPT))
+        self.assertIs(self.other_plugin,
+                      self.manager.get_plugin_store_generate(
+                          crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION,
+                          'aes', 128, 'cbc'))
+
+    def test_should_remember_selected_plugin(self):
+        for i in range(2):
+            self.manager.get_plugin_store_generate(
+                crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION,
+                'aes', 128, 'cbc')
+
+        self.assertEqual(1, self.other_plugin.supports.call_count)
+        self.manager.get_plugin_store_generate(
+            crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION,
+            'aes', 256, 'cbc')
+        self.assertEqual(2, self.other_plugin.supports.call_count)
+
+    def test_should_not_remember_too_many_selections(self):
+        self.manager._store_generate_selections = dict(
+            (i, self.plugin)
+            for i in range(manager._MAX_STORE_GENERATE_SELECTIONS))
+
+        for i in range(2):
+            self.manager.get_plugin_store_generate(
+                crypto.PluginSupportTypes.ENCRYPT_DECRYPT)
+
+        self.assertEqual(2, self.plugin.supports.call_count)
+
+    def test_should_raise_if_no_plugin_supports_type(self):
+        self.assertRaises(
+            secret_store.SecretStorePluginNotFound,
+            self.manager.get_plugin_store_generate,
+            crypto.PluginSupportTypes.ASYMMETRIC_KEY_GENERATION)
+
+    def test_should_get_first_plugin_by_name(self):
+        self.assertIs(self.plugin, self.manager.get_plugin_retrieve(
+            'barbican.tests.plugin.crypto.test_manager.FakePlugin'))
+        self.assertIs(self.other_plugin, self.manager.get_plugin_retrieve(
+            'barbican.tests.plugin.crypto.test_manager.OtherFakePlugin'))
+
+    def test_should_raise_if_no_plugin_has_name(self):
+        self.assertRaises(secret_store.SecretStorePluginNotFound,
+                          self.manager.get_plugin_retrieve, 'no.such.Plugin')
+
+    def test_should_raise_without_plugins(self):
+        self.manager = self._create_manager([])
+
+        self.assertRaises(crypto.CryptoPluginNotFound,
+                          self.manager.get_plugin_retrieve, 'no.such.Plugin')
+        self.assertRaises(crypto.CryptoPluginNotFound,
+                          self.manager.get_plugin_store_generate,
+                          crypto.PluginSupportTypes.ENCRYPT_DECRYPT)
@@ -15,8 +15,11 @@
 
 import base64
 import json
+import os
+import threading
 
 import mock
+import testtools
 
 from barbican.model import models
 from barbican.plugin.crypto import crypto as plugin_import
@@ -24,6 +27,13 @@ from barbican.plugin.crypto import p11_crypto
 from barbican.tests import utils
 
 
+# Set to the path of the SoftHSM library, to also test the plugin against
+# the SoftHSM token whose user PIN and slot ID are set below.
+SOFTHSM_LIBRARY = os.environ.get('BARBICAN_TEST_SOFTHSM_LIBRARY')
+SOFTHSM_PIN = os.environ.get('BARBICAN_TEST_SOFTHSM_PIN')
+SOFTHSM_SLOT = int(os.environ.get('BARBICAN_TEST_SOFTHSM_SLOT', '0'))
+
+
 def write_random_first_byte(session, buf, length):
     buf[0] = 1
     return p11_crypto.CKR_OK
@@ -42,6 +52,8 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.lib.C_FindObjectsFinal.return_value = p11_crypto.CKR_OK
         self.lib.C_GenerateKey.return_value = p11_crypto.CKR_OK
         self.lib.C_Login.return_value = p11_crypto.CKR_OK
+        self.lib.C_CloseSession.return_value = p11_crypto.CKR_OK
+        self.lib.C_DestroyObject.return_value = p11_crypto.CKR_OK
         self.lib.C_GenerateRandom.side_effect = write_random_first_byte
         self.ffi = p11_crypto._build_ffi()
         setattr(self.ffi, 'dlopen', lambda x: self.lib)
@@ -50,6 +62,12 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.cfg_mock.p11_crypto_plugin.mkek_label = "mkek"
         self.cfg_mock.p11_crypto_plugin.hmac_label = "hmac"
         self.cfg_mock.p11_crypto_plugin.mkek_length = 32
+        self.cfg_mock.p11_crypto_plugin.slot_id = 1
+        self.cfg_mock.p11_crypto_plugin.session_pool_size = 2
+        self.cfg_mock.p11_crypto_plugin.session_check_interval = 60
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_size = 10
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_ttl = 300
+        self.cfg_mock.p11_crypto_plugin.thread_pool_size = 0
         self.plugin = p11_crypto.P11CryptoPlugin(
             ffi=self.ffi, conf=self.cfg_mock
         )
@@ -100,11 +118,12 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.assertRaises(
             p11_crypto.P11CryptoPluginKeyException,
             self.plugin._get_key_handle,
+            1,
             'mylabel',
         )
 
     def test_get_key_handle_with_no_keys(self):
-        result = self.plugin._get_key_handle('mylabel')
+        result = self.plugin._get_key_handle(1, 'mylabel')
         self.assertIsNone(result)
 
     def test_get_key_handle_with_one_key(self):
@@ -115,9 +134,33 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
 
         self.lib.C_FindObjects.side_effect = one_key
 
-        key = self.plugin._get_key_handle('mylabel')
+        key = self.plugin._get_key_handle(1, 'mylabel')
         self.assertEqual(key, 50)
 
+    def test_get_key_handle_caches_found_key(self):
+        def one_key(session, object_handle_ptr, length, returned_count):
+            object_handle_ptr[0] = 50
+            returned_count[0] = 1
+            return p11_crypto.CKR_OK
+
+        self.lib.C_FindObjects.side_effect = one_key
+        self.lib.C_FindObjectsInit.reset_mock()
+
+        keys = [self.plugin._get_key_handle(1, 'mylabel') for i in range(2)]
+
+        self.assertEqual([50, 50], keys)
+        self.assertEqual(1, self.lib.C_FindObjectsInit.call_count)
+
+    def test_forgets_key_handles_if_invalid(self):
+        self.plugin.key_handles['mylabel'] = 50
+        func = mock.Mock(side_effect=[
+            p11_crypto.P11CryptoPluginKeyHandleException(), 'result'])
+
+        self.assertEqual('result', self.plugin._with_session(func))
+
+        self.assertNotIn('mylabel', self.plugin.key_handles)
+        self.assertEqual(2, func.call_count)
+
     def test_encrypt(self):
         payload = 'encrypt me!!'
         self.lib.C_EncryptInit.return_value = p11_crypto.CKR_OK
@@ -151,12 +194,56 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
                                 mock.MagicMock())
             self.assertEqual(self.lib.C_Decrypt.call_count, 1)
 
+    def test_reuses_session_buffers(self):
+        self.lib.C_EncryptInit.return_value = p11_crypto.CKR_OK
+        self.lib.C_Encrypt.return_value = p11_crypto.CKR_OK
+        encrypt_dto = plugin_import.EncryptDTO('encrypt me!!')
+        with mock.patch.object(self.plugin, '_unwrap_key') as unwrap_key_mock:
+            unwrap_key_mock.return_value = 'unwrapped_key'
+            for i in range(2):
+                self.plugin.encrypt(encrypt_dto, mock.MagicMock(),
+                                    mock.MagicMock())
+
+        mechs = [c[0][1] for c in self.lib.C_EncryptInit.call_args_list]
+        outputs = [c[0][3] for c in self.lib.C_Encrypt.call_args_list]
+        self.assertIs(mechs[0], mechs[1])
+        self.assertIs(outputs[0], outputs[1])
+
+    def test_forgets_buffers_of_closed_session(self):
+        buffers = self.plugin._get_session_buffers(1)
+        self.assertIs(buffers, self.plugin._get_session_buffers(1))
+
+        self.plugin._close_session(1)
+
+        self.assertIsNot(buffers, self.plugin._get_session_buffers(1))
+
+    def test_session_buffers_grow_output(self):
+        buffers = p11_crypto.SessionBuffers(self.ffi, self.plugin.algorithm)
+
+        small = buffers.output(16)
+        self.assertEqual(16, buffers.output_len[0])
+        self.assertIs(small, buffers.output(8))
+        self.assertEqual(8, buffers.output_len[0])
+        self.assertEqual(32, len(buffers.output(32)))
+
+    def test_pads_to_block_size(self):
+        for length in (0, 1, 15, 16, 17):
+            padded = self.plugin._pad(b'x' * length)
+            self.assertEqual(0, len(padded) % 16)
+            self.assertGreater(len(padded), length)
+            self.assertEqual(b'x' * length, self.plugin._unpad(padded))
+
+    def test_unpad_rejects_invalid_padding(self):
+        for padded in (b'', b'x' * 15 + b'\x00', b'x' * 15 + b'\x11',
+                       b'x' * 14 + b'\x01\x02'):
+            self.assertRaises(ValueError, self.plugin._unpad, padded)
+
     def test_generate_wrapped_kek(self):
         self.lib.C_GenerateKey.return_value = p11_crypto.CKR_OK
         self.lib.C_WrapKey.return_value = p11_crypto.CKR_OK
         self.lib.C_SignInit.return_value = p11_crypto.CKR_OK
         self.lib.C_Sign.return_value = p11_crypto.CKR_OK
-        self.plugin._generate_wrapped_kek("label", 32)
+        self.plugin._generate_wrapped_kek(1, "label", 32)
         self.assertEqual(self.lib.C_WrapKey.call_count, 1)
         self.assertEqual(self.lib.C_SignInit.call_count, 1)
         self.assertEqual(self.lib.C_Sign.call_count, 1)
@@ -175,14 +262,32 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
             genmock.return_value = self.ffi.new("CK_BYTE[100]")
             self.assertRaises(
                 p11_crypto.P11CryptoPluginException,
-                self.plugin._perform_rng_self_test
+                self.plugin._perform_rng_self_test,
+                1
             )
 
+    def test_rng_self_test_with_unusable_session(self):
+        self.lib.C_GenerateRandom.side_effect = None
+        self.lib.C_GenerateRandom.return_value = p11_crypto.CKR_SESSION_CLOSED
+
+        self.assertRaises(
+            p11_crypto.P11CryptoPluginSessionException,
+            p11_crypto.P11CryptoPlugin,
+            ffi=self.ffi, conf=self.cfg_mock
+        )
+
     def test_check_error(self):
         self.assertRaises(
             p11_crypto.P11CryptoPluginException, self.plugin._check_error, 1
         )
 
+    def test_check_error_with_unusable_session(self):
+        self.assertRaises(
+            p11_crypto.P11CryptoPluginSessionException,
+            self.plugin._check_error,
+            p11_crypto.CKR_SESSION_HANDLE_INVALID
+        )
+
     def test_invalid_attribute(self):
         attrs = [p11_crypto.Attribute(0, object())]
         self.assertRaises(TypeError, self.plugin._build_attributes, attrs)
@@ -198,7 +303,7 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.lib.C_UnwrapKey.return_value = p11_crypto.CKR_OK
         self.lib.C_VerifyInit.return_value = p11_crypto.CKR_OK
         self.lib.C_Verify.return_value = p11_crypto.CKR_OK
-        self.plugin._unwrap_key(json.dumps(plugin_meta))
+        self.plugin._unwrap_key(1, json.dumps(plugin_meta))
         self.assertEqual(self.lib.C_UnwrapKey.call_count, 1)
         self.assertEqual(self.lib.C_Verify.call_count, 1)
 
@@ -234,3 +339,429 @@ class WhenTestingP11CryptoPlugin(utils.BaseTestCase):
         self.assertFalse(
             self.plugin.supports("SOMETHING_RANDOM")
         )
+
+    @mock.patch('barbican.plugin.crypto.p11_crypto.tpool')
+    @mock.patch('eventlet.patcher.is_monkey_patched')
+    def test_offloads_hsm_calls_under_eventlet(self, mock_patched,
+                                               mock_tpool):
+        mock_patched.return_value = True
+        mock_tpool.execute.side_effect = lambda func, *args: func(*args)
+        self.cfg_mock.p11_crypto_plugin.thread_pool_size = 4
+
+        plugin = p11_crypto.P11CryptoPlugin(ffi=self.ffi, conf=self.cfg_mock)
+
+        mock_tpool.set_num_threads.assert_called_once_with(4)
+        mock_tpool.execute.assert_any_call(self.lib.C_Initialize,
+                                           self.ffi.NULL)
+        self.assertTrue(plugin.lib._offload)
+
+    @mock.patch('eventlet.patcher.is_monkey_patched')
+    def test_does_not_offload_hsm_calls_if_disabled(self, mock_patched):
+        mock_patched.return_value = True
+
+        plugin = p11_crypto.P11CryptoPlugin(ffi=self.ffi, conf=self.cfg_mock)
+
+        self.assertFalse(plugin.lib._offload)
+
+
+class WhenTestingHSMLibrary(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingHSMLibrary, self).setUp()
+        self.lib = mock.Mock()
+        self.lib.C_Encrypt.return_value = p11_crypto.CKR_OK
+
+    def test_should_call_library_directly(self):
+        hsm_lib = p11_crypto.HSMLibrary(self.lib, False)
+
+        self.assertEqual(p11_crypto.CKR_OK, hsm_lib.C_Encrypt(1, 2))
+        self.lib.C_Encrypt.assert_called_once_with(1, 2)
+
+    @mock.patch('barbican.plugin.crypto.p11_crypto.tpool')
+    def test_should_offload_library_calls(self, mock_tpool):
+        mock_tpool.execute.return_value = p11_crypto.CKR_OK
+        hsm_lib = p11_crypto.HSMLibrary(self.lib, True)
+
+        self.assertEqual(p11_crypto.CKR_OK, hsm_lib.C_Encrypt(1, 2))
+        mock_tpool.execute.assert_called_once_with(self.lib.C_Encrypt, 1, 2)
+        self.assertFalse(self.lib.C_Encrypt.called)
+
+    @mock.patch('barbican.plugin.crypto.p11_crypto.LOG')
+    def test_should_log_call_time_on_error(self, mock_log):
+        self.lib.C_Encrypt.side_effect = ValueError()
+        hsm_lib = p11_crypto.HSMLibrary(self.lib, False)
+
+        self.assertRaises(ValueError, hsm_lib.C_Encrypt, 1, 2)
+        mock_log.debug.assert_called_once_with(
+            mock.ANY, 'C_Encrypt', mock.ANY)
+
+
+class WhenTestingP11CryptoPluginSessionPool(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11CryptoPluginSessionPool, self).setUp()
+
+        self.session_count = 0
+        self.lib = mock.Mock()
+        self.lib.C_Initialize.return_value = p11_crypto.CKR_OK
+        self.lib.C_OpenSession.side_effect = self._open_session
+        self.lib.C_CloseSession.return_value = p11_crypto.CKR_OK
+        self.lib.C_DestroyObject.return_value = p11_crypto.CKR_OK
+        self.lib.C_Login.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjectsInit.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjects.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjectsFinal.return_value = p11_crypto.CKR_OK
+        self.lib.C_GenerateKey.return_value = p11_crypto.CKR_OK
+        self.lib.C_GenerateRandom.side_effect = write_random_first_byte
+        self.ffi = p11_crypto._build_ffi()
+        setattr(self.ffi, 'dlopen', lambda x: self.lib)
+
+        self.cfg_mock = mock.MagicMock(name='config mock')
+        self.cfg_mock.p11_crypto_plugin.mkek_label = "mkek"
+        self.cfg_mock.p11_crypto_plugin.hmac_label = "hmac"
+        self.cfg_mock.p11_crypto_plugin.mkek_length = 32
+        self.cfg_mock.p11_crypto_plugin.slot_id = 1
+        self.cfg_mock.p11_crypto_plugin.session_pool_size = 2
+        self.cfg_mock.p11_crypto_plugin.session_check_interval = 60
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_size = 10
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_ttl = 300
+        self.cfg_mock.p11_crypto_plugin.thread_pool_size = 0
+        self.plugin = p11_crypto.P11CryptoPlugin(
+            ffi=self.ffi, conf=self.cfg_mock
+        )
+
+    def _open_session(self, slot, flags, application, notify, session_ptr):
+        self.session_count += 1
+        session_ptr[0] = self.session_count
+        return p11_crypto.CKR_OK
+
+    def test_opens_sessions_on_demand(self):
+        # Initializing the plugin only needed one session.
+        self.assertEqual(1, self.lib.C_OpenSession.call_count)
+        self.assertEqual(1, self.lib.C_Login.call_count)
+
+        sessions = [self.plugin._checkout_session() for i in range(2)]
+
+        self.assertEqual([1, 2], sorted(sessions))
+        self.assertTrue(self.plugin.sessions.empty())
+
+    def test_opens_sessions_while_another_is_logged_in(self):
+        self.lib.C_Login.return_value = p11_crypto.CKR_USER_ALREADY_LOGGED_IN
+
+        sessions = [self.plugin._checkout_session() for i in range(2)]
+
+        self.assertEqual([1, 2], sorted(sessions))
+        self.assertFalse(self.lib.C_CloseSession.called)
+
+    def test_reuses_returned_sessions(self):
+        for i in range(3):
+            self.plugin._with_session(self.plugin._generate_random, 16)
+
+        self.assertEqual(1, self.lib.C_OpenSession.call_count)
+        sessions = [c[0][0] for c in
+                    self.lib.C_GenerateRandom.call_args_list]
+        self.assertEqual(set([1]), set(sessions))
+
+    def test_waits_for_returned_session(self):
+        sessions = [self.plugin._checkout_session() for i in range(2)]
+        used_sessions = []
+
+        thread = threading.Thread(
+            target=self.plugin._with_session, args=(used_sessions.append,))
+        thread.start()
+        self.plugin._return_session(sessions[0])
+        thread.join()
+
+        self.assertEqual([sessions[0]], used_sessions)
+
+    def test_replaces_unusable_session_and_retries(self):
+        func = mock.Mock(side_effect=[
+            p11_crypto.P11CryptoPluginSessionException(), 'result'])
+
+        self.assertEqual('result', self.plugin._with_session(func, 'arg'))
+
+        self.assertEqual([mock.call(1, 'arg'), mock.call(2, 'arg')],
+                         func.call_args_list)
+        self.lib.C_CloseSession.assert_called_once_with(1)
+        self.assertEqual(2, self.lib.C_Login.call_count)
+        self.assertEqual([None, 2],
+                         sorted(self.plugin.sessions.get()[0]
+                                for i in range(2)))
+
+    def test_does_not_retry_other_errors(self):
+        func = mock.Mock(side_effect=p11_crypto.P11CryptoPluginException())
+
+        self.assertRaises(p11_crypto.P11CryptoPluginException,
+                          self.plugin._with_session, func)
+
+        self.assertEqual(1, func.call_count)
+        self.assertFalse(self.lib.C_CloseSession.called)
+
+    @mock.patch('time.time')
+    def test_checks_idle_session(self, mock_time):
+        def usable(session, session_info):
+            session_info.state = p11_crypto.CKS_RW_USER_FUNCTIONS
+            return p11_crypto.CKR_OK
+        self.lib.C_GetSessionInfo.side_effect = usable
+        mock_time.return_value = 1000.0
+        self.plugin._with_session(mock.Mock())
+
+        mock_time.return_value = 1061.0
+        self.assertEqual(1, self.plugin._checkout_session())
+        self.assertEqual(1, self.lib.C_GetSessionInfo.call_count)
+
+    @mock.patch('time.time')
+    def test_replaces_idle_session_found_unusable(self, mock_time):
+        def logged_out(session, session_info):
+            session_info.state = 0
+            return p11_crypto.CKR_OK
+        self.lib.C_GetSessionInfo.side_effect = logged_out
+        mock_time.return_value = 1000.0
+        self.plugin._with_session(mock.Mock())
+
+        mock_time.return_value = 1061.0
+        self.assertEqual(2, self.plugin._checkout_session())
+        self.lib.C_CloseSession.assert_called_once_with(1)
+
+    def test_keeps_pool_size_when_opening_session_fails(self):
+        self.lib.C_OpenSession.side_effect = None
+        self.lib.C_OpenSession.return_value = 1
+        self.plugin._checkout_session()
+
+        self.assertRaises(p11_crypto.P11CryptoPluginException,
+                          self.plugin._checkout_session)
+
+        self.assertEqual((None, None), self.plugin.sessions.get_nowait())
+
+
+class WhenTestingUnwrappedKeyCache(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingUnwrappedKeyCache, self).setUp()
+        self.cache = p11_crypto.UnwrappedKeyCache(2, 300)
+
+    def _add(self, kek_label, handle, session=1):
+        key = self.cache.add(kek_label, 'meta', handle, session)
+        self.cache.checkin(key)
+        return key
+
+    def test_should_checkout_cached_key(self):
+        self._add('kek1', 10)
+
+        key = self.cache.checkout('kek1', 'meta')
+
+        self.assertEqual(10, key.handle)
+        self.assertEqual([], self.cache.pop_keys_to_destroy())
+
+    def test_should_miss_other_plugin_meta(self):
+        self._add('kek1', 10)
+
+        self.assertIsNone(self.cache.checkout('kek1', 'other meta'))
+        self.assertEqual([10], self.cache.pop_keys_to_destroy())
+
+    @mock.patch('time.time')
+    def test_should_destroy_expired_key(self, mock_time):
+        mock_time.return_value = 1000.0
+        self._add('kek1', 10)
+
+        mock_time.return_value = 1300.0
+        self.assertIsNone(self.cache.checkout('kek1', 'meta'))
+        self.assertEqual([10], self.cache.pop_keys_to_destroy())
+
+    def test_should_destroy_least_recently_used_key(self):
+        self._add('kek1', 10)
+        self._add('kek2', 20)
+        self.cache.checkin(self.cache.checkout('kek1', 'meta'))
+        self._add('kek3', 30)
+
+        self.assertEqual([20], self.cache.pop_keys_to_destroy())
+        self.assertIsNone(self.cache.checkout('kek2', 'meta'))
+
+    def test_should_destroy_evicted_key_once_checked_in(self):
+        key = self.cache.add('kek1', 'meta', 10, 1)
+        self._add('kek2', 20)
+        self._add('kek3', 30)
+        self.assertEqual([], self.cache.pop_keys_to_destroy())
+
+        self.cache.checkin(key)
+        self.assertEqual([10], self.cache.pop_keys_to_destroy())
+
+    def test_should_destroy_keys_once_used_if_disabled(self):
+        self.cache = p11_crypto.UnwrappedKeyCache(0, 300)
+
+        self._add('kek1', 10)
+
+        self.assertIsNone(self.cache.checkout('kek1', 'meta'))
+        self.assertEqual([10], self.cache.pop_keys_to_destroy())
+
+    def test_should_not_destroy_keys_of_closed_session(self):
+        key = self.cache.add('kek1', 'meta', 10, 1)
+        self._add('kek2', 20, session=2)
+
+        self.cache.invalidate_session(1)
+        self.cache.checkin(key)
+
+        self.assertIsNone(self.cache.checkout('kek1', 'meta'))
+        self.assertEqual([], self.cache.pop_keys_to_destroy())
+        self.assertEqual(20, self.cache.checkout('kek2', 'meta').handle)
+
+    def test_should_not_destroy_invalid_key(self):
+        key = self.cache.add('kek1', 'meta', 10, 1)
+
+        self.cache.invalidate(key)
+        self.cache.checkin(key)
+
+        self.assertIsNone(self.cache.checkout('kek1', 'meta'))
+        self.assertEqual([], self.cache.pop_keys_to_destroy())
+
+
+class WhenTestingP11CryptoPluginUnwrappedKeys(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11CryptoPluginUnwrappedKeys, self).setUp()
+
+        self.lib = mock.Mock()
+        self.lib.C_Initialize.return_value = p11_crypto.CKR_OK
+        self.lib.C_OpenSession.return_value = p11_crypto.CKR_OK
+        self.lib.C_CloseSession.return_value = p11_crypto.CKR_OK
+        self.lib.C_DestroyObject.return_value = p11_crypto.CKR_OK
+        self.lib.C_Login.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjectsInit.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjects.return_value = p11_crypto.CKR_OK
+        self.lib.C_FindObjectsFinal.return_value = p11_crypto.CKR_OK
+        self.lib.C_GenerateKey.return_value = p11_crypto.CKR_OK
+        self.lib.C_GenerateRandom.side_effect = write_random_first_byte
+        self.lib.C_EncryptInit.return_value = p11_crypto.CKR_OK
+        self.lib.C_Encrypt.return_value = p11_crypto.CKR_OK
+        self.ffi = p11_crypto._build_ffi()
+        setattr(self.ffi, 'dlopen', lambda x: self.lib)
+
+        self.cfg_mock = mock.MagicMock(name='config mock')
+        self.cfg_mock.p11_crypto_plugin.mkek_label = "mkek"
+        self.cfg_mock.p11_crypto_plugin.hmac_label = "hmac"
+        self.cfg_mock.p11_crypto_plugin.mkek_length = 32
+        self.cfg_mock.p11_crypto_plugin.slot_id = 1
+        self.cfg_mock.p11_crypto_plugin.session_pool_size = 2
+        self.cfg_mock.p11_crypto_plugin.session_check_interval = 60
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_size = 10
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_ttl = 300
+        self.cfg_mock.p11_crypto_plugin.thread_pool_size = 0
+        self.plugin = p11_crypto.P11CryptoPlugin(
+            ffi=self.ffi, conf=self.cfg_mock
+        )
+
+        self.unwrap_patcher = mock.patch.object(
+            self.plugin, '_unwrap_key', side_effect=[40, 41])
+        self.unwrap_key = self.unwrap_patcher.start()
+        self.addCleanup(self.unwrap_patcher.stop)
+
+        self.kek_meta_dto = mock.MagicMock(kek_label='kek1',
+                                           plugin_meta='meta')
+
+    def _encrypt(self):
+        encrypt_dto = plugin_import.EncryptDTO('encrypt me!!')
+        self.plugin.encrypt(encrypt_dto, self.kek_meta_dto, mock.MagicMock())
+
+    def _get_encrypt_keys(self):
+        return [c[0][2] for c in self.lib.C_EncryptInit.call_args_list]
+
+    def test_should_reuse_unwrapped_key(self):
+        self._encrypt()
+        self._encrypt()
+
+        self.assertEqual(1, self.unwrap_key.call_count)
+        self.assertEqual([40, 40], self._get_encrypt_keys())
+        self.assertFalse(self.lib.C_DestroyObject.called)
+
+    def test_should_destroy_key_if_caching_disabled(self):
+        self.plugin.unwrapped_keys = p11_crypto.UnwrappedKeyCache(0, 0)
+
+        self._encrypt()
+        self._encrypt()
+
+        self.assertEqual([40, 41], self._get_encrypt_keys())
+        self.assertEqual([mock.call(mock.ANY, 40), mock.call(mock.ANY, 41)],
+                         self.lib.C_DestroyObject.call_args_list)
+
+    def test_should_unwrap_key_again_if_handle_invalid(self):
+        self._encrypt()
+        self.lib.C_EncryptInit.side_effect = [
+            p11_crypto.CKR_KEY_HANDLE_INVALID, p11_crypto.CKR_OK]
+
+        self._encrypt()
+
+        self.assertEqual([40, 40, 41], self._get_encrypt_keys())
+        self.assertFalse(self.lib.C_DestroyObject.called)
+
+    def test_should_forget_keys_of_closed_session(self):
+        self._encrypt()
+
+        session = self.plugin._checkout_session()
+        self.plugin._close_session(session)
+        self.plugin._return_session(None)
+        self._encrypt()
+
+        self.assertEqual([40, 41], self._get_encrypt_keys())
+        self.assertFalse(self.lib.C_DestroyObject.called)
+
+
+@testtools.skipUnless(SOFTHSM_LIBRARY,
+                      'BARBICAN_TEST_SOFTHSM_LIBRARY is not set')
+class WhenTestingP11CryptoPluginSessionPoolOnSoftHSM(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingP11CryptoPluginSessionPoolOnSoftHSM, self).setUp()
+
+        self.cfg_mock = mock.MagicMock(name='config mock')
+        self.cfg_mock.p11_crypto_plugin.library_path = SOFTHSM_LIBRARY
+        self.cfg_mock.p11_crypto_plugin.login = SOFTHSM_PIN
+        self.cfg_mock.p11_crypto_plugin.mkek_label = "test_mkek"
+        self.cfg_mock.p11_crypto_plugin.hmac_label = "test_hmac"
+        self.cfg_mock.p11_crypto_plugin.mkek_length = 32
+        self.cfg_mock.p11_crypto_plugin.slot_id = SOFTHSM_SLOT
+        self.cfg_mock.p11_crypto_plugin.session_pool_size = 4
+        self.cfg_mock.p11_crypto_plugin.session_check_interval = 60
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_size = 10
+        self.cfg_mock.p11_crypto_plugin.unwrapped_key_cache_ttl = 300
+        self.cfg_mock.p11_crypto_plugin.thread_pool_size = 0
+        self.plugin = p11_crypto.P11CryptoPlugin(conf=self.cfg_mock)
+
+    def test_concurrent_operations(self):
+        errors = []
+
+        def find_keys():
+            try:
+                for i in range(20):
+                    self.plugin._with_session(self.plugin._generate_random,
+                                              16)
+                    self.plugin.key_handles.clear()
+                    self.plugin._with_session(self.plugin._get_key_handle,
+                                              "test_mkek")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=find_keys) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(4, self.plugin.sessions.qsize())
+
+    def test_checks_out_concurrent_sessions(self):
+        sessions = [self.plugin._checkout_session() for i in range(2)]
+        self.assertNotEqual(sessions[0], sessions[1])
+
+        for session in sessions:
+            self.plugin._generate_random(session, 16)
+            self.plugin._return_session(session)
+
+    def test_replaces_session_closed_by_token(self):
+        session = self.plugin._checkout_session()
+        self.plugin.lib.C_CloseSession(session)
+        self.plugin._return_session(session)
+
+        self.plugin.key_handles.clear()
+        self.assertIsNotNone(self.plugin._with_session(
+            self.plugin._get_key_handle, "test_mkek"))
@@ -216,3 +216,73 @@ class WhenTestingSecretStorePluginManager(utils.BaseTestCase):
                          self.manager.get_plugin_store(
                              key_spec=keySpec,
                              transport_key_needed=True))
+
+    def test_get_retrieve_delete_plugin_by_name(self):
+        plugin1 = TestSecretStore([str.KeyAlgorithm.AES])
+        plugin2 = TestSecretStoreWithTransportKey([str.KeyAlgorithm.AES])
+        self.manager.extensions = [mock.MagicMock(obj=plugin1),
+                                   mock.MagicMock(obj=plugin2)]
+
+        self.assertEqual(plugin2, self.manager.get_plugin_retrieve_delete(
+            'barbican.tests.plugin.interface.test_secret_store.'
+            'TestSecretStoreWithTransportKey'))
+        self.assertEqual(plugin1, self.manager.get_plugin_store(
+            None,
+            plugin_name='barbican.tests.plugin.interface.test_secret_store.'
+                        'TestSecretStore'))
+        self.assertRaises(str.SecretStorePluginNotFound,
+                          self.manager.get_plugin_retrieve_delete,
+                          'plugin')
+
+    def test_get_generate_plugin_remembers_selection(self):
+        plugin = TestSecretStore([str.KeyAlgorithm.AES])
+        plugin.generate_supports = mock.Mock(return_value=True)
+        self.manager.extensions = [mock.MagicMock(obj=plugin)]
+
+        for passphrase in ('one', 'two'):
+            self.assertEqual(plugin, self.manager.get_plugin_generate(
+                str.KeySpec(str.KeyAlgorithm.AES, 128,
+                            passphrase=passphrase)))
+        self.assertEqual(1, plugin.generate_supports.call_count)
+
+        self.manager.get_plugin_generate(
+            str.KeySpec(str.KeyAlgorithm.AES, 256))
+        self.assertEqual(2, plugin.generate_supports.call_count)
+
+    def test_get_store_plugin_remembers_selection(self):
+        plugin = TestSecretStoreWithTransportKey([str.KeyAlgorithm.AES])
+        plugin.store_secret_supports = mock.Mock(return_value=True)
+        self.manager.extensions = [mock.MagicMock(obj=plugin)]
+        keySpec = str.KeySpec(str.KeyAlgorithm.AES, 128)
+
+        for transport_key_needed in (False, True, False, True):
+            self.assertEqual(plugin, self.manager.get_plugin_store(
+                keySpec, transport_key_needed=transport_key_needed))
+        self.assertEqual(2, plugin.store_secret_supports.call_count)
+
+    def test_does_not_remember_too_many_selections(self):
+        plugin = TestSecretStore([str.KeyAlgorithm.AES])
+        plugin.generate_supports = mock.Mock(return_value=True)
+        self.manager.extensions = [mock.MagicMock(obj=plugin)]
+        self.manager._selections = dict(
+            (i, plugin) for i in range(str._MAX_PLUGIN_SELECTIONS))
+
+        for i in range(2):
+            self.manager.get_plugin_generate(
+                str.KeySpec(str.KeyAlgorithm.AES, 128))
+        self.assertEqual(2, plugin.generate_supports.call_count)
+
+
+class WhenGettingSecretStorePluginManager(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenGettingSecretStorePluginManager, self).setUp()
+        str._SECRET_STORE = None
+        self.addCleanup(setattr, str, '_SECRET_STORE', None)
+
+    def test_should_create_manager_once(self):
+        with mock.patch.object(str, 'SecretStorePluginManager') as cls:
+            self.assertIs(cls.return_value, str.get_manager())
+            self.assertIs(cls.return_value, str.get_manager())
+
+        cls.assert_called_once_with()
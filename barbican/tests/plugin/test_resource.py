@@ -50,8 +50,7 @@ class WhenTestingPluginResource(testtools.TestCase):
         }
 
         self.moc_plugin_patcher = mock.patch(
-            'barbican.plugin.interface.secret_store'
-            '.SecretStorePluginManager',
+            'barbican.plugin.interface.secret_store.get_manager',
             **moc_plugin_config
         )
         self.moc_plugin_patcher.start()
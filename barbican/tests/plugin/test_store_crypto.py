@@ -19,6 +19,7 @@ import testtools
 
 from barbican.common import utils
 from barbican.model import models
+from barbican.model import repositories
 from barbican.plugin.crypto import crypto
 from barbican.plugin.interface import secret_store
 from barbican.plugin import store_crypto
@@ -28,6 +29,8 @@ class TestSecretStoreBase(testtools.TestCase):
     """Define common configurations for testing store_crypto.py."""
     def setUp(self):
         super(TestSecretStoreBase, self).setUp()
+        # Don't let KEK data cached by one test leak into the next.
+        self.addCleanup(repositories.get_kek_datum_cache().clear)
 
         self.patchers = []  # List of patchers utilized in this test class.
 
@@ -248,6 +251,14 @@ class WhenTestingStoreCrypto(TestSecretStoreBase):
 
         self.assertEqual(self.project_id, test_project_id)
 
+    def test_get_secret_stored_as_binary(self):
+        self.encrypted_datum_model.binary_cypher_text = b'binary_cypher_text'
+
+        self.plugin_to_test.get_secret(None, self.context)
+
+        args, kwargs = self.retrieving_plugin.decrypt.call_args
+        self.assertEqual(b'binary_cypher_text', args[0].encrypted)
+
     def test_generate_symmetric_key(self):
         """test symmetric secret generation."""
         generation_type = crypto.PluginSupportTypes.SYMMETRIC_KEY_GENERATION
@@ -558,6 +569,36 @@ class WhenTestingStoreCryptoFindOrCreateKekObjects(TestSecretStoreBase):
         kek_model = args[0]
         self.assertEqual(self.kek_meta_project_model, kek_model)
 
+    def test_kek_bind_completed_is_cached(self):
+        self.kek_meta_project_model.id = 'kek-id'
+        self.kek_meta_project_model.project_id = self.project_model.id
+        self.kek_meta_project_model.plugin_name = utils.generate_fullname_for(
+            self)
+        self.kek_meta_project_model.bind_completed = True
+        self.kek_meta_project_model.active = True
+
+        store_crypto._find_or_create_kek_objects(self, self.project_model)
+        kek_model, kek_meta_dto = store_crypto._find_or_create_kek_objects(
+            self, self.project_model)
+
+        # Verify the second call was served from the cache.
+        self._verify_kek_repository_interactions(self)
+        self.assertEqual('kek-id', kek_model.id)
+        self.assertIsInstance(kek_meta_dto, crypto.KEKMetaDTO)
+        self.assertEqual(self.kek_meta_project_model.plugin_meta,
+                         kek_meta_dto.plugin_meta)
+
+    def test_kek_bind_not_completed_is_not_cached(self):
+        self.kek_meta_project_model.bind_completed = False
+        plugin_inst = mock.MagicMock()
+
+        for i in range(2):
+            store_crypto._find_or_create_kek_objects(plugin_inst,
+                                                     self.project_model)
+
+        self.assertEqual(
+            2, self.kek_repo.find_or_create_kek_datum.call_count)
+
     def test_kek_raise_no_kek_bind_not_completed(self):
         self.kek_meta_project_model.bind_completed = False
         plugin_inst = mock.MagicMock()
@@ -633,6 +674,21 @@ class WhenTestingStoreCryptoStoreSecretAndDatum(TestSecretStoreBase):
         self.assertEqual(
             self.project_secret_repo.create_from.call_count, 0)
 
+    def test_with_cached_kek_datum(self):
+        cached_kek_datum = repositories.CachedKEKDatum(
+            'kek-id', 'project-model-id', 'plugin-name', 'kek-meta-label',
+            'kek-meta-algo', 1024, 'kek=meta-mode', 'kek-meta-plugin-meta')
+
+        store_crypto._store_secret_and_datum(
+            self.context,
+            self.secret_model,
+            cached_kek_datum,
+            self.response_dto)
+
+        self._verify_encrypted_datum_repository_interactions()
+        args, kwargs = self.datum_repo.create_from.call_args
+        self.assertEqual('kek-id', args[0].kek_id)
+
     def _verify_secret_repository_interactions(self):
         """Verify the secret repository interactions."""
         self.assertEqual(
@@ -664,7 +720,8 @@ class WhenTestingStoreCryptoStoreSecretAndDatum(TestSecretStoreBase):
         self.assertEqual(
             self.content_type, test_datum_model.content_type)
         self.assertEqual(
-            base64.b64encode(self.cypher_text), test_datum_model.cypher_text)
+            self.cypher_text, test_datum_model.binary_cypher_text)
+        self.assertIsNone(test_datum_model.cypher_text)
         self.assertEqual(
             self.response_dto.kek_meta_extended,
             test_datum_model.kek_meta_extended)
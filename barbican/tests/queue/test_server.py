@@ -183,6 +183,7 @@ class WhenUsingTaskServer(utils.BaseTestCase):
         queue.get_server = mock.MagicMock(return_value=self.server_mock)
 
         self.server = server.TaskServer()
+        self.server.tg = mock.MagicMock()
 
     def test_should_start(self):
         self.server.start()
@@ -191,6 +192,30 @@ class WhenUsingTaskServer(utils.BaseTestCase):
                                             endpoints=[self.server])
         self.server_mock.start.assert_called_with()
 
+    def test_should_start_expiration_sweeps(self):
+        self.server.start()
+        self.server.tg.add_timer.assert_called_once_with(
+            300, self.server.sweep_expired_secrets, initial_delay=300)
+
+    def test_should_not_start_expiration_sweeps_if_disabled(self):
+        server.CONF.set_override('sweep_interval', 0,
+                                 group='secret_expiration')
+        self.addCleanup(server.CONF.clear_override, 'sweep_interval',
+                        group='secret_expiration')
+
+        self.server.start()
+        self.assertFalse(self.server.tg.add_timer.called)
+
+    @mock.patch('barbican.tasks.expiration.SecretExpirationSweeper')
+    def test_should_sweep_expired_secrets(self, mock_sweeper):
+        self.server.sweep_expired_secrets()
+        mock_sweeper.return_value.sweep.assert_called_once_with()
+
+    @mock.patch('barbican.tasks.expiration.SecretExpirationSweeper')
+    def test_should_not_raise_if_sweep_fails(self, mock_sweeper):
+        mock_sweeper.return_value.sweep.side_effect = ValueError()
+        self.server.sweep_expired_secrets()
+
     def test_should_stop(self):
         self.server.stop()
         queue.get_target.assert_called_with()
@@ -0,0 +1,186 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import mock
+
+from barbican.model import models
+from barbican.model import repositories as rep
+from barbican.openstack.common import timeutils
+from barbican.tasks import expiration
+from barbican.tests import database_utils
+from barbican.tests import utils
+
+
+class WhenSweepingExpiredSecrets(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenSweepingExpiredSecrets, self).setUp()
+
+        expiration.CONF.set_override('sweep_batch_size', 2,
+                                     group='secret_expiration')
+        self.addCleanup(expiration.CONF.clear_override, 'sweep_batch_size',
+                        group='secret_expiration')
+
+        self.plugin_manager_patcher = mock.patch(
+            'barbican.plugin.interface.secret_store.get_manager')
+        self.plugin_manager = self.plugin_manager_patcher.start()
+        self.addCleanup(self.plugin_manager_patcher.stop)
+        self.delete_plugin = (
+            self.plugin_manager.return_value.get_plugin_retrieve_delete.
+            return_value)
+
+        self.session = rep.get_session()
+        self.project = models.Project()
+        self.project.external_id = 'keystone1234'
+        self.project.save(session=self.session)
+
+        now = timeutils.utcnow()
+        self.expired_ids = [
+            self._create_secret(now - datetime.timedelta(minutes=i))
+            for i in range(1, 4)]
+        self.live_ids = [
+            self._create_secret(now + datetime.timedelta(days=1)),
+            self._create_secret(None)]
+        self.session.commit()
+
+        self.sweeper = expiration.SecretExpirationSweeper()
+
+    def _create_secret(self, expiration_time):
+        secret = models.Secret()
+        secret.expiration = expiration_time
+        secret.project_id = self.project.id
+        secret.save(session=self.session)
+        if expiration_time:
+            # Secrets are last updated before they expire.
+            secret.updated_at = expiration_time - datetime.timedelta(days=1)
+            secret.save(session=self.session)
+
+        meta = models.SecretStoreMetadatum('plugin_name', 'store_plugin')
+        meta.secret_id = secret.id
+        meta.save(session=self.session)
+
+        return secret.id
+
+    def _get_deleted(self, secret_ids):
+        return [rep.get_session().query(models.Secret).get(secret_id).deleted
+                for secret_id in secret_ids]
+
+    def test_should_delete_expired_secrets(self):
+        self.assertEqual(3, self.sweeper.sweep())
+
+        self.assertEqual([True] * 3, self._get_deleted(self.expired_ids))
+        self.assertEqual([False] * 2, self._get_deleted(self.live_ids))
+        self.assertEqual(3, self.delete_plugin.delete_secret.call_count)
+        self.delete_plugin.delete_secret.assert_called_with(
+            {'plugin_name': 'store_plugin'})
+
+    def test_should_delete_secrets_metadata(self):
+        self.sweeper.sweep()
+
+        metadata = rep.get_session().query(models.SecretStoreMetadatum)
+        self.assertEqual(
+            set([False]), set(m.deleted for m in metadata
+                              if m.secret_id in self.live_ids))
+        self.assertEqual(
+            set([True]), set(m.deleted for m in metadata
+                             if m.secret_id in self.expired_ids))
+
+    def test_should_skip_secrets_that_fail(self):
+        self.delete_plugin.delete_secret.side_effect = [
+            None, ValueError(), None]
+
+        self.assertEqual(2, self.sweeper.sweep())
+
+        # The secret that failed is skipped, and the sweep goes on with the
+        # secret after it in the next batch.
+        self.assertEqual([True, False, True],
+                         self._get_deleted(self.expired_ids))
+        self.assertEqual(3, self.delete_plugin.delete_secret.call_count)
+
+    def test_should_retry_failed_secrets_once_claim_lapsed(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.delete_plugin.delete_secret.side_effect = [
+            ValueError(), None, None, None]
+        self.sweeper.sweep()
+
+        # The failed secret is still claimed by the first sweep.
+        self.assertEqual(0, self.sweeper.sweep())
+
+        timeutils.advance_time_seconds(
+            expiration.CONF.secret_expiration.sweep_claim_timeout + 1)
+        self.assertEqual(1, self.sweeper.sweep())
+        self.assertEqual([True] * 3, self._get_deleted(self.expired_ids))
+
+    def test_should_skip_secrets_claimed_by_another_sweep(self):
+        claimed_before = timeutils.utcnow() - datetime.timedelta(
+            seconds=expiration.CONF.secret_expiration.sweep_claim_timeout)
+        rep.SecretRepo().claim_expired(self.expired_ids[0], claimed_before)
+        rep.commit()
+
+        self.assertEqual(2, self.sweeper.sweep())
+
+        self.assertEqual([False, True, True],
+                         self._get_deleted(self.expired_ids))
+        self.assertEqual(2, self.delete_plugin.delete_secret.call_count)
+
+    def test_should_do_nothing_without_expired_secrets(self):
+        self.sweeper.sweep()
+
+        self.assertEqual(0, self.sweeper.sweep())
+        self.assertEqual(3, self.delete_plugin.delete_secret.call_count)
+
+
+class WhenSweepingExpiredSecretsWithDatabaseErrors(utils.BaseTestCase):
+
+    def setUp(self):
+        super(WhenSweepingExpiredSecretsWithDatabaseErrors, self).setUp()
+
+        self.secret_repo = mock.MagicMock()
+        self.secret_repo.get_expired.side_effect = ValueError()
+        self.db_start = mock.MagicMock()
+        self.db_commit = mock.MagicMock()
+        self.db_rollback = mock.MagicMock()
+        self.db_clear = mock.MagicMock()
+
+        self.sweeper = expiration.SecretExpirationSweeper(
+            secret_repo=self.secret_repo,
+            secret_meta_repo=mock.MagicMock(),
+            db_start=self.db_start, db_commit=self.db_commit,
+            db_rollback=self.db_rollback, db_clear=self.db_clear)
+
+    def test_should_rollback_and_stop(self):
+        self.assertEqual(0, self.sweeper.sweep())
+
+        self.assertEqual(1, self.db_start.call_count)
+        self.assertFalse(self.db_commit.called)
+        self.assertEqual(1, self.db_rollback.call_count)
+        self.assertEqual(1, self.db_clear.call_count)
+
+    @mock.patch('barbican.plugin.resources.expire_secret_from_store')
+    def test_should_stop_if_soft_delete_fails(self, mock_expire):
+        self.secret_repo.get_expired.side_effect = None
+        self.secret_repo.get_expired.return_value = [
+            mock.MagicMock(id='secret1'), mock.MagicMock(id='secret2')]
+        self.secret_repo.claim_expired.return_value = True
+        self.secret_repo.delete_expired.side_effect = ValueError()
+
+        self.assertEqual(0, self.sweeper.sweep())
+
+        # The sweep stopped with the first secret, rolling back the
+        # transaction of its soft delete only.
+        self.assertEqual(1, mock_expire.call_count)
+        self.assertEqual(2, self.db_commit.call_count)
+        self.assertEqual(1, self.db_rollback.call_count)
@@ -19,7 +19,6 @@ import sqlalchemy
 
 from barbican.common import exception
 from barbican.common import resources as c_resources
-from barbican.model import models
 from barbican.model import repositories as rep
 from barbican.plugin.crypto import manager
 from barbican.plugin import resources as plugin
@@ -110,7 +109,7 @@ class WhenUsingKeystoneEventConsumer(
                           self.repos.transport_key_repo.get_project_entities,
                           project2_id)
 
-    @mock.patch.object(models.Project, 'delete',
+    @mock.patch.object(sqlalchemy.orm.Query, 'update',
                        side_effect=sqlalchemy.exc.SQLAlchemyError)
     def test_delete_project_entities_alchemy_error_suppress_exception_true(
             self, mock_entity_delete):
@@ -125,7 +124,7 @@ class WhenUsingKeystoneEventConsumer(
             project1_id, suppress_exception=True)
         self.assertIsNone(no_error)
 
-    @mock.patch.object(models.Project, 'delete',
+    @mock.patch.object(sqlalchemy.orm.Query, 'update',
                        side_effect=sqlalchemy.exc.SQLAlchemyError)
     def test_delete_project_entities_alchemy_error_suppress_exception_false(
             self, mock_entity_delete):
@@ -287,11 +286,27 @@ class WhenUsingKeystoneEventConsumerProcessMethod(
                           self.repos.secret_meta_repo.get,
                           entity_id=secret_metadata_id)
 
+    def test_project_cleanup_invalidates_cached_project(self):
+        self._init_memory_db_setup()
+        project_cache = c_resources.get_project_cache()
+
+        # Look the project up again, now that it exists, to cache it.
+        c_resources.get_or_create_project(self.project_id1,
+                                          self.repos.project_repo)
+        self.assertEqual(self.project1_data.id,
+                         project_cache.get(self.project_id1))
+
+        self.task.process(project_id=self.project_id1,
+                          resource_type='project',
+                          operation_type='deleted')
+
+        self.assertIsNone(project_cache.get(self.project_id1))
+
     @mock.patch.object(consumer.KeystoneEventConsumer, 'handle_error')
     @mock.patch.object(rep.ProjectRepo, 'delete_project_entities',
                        side_effect=exception.BarbicanException)
-    def test_rollback_with_error_during_project_cleanup(self, mock_delete,
-                                                        mock_handle_error):
+    def test_project_kept_with_error_during_project_cleanup(
+            self, mock_delete, mock_handle_error):
         self._init_memory_db_setup()
 
         secret = self._create_secret_for_project(self.project1_data)
@@ -326,17 +341,17 @@ class WhenUsingKeystoneEventConsumerProcessMethod(
         self.assertEqual(self.project_id1, kwargs['project_id'])
         self.assertEqual('project', kwargs['resource_type'])
         self.assertEqual('deleted', kwargs['operation_type'])
-        # Make sure entities are still present after rollback
-        db_secrets = self.repos.secret_repo.get_project_entities(project1_id)
-        self.assertEqual(1, len(db_secrets))
-        self.assertEqual(secret_id, db_secrets[0].id)
-
-        db_project_secret = (
-            self.repos.project_secret_repo.get_project_entities(project1_id))
-        self.assertEqual(1, len(db_project_secret))
+        # Entities are deleted in committed batches, so those deleted before
+        # the error stay deleted.
+        ex = self.assertRaises(exception.NotFound, self.repos.secret_repo.get,
+                               entity_id=secret_id,
+                               external_project_id=self.project_id1)
+        self.assertIn(secret_id, str(ex))
 
         db_kek = self.repos.kek_repo.get_project_entities(project1_id)
-        self.assertEqual(1, len(db_kek))
+        self.assertEqual(0, len(db_kek))
 
+        # The project is deleted last, so it is still present for the
+        # cleanup to be retried.
         db_project = self.repos.project_repo.get_project_entities(project1_id)
         self.assertEqual(1, len(db_project))
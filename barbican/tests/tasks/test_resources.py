@@ -11,12 +11,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+
 import mock
+import sqlalchemy
 
+from barbican.common import resources as c_resources
 from barbican import i18n as u
 from barbican.model import models
+from barbican.model import repositories as rep
 from barbican.openstack.common import timeutils
+from barbican.plugin.crypto import manager
 from barbican.tasks import resources
+from barbican.tests import database_utils
 from barbican.tests import utils
 
 
@@ -332,3 +339,88 @@ class WhenBeginningAsymmetricTypeOrder(BaseOrderTestCase):
             self.order.id,
             self.external_project_id,
         )
+
+
+class WhenCountingOrderRoundTrips(database_utils.RepositoryTestCase):
+    """Benchmarks the database round trips made to process orders.
+
+    Orders are processed end to end against the in-memory database, with
+    and without deferring the flushes of the entities they create.
+    """
+
+    def setUp(self):
+        super(WhenCountingOrderRoundTrips, self).setUp()
+
+        # Force a refresh of the singleton plugin manager for each test.
+        manager._PLUGIN_MANAGER = None
+        manager.CONF.set_override('enabled_crypto_plugins',
+                                  'simple_crypto', group='crypto')
+        self.addCleanup(manager.CONF.clear_override,
+                        'enabled_crypto_plugins', group='crypto')
+
+        self.repos = rep.Repositories(
+            project_repo=None, project_secret_repo=None, secret_repo=None,
+            datum_repo=None, kek_repo=None, secret_meta_repo=None,
+            order_repo=None, order_plugin_meta_repo=None,
+            transport_key_repo=None, container_repo=None,
+            container_secret_repo=None)
+        self.project = c_resources.get_or_create_project(
+            'keystone1234', self.repos.project_repo)
+
+    def _count_round_trips(self, order_type, meta):
+        order = models.Order()
+        order.type = order_type
+        order.meta = meta
+        order.project_id = self.project.id
+        self.repos.order_repo.create_from(order)
+        rep.commit()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            statements.append(statement)
+
+        engine = rep.get_engine()
+        sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                                before_cursor_execute)
+        try:
+            resources.BeginTypeOrder().process(order.id,
+                                               self.project.external_id)
+            rep.commit()
+        finally:
+            sqlalchemy.event.remove(engine, 'before_cursor_execute',
+                                    before_cursor_execute)
+
+        self.assertEqual(models.States.ACTIVE, order.status)
+        return len(statements)
+
+    def _count_round_trips_before_and_after(self, order_type, meta):
+        # Process an order first to create and bind the project's KEK, so
+        # that neither measured order counts its creation.
+        self._count_round_trips(order_type, meta)
+
+        with mock.patch.object(rep, 'deferred_flush',
+                               contextlib.contextmanager(lambda: (yield))):
+            before = self._count_round_trips(order_type, meta)
+        after = self._count_round_trips(order_type, meta)
+        return before, after
+
+    def test_key_order(self):
+        before, after = self._count_round_trips_before_and_after(
+            'key', {'algorithm': 'aes', 'bit_length': 256, 'mode': 'cbc',
+                    'payload_content_type': 'application/octet-stream'})
+
+        # The secret's inserts, and those of its association, datum and
+        # metadata, are flushed together.
+        self.assertEqual((11, 9), (before, after))
+
+    def test_asymmetric_order(self):
+        before, after = self._count_round_trips_before_and_after(
+            'asymmetric', {'algorithm': 'rsa', 'bit_length': 1024,
+                           'payload_content_type':
+                           'application/octet-stream'})
+
+        # The two secrets' inserts, and those of their associations, datums,
+        # metadata and container links, are each batched into one round trip.
+        self.assertEqual((20, 11), (before, after))
@@ -7,6 +7,7 @@ import argparse
 sys.path.insert(0, os.getcwd())
 
 from barbican.model.migration import commands
+from barbican.model import repositories
 from barbican.openstack.common import log
 
 
@@ -26,6 +27,8 @@ class DatabaseManager:
         self.add_upgrade_args()
         self.add_history_args()
         self.add_current_args()
+        self.add_purge_args()
+        self.add_backfill_args()
 
     def get_main_parser(self):
         """Create top-level parser and arguments."""
@@ -87,6 +90,39 @@ class DatabaseManager:
                                         'revision.')
         create_parser.set_defaults(func=self.current)
 
+    def add_purge_args(self):
+        """Create 'purge' command parser and arguments."""
+        create_parser = self.subparsers.add_parser(
+            'purge',
+            help='Hard delete entities soft deleted a number of days ago.')
+        create_parser.add_argument('--min-days', '-m', type=int, default=90,
+                                   help='the minimum number of days since '
+                                        'the entities were deleted.')
+        create_parser.add_argument('--batch-size', '-b', type=int,
+                                   default=1000,
+                                   help='the number of rows deleted per '
+                                        'transaction.')
+        create_parser.add_argument('--pause', '-p', type=float, default=0.5,
+                                   help='the seconds to pause between '
+                                        'batches, to limit the load on the '
+                                        'database.')
+        create_parser.set_defaults(func=self.purge)
+
+    def add_backfill_args(self):
+        """Create 'backfill' command parser and arguments."""
+        create_parser = self.subparsers.add_parser(
+            'backfill',
+            help='Move encrypted data stored as base64 text to binary.')
+        create_parser.add_argument('--batch-size', '-b', type=int,
+                                   default=1000,
+                                   help='the number of rows converted per '
+                                        'transaction.')
+        create_parser.add_argument('--pause', '-p', type=float, default=0.5,
+                                   help='the seconds to pause between '
+                                        'batches, to limit the load on the '
+                                        'database.')
+        create_parser.set_defaults(func=self.backfill)
+
     def revision(self, args):
         """Process the 'revision' Alembic command."""
         commands.generate(autogenerate=args.autogenerate,
@@ -107,6 +143,42 @@ class DatabaseManager:
     def current(self, args):
         commands.current(args.verbose, sql_url=args.dburl)
 
+    def _configure_repositories(self, args):
+        """Point the repositories at the database to maintain.
+
+        The maintenance commands only work on an existing schema, so getting
+        the engine must not create or upgrade it as a side effect.
+        """
+        repositories.CONF.set_override('db_auto_create', False)
+        if args.dburl:
+            repositories.CONF.set_override('sql_connection', args.dburl)
+
+    def purge(self, args):
+        """Process the 'purge' command."""
+        self._configure_repositories(args)
+
+        def progress(table_name, count):
+            print('Purged {0} rows from {1}...'.format(count, table_name))
+
+        purged = repositories.purge_deleted(args.min_days,
+                                            batch_size=args.batch_size,
+                                            batch_pause=args.pause,
+                                            progress=progress)
+        for table_name, count in sorted(purged.items()):
+            print('{0}: {1} rows purged'.format(table_name, count))
+
+    def backfill(self, args):
+        """Process the 'backfill' command."""
+        self._configure_repositories(args)
+
+        def progress(count):
+            print('Converted {0} encrypted data...'.format(count))
+
+        converted = repositories.backfill_binary_cypher_text(
+            batch_size=args.batch_size, batch_pause=args.pause,
+            progress=progress)
+        print('{0} encrypted data converted'.format(converted))
+
     def execute(self):
         """Parse the command line arguments."""
         args = self.parser.parse_args()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the throughput of the PKCS#11 crypto plugin against an HSM.
+
+For each payload size, reports the encrypt and decrypt throughput of the
+plugin, along with the average time per operation. SoftHSM does not
+support the vendor GCM mechanism of the plugin, so the standard CKM_AES_GCM
+mechanism is used unless --vendor-gcm is given. Run from the root of the
+repository, for instance against a SoftHSM token:
+
+    python tools/p11_crypto_benchmark.py \\
+        --library /usr/lib/softhsm/libsofthsm2.so --pin 1234 --slot 0
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import mock  # noqa
+
+from barbican.plugin.crypto import crypto as c  # noqa
+from barbican.plugin.crypto import p11_crypto  # noqa
+
+
+CKM_AES_GCM = 0x1087
+PAYLOAD_SIZES = [32, 1024, 16384]
+
+
+def _time(func, iterations):
+    start = time.time()
+    for i in range(iterations):
+        func()
+    return time.time() - start
+
+
+def _configure(args):
+    for name, value in (('library_path', args.library),
+                        ('login', args.pin),
+                        ('slot_id', args.slot),
+                        ('mkek_label', 'benchmark_mkek'),
+                        ('hmac_label', 'benchmark_hmac')):
+        p11_crypto.CONF.set_override(name, value, group='p11_crypto_plugin')
+
+
+def benchmark(plugin, payload_size, iterations):
+    kek_meta_dto = c.KEKMetaDTO(mock.MagicMock())
+    kek_meta_dto.kek_label = 'benchmark_kek'
+    kek_meta_dto.plugin_meta = None
+    kek_meta_dto = plugin.bind_kek_metadata(kek_meta_dto)
+
+    encrypt_dto = c.EncryptDTO(os.urandom(payload_size))
+    response_dto = plugin.encrypt(encrypt_dto, kek_meta_dto, None)
+    decrypt_dto = c.DecryptDTO(response_dto.cypher_text)
+
+    encrypt_time = _time(
+        lambda: plugin.encrypt(encrypt_dto, kek_meta_dto, None),
+        iterations)
+    decrypt_time = _time(
+        lambda: plugin.decrypt(decrypt_dto, kek_meta_dto,
+                               response_dto.kek_meta_extended, None),
+        iterations)
+
+    return encrypt_time, decrypt_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--library', '-l', required=True,
+                        help='Path to the PKCS#11 library of the HSM.')
+    parser.add_argument('--pin', '-p', required=True,
+                        help='User PIN of the token.')
+    parser.add_argument('--slot', '-s', type=int, default=0,
+                        help='Slot ID of the token.')
+    parser.add_argument('--vendor-gcm', action='store_true',
+                        help='Use the vendor GCM mechanism of the plugin.')
+    parser.add_argument('--iterations', '-i', type=int, default=2000,
+                        help='Operations timed per payload size.')
+    args = parser.parse_args()
+
+    _configure(args)
+    plugin = p11_crypto.P11CryptoPlugin()
+    if not args.vendor_gcm:
+        plugin.algorithm = CKM_AES_GCM
+
+    print('{0:>8} {1:>12} {2:>12} {3:>14} {4:>14}'.format(
+        'payload', 'encrypt/s', 'decrypt/s', 'us/encrypt', 'us/decrypt'))
+    for payload_size in PAYLOAD_SIZES:
+        encrypt_time, decrypt_time = benchmark(
+            plugin, payload_size, args.iterations)
+        print('{0:>8} {1:>12.0f} {2:>12.0f} {3:>14.1f} {4:>14.1f}'.format(
+            payload_size,
+            args.iterations / encrypt_time,
+            args.iterations / decrypt_time,
+            encrypt_time * 1e6 / args.iterations,
+            decrypt_time * 1e6 / args.iterations))
+
+
+if __name__ == '__main__':
+    main()
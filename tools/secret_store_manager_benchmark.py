@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the cost of getting secret store plugins for each request.
+
+Compares creating a new secret store plugin manager for each request, as
+was done before, with using the singleton manager, for the plugins
+enabled in the configuration. Each request gets a store and a generate
+plugin. Run from the root of the repository, with Barbican installed so
+that its plugins are found:
+
+    python tools/secret_store_manager_benchmark.py --config-file \\
+        etc/barbican/barbican-api.conf
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from barbican.plugin.interface import secret_store  # noqa
+
+
+KEY_SPEC = secret_store.KeySpec(secret_store.KeyAlgorithm.AES, 256, 'CBC')
+
+
+def _request(plugin_manager):
+    plugin_manager.get_plugin_store(KEY_SPEC)
+    plugin_manager.get_plugin_generate(KEY_SPEC)
+
+
+def _time(func, iterations):
+    start = time.time()
+    for i in range(iterations):
+        func()
+    return (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--config-file', default=None,
+                        help='Barbican configuration file to load.')
+    parser.add_argument('--iterations', '-i', type=int, default=200,
+                        help='Requests timed per way of getting plugins.')
+    args = parser.parse_args()
+
+    config_files = [args.config_file] if args.config_file else []
+    secret_store.CONF(args=[], project='barbican',
+                      default_config_files=config_files)
+
+    per_request = _time(
+        lambda: _request(secret_store.SecretStorePluginManager()),
+        args.iterations)
+    singleton = _time(
+        lambda: _request(secret_store.get_manager()),
+        args.iterations)
+
+    print('Plugins: {0}'.format(', '.join(
+        secret_store.get_manager().names())))
+    print('{0:<22} {1:>14}'.format('manager', 'us/request'))
+    print('{0:<22} {1:>14.1f}'.format('created per request',
+                                      per_request * 1e6))
+    print('{0:<22} {1:>14.1f}'.format('singleton', singleton * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the encryption modes of the simple crypto plugin.
+
+For each mode and payload size, reports the encrypt and decrypt throughput
+of the plugin, and the size of the ciphertext as stored by Barbican (that
+is, base64 encoded). Run from the root of the repository:
+
+    python tools/simple_crypto_benchmark.py --iterations 10000
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import mock  # noqa
+
+from barbican.plugin.crypto import crypto as c  # noqa
+from barbican.plugin.crypto import simple_crypto as simple  # noqa
+
+
+MODES = ['fernet', 'aes-256-gcm']
+PAYLOAD_SIZES = [32, 1024, 16384]
+
+
+def _time(func, iterations):
+    start = time.time()
+    for i in range(iterations):
+        func()
+    return iterations / (time.time() - start)
+
+
+def benchmark(mode, payload_size, iterations):
+    simple.CONF.set_override('encryption_mode', mode,
+                             group='simple_crypto_plugin')
+    plugin = simple.SimpleCryptoPlugin()
+
+    kek_meta_dto = c.KEKMetaDTO(mock.MagicMock())
+    kek_meta_dto.plugin_meta = None
+    kek_meta_dto = plugin.bind_kek_metadata(kek_meta_dto)
+
+    encrypt_dto = c.EncryptDTO(os.urandom(payload_size))
+    response_dto = plugin.encrypt(encrypt_dto, kek_meta_dto, None)
+    decrypt_dto = c.DecryptDTO(response_dto.cypher_text)
+
+    encrypts = _time(
+        lambda: plugin.encrypt(encrypt_dto, kek_meta_dto, None),
+        iterations)
+    decrypts = _time(
+        lambda: plugin.decrypt(decrypt_dto, kek_meta_dto,
+                               response_dto.kek_meta_extended, None),
+        iterations)
+    stored_size = len(base64.b64encode(response_dto.cypher_text))
+
+    return encrypts, decrypts, stored_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', '-i', type=int, default=5000,
+                        help='Operations timed per mode and payload size.')
+    args = parser.parse_args()
+
+    print('{0:<12} {1:>8} {2:>12} {3:>12} {4:>12}'.format(
+        'mode', 'payload', 'encrypt/s', 'decrypt/s', 'stored size'))
+    for payload_size in PAYLOAD_SIZES:
+        for mode in MODES:
+            encrypts, decrypts, stored_size = benchmark(
+                mode, payload_size, args.iterations)
+            print('{0:<12} {1:>8} {2:>12.0f} {3:>12.0f} {4:>12}'.format(
+                mode, payload_size, encrypts, decrypts, stored_size))
+
+
+if __name__ == '__main__':
+    main()